@@ -18,6 +18,7 @@ class TransacaoExtraida(BaseModel):
 
     banco_origem: str
     arquivo_nome: str
+    user_id: Optional[str] = None
 
     categoria: Optional[str] = None
     is_duplicada: bool = False
@@ -0,0 +1,14 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import uuid
+
+
+class Meta(BaseModel):
+    """Orçamento mensal de uma categoria de gastos"""
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    categoria: str
+    valor_limite: float  # por mês
+    limiares: List[float] = Field(default_factory=lambda: [0.8, 1.0])  # frações do limite que geram eventos
+    ativo: bool = True
+    user_id: Optional[str] = None
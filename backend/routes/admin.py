@@ -6,6 +6,8 @@ from fastapi import APIRouter, Header, HTTPException, status
 from pydantic import BaseModel
 
 from server import db
+from utils.metas import invalidar_metas
+from utils.saldos import invalidar_saldos
 
 admin_router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -57,7 +59,14 @@ async def reset_data(
     if payload.reset_metas and "metas" in await db.list_collection_names():
         delete_res = await db.metas.delete_many({})
         result["metas_apagadas"] = delete_res.deleted_count
+        await db.metas_eventos.delete_many({})
+        invalidar_metas()
+
+    if payload.reset_lancamentos:
+        # contadores de consumo das metas e saldos diários derivam dos lançamentos
+        await db.metas_consumo.delete_many({})
+        await db.saldos_diarios.delete_many({})
+        invalidar_saldos()
 
     return {"status": "ok", "detalhes": result}
-*** End Patch】}"""
 
@@ -1,34 +1,61 @@
 from __future__ import annotations
 
+import asyncio
+
 from fastapi import APIRouter, HTTPException, Response
 from typing import List, Optional
 from models.cartao import CartaoCredito, FaturaCartao
 from server import db
+from utils.faturas import (
+    ALERTAS_JANELA_DIAS,
+    ciclo_atual,
+    data_vencimento_ciclo,
+    fatura_id,
+    aplicar_limites,
+    invalidar_projecoes,
+    lancamentos_do_ciclo,
+    pipeline_lancamentos_ciclos,
+    limites_usados,
+    projetar_faturas_futuras,
+    recalcular_faturas,
+    verificar_faturas,
+)
+from utils.exportacao import TIPOS_MIDIA, resposta_exportacao
+from utils.fixos import mes_para_indice
+from utils.medicao import Cronometro
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
-from collections import defaultdict
-import csv
-import io
 
 cartao_router = APIRouter(prefix="/api/cartao", tags=["cartao"])
 
+COLUNAS_FATURA = [
+    ("data", "Data"),
+    ("descricao", "Descrição"),
+    ("categoria", "Categoria"),
+    ("valor", "Valor"),
+    ("parcela", "Parcela"),
+]
+
 
 @cartao_router.get("", response_model=List[dict])
 async def listar_cartoes():
-    """Lista todos os cartões de crédito"""
+    """
+    Lista todos os cartões de crédito, com o limite usado calculado no servidor
+    a partir das faturas em aberto (um resumo em cache para todos os cartões).
+    """
+    resumo = await limites_usados()
     cursor = db.cartoes.find({})
     cartoes = []
     async for doc in cursor:
         doc["_id"] = str(doc["_id"])
-        cartoes.append(doc)
+        cartoes.append(aplicar_limites(doc, resumo))
     return cartoes
 
 
 @cartao_router.post("", response_model=dict)
 async def criar_cartao(cartao: CartaoCredito):
     """Cria um novo cartão de crédito"""
-    cartao.limite_disponivel = cartao.limite_total - cartao.limite_usado
-    doc = cartao.model_dump()
+    doc = aplicar_limites(cartao.model_dump(), await limites_usados())
     await db.cartoes.insert_one(doc)
     doc["_id"] = str(doc.get("_id", ""))
     return doc
@@ -37,11 +64,12 @@ async def criar_cartao(cartao: CartaoCredito):
 @cartao_router.put("/{cartao_id}", response_model=dict)
 async def atualizar_cartao(cartao_id: str, cartao: CartaoCredito):
     """Atualiza um cartão de crédito"""
-    cartao.limite_disponivel = cartao.limite_total - cartao.limite_usado
-    doc = cartao.model_dump()
+    cartao.id = cartao_id
+    doc = aplicar_limites(cartao.model_dump(), await limites_usados())
     result = await db.cartoes.update_one({"id": cartao_id}, {"$set": doc})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cartão não encontrado")
+    invalidar_projecoes([cartao_id])
     doc["_id"] = cartao_id
     return doc
 
@@ -64,283 +92,252 @@ async def listar_faturas(cartao_id: str, mes: Optional[str] = None):
 @cartao_router.post("/{cartao_id}/calcular-fatura")
 async def calcular_fatura_atual(cartao_id: str, mes: Optional[str] = None):
     """
-    Calcula a fatura atual do cartão baseado nos lançamentos do mês.
-    Se não passar o mês, usa o mês atual.
+    Recalcula as faturas do cartão pelos ciclos de fechamento/vencimento e
+    retorna a do mês de referência pedido (padrão: ciclo aberto hoje).
     """
+    cartao = await db.cartoes.find_one({"id": cartao_id})
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+
     if not mes:
-        mes = datetime.now().strftime("%Y-%m")
-    
-    # Buscar lançamentos do cartão no mês
-    cursor = db.lancamentos.find({
-        "forma": "credito",
-        "data": {"$regex": f"^{mes}"},
-        "tipo": "saida",
-    })
-    
-    lancamentos = [doc async for doc in cursor]
-    valor_total = sum(float(l.get("valor", 0)) for l in lancamentos)
-    lancamentos_ids = [l.get("id") for l in lancamentos]
-    
-    # Buscar ou criar fatura
-    fatura_existente = await db.faturas.find_one({
-        "cartao_id": cartao_id,
-        "mes_referencia": mes,
-    })
-    
-    if fatura_existente:
-        await db.faturas.update_one(
-            {"_id": fatura_existente["_id"]},
-            {"$set": {
-                "valor_total": valor_total,
-                "lancamentos_ids": lancamentos_ids,
-            }}
-        )
-        fatura_existente["valor_total"] = valor_total
-        fatura_existente["lancamentos_ids"] = lancamentos_ids
-        fatura_existente["_id"] = str(fatura_existente["_id"])
-        return fatura_existente
-    else:
-        # Buscar cartão para pegar dia de vencimento
-        cartao = await db.cartoes.find_one({"id": cartao_id})
-        if not cartao:
-            raise HTTPException(status_code=404, detail="Cartão não encontrado")
-        
-        dia_venc = cartao.get("dia_vencimento", 12)
-        ano, mes_num = mes.split("-")
-        data_venc = datetime(int(ano), int(mes_num), min(dia_venc, 28))
-        data_venc += relativedelta(months=1)  # Vencimento é no mês seguinte
-        
-        nova_fatura = {
-            "id": f"{cartao_id}_{mes}",
-            "cartao_id": cartao_id,
-            "mes_referencia": mes,
-            "valor_total": valor_total,
-            "valor_pago": 0.0,
-            "data_vencimento": data_venc.strftime("%Y-%m-%d"),
-            "status": "aberta",
-            "lancamentos_ids": lancamentos_ids,
-            "criado_em": datetime.utcnow(),
-        }
-        
-        await db.faturas.insert_one(nova_fatura)
-        nova_fatura["_id"] = str(nova_fatura.get("_id", ""))
-        return nova_fatura
+        mes = ciclo_atual(cartao)
+
+    await recalcular_faturas(cartao)
+
+    # Garante a fatura do mês mesmo sem lançamentos no ciclo
+    fatura = await db.faturas.find_one_and_update(
+        {"cartao_id": cartao_id, "mes_referencia": mes},
+        {
+            "$setOnInsert": {
+                "id": fatura_id(cartao_id, mes),
+                "valor_total": 0.0,
+                "valor_pago": 0.0,
+                "data_vencimento": data_vencimento_ciclo(mes, cartao),
+                "status": "aberta",
+                "lancamentos_ids": [],
+                "criado_em": datetime.utcnow(),
+            }
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    fatura["_id"] = str(fatura["_id"])
+    return fatura
+
+
+@cartao_router.post("/{cartao_id}/recalcular-faturas", response_model=List[dict])
+async def recalcular_historico_faturas(cartao_id: str):
+    """
+    Recalcula todo o histórico de faturas do cartão de uma vez
+    (uma agregação + um bulk_write) e retorna as faturas atualizadas.
+    """
+    cartao = await db.cartoes.find_one({"id": cartao_id})
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+
+    await recalcular_faturas(cartao)
+    return await listar_faturas(cartao_id)
+
+
+@cartao_router.get("/{cartao_id}/verificar-faturas")
+async def verificar_consistencia_faturas(cartao_id: str, corrigir: bool = False):
+    """
+    Confere as faturas mantidas incrementalmente contra um recálculo dos
+    lançamentos; com `corrigir=true`, reconstrói as divergentes.
+    """
+    cartao = await db.cartoes.find_one({"id": cartao_id})
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+    return await verificar_faturas(cartao, corrigir)
 
 
 @cartao_router.get("/alertas/vencimento")
-async def alertas_vencimento(dias_antes: int = 7):
+async def alertas_vencimento(dias_antes: int = 7, user_id: Optional[str] = None):
     """
-    Retorna faturas que vencem nos próximos N dias (padrão: 7 dias)
+    Retorna faturas que vencem nos próximos N dias (padrão: 7 dias) e as vencidas.
+    Lê os alertas pré-calculados pelo agendador (`alertas`); se ainda não
+    existirem ou a janela pedida for maior que a pré-calculada, consulta `faturas`.
     """
     hoje = datetime.now().date()
     limite = hoje + timedelta(days=dias_antes)
-    
-    cursor = db.faturas.find({
-        "status": "aberta",
-        "data_vencimento": {
-            "$gte": hoje.strftime("%Y-%m-%d"),
-            "$lte": limite.strftime("%Y-%m-%d"),
-        }
-    })
-    
-    alertas = []
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"])
-        alertas.append(doc)
-    
-    return {"alertas": alertas, "total": len(alertas)}
+    hoje_str = hoje.strftime("%Y-%m-%d")
+    limite_str = limite.strftime("%Y-%m-%d")
+
+    filtro_alertas = {"user_id": user_id} if user_id else {}
+    docs = await db.alertas.find(filtro_alertas, {"_id": 0, "faturas": 1}).to_list(length=None)
+
+    if docs and dias_antes <= ALERTAS_JANELA_DIAS:
+        faturas = [f for doc in docs for f in doc.get("faturas", [])]
+    else:
+        filtro = {"status": {"$in": ["aberta", "vencida"]}, "data_vencimento": {"$lte": limite_str}}
+        if user_id:
+            # só as faturas dos cartões do usuário
+            filtro["cartao_id"] = {"$in": await db.cartoes.distinct("id", {"user_id": user_id})}
+        cursor = db.faturas.find(filtro, {"_id": 0})
+        faturas = [doc async for doc in cursor]
+
+    alertas = [
+        f for f in faturas
+        if f.get("status") == "aberta" and hoje_str <= f.get("data_vencimento", "") <= limite_str
+    ]
+    vencidas = [f for f in faturas if f.get("status") == "vencida"]
+
+    return {"alertas": alertas, "total": len(alertas), "vencidas": vencidas}
 
 
 @cartao_router.get("/{cartao_id}/faturas-futuras")
-async def calcular_faturas_futuras(cartao_id: str, meses_ahead: int = 6):
+async def calcular_faturas_futuras(cartao_id: str, meses_ahead: int = 6, resumido: bool = False):
     """
     Calcula faturas futuras baseadas nas parcelas pendentes.
-    Agrupa parcelas por mês de vencimento.
+    Agrupa parcelas por ciclo de fatura numa agregação no Mongo.
+    Com `resumido=true` retorna só totais/quantidades; os itens de cada mês
+    ficam em /faturas-futuras/{mes_referencia}/lancamentos.
     """
-    hoje = datetime.now()
-    
-    # Buscar todas as parcelas futuras (origem = "parcela_futura" ou data futura)
-    data_hoje_str = hoje.strftime("%Y-%m-%d")
-    
-    cursor = db.lancamentos.find({
-        "forma": "credito",
-        "tipo": "saida",
-        "data": {"$gte": data_hoje_str},
-        "$or": [
-            {"origem": "parcela_futura"},
-            {"parcelas_total": {"$exists": True, "$gt": 1}},
-        ]
-    })
-    
-    lancamentos = [doc async for doc in cursor]
-    
-    # Agrupar por mês de vencimento
-    faturas_futuras = defaultdict(lambda: {
-        "lancamentos": [],
-        "valor_total": 0.0,
-        "mes_referencia": None,
-        "data_vencimento": None,
-    })
-    
-    # Buscar cartão para pegar dia de vencimento
     cartao = await db.cartoes.find_one({"id": cartao_id})
     if not cartao:
         raise HTTPException(status_code=404, detail="Cartão não encontrado")
-    
-    dia_venc = cartao.get("dia_vencimento", 12)
-    
-    for lanc in lancamentos:
-        data_lanc = datetime.strptime(lanc.get("data"), "%Y-%m-%d")
-        mes_ref = data_lanc.strftime("%Y-%m")
-        
-        # Calcular data de vencimento (mês seguinte ao da compra)
-        ano, mes_num = mes_ref.split("-")
-        data_venc = datetime(int(ano), int(mes_num), min(dia_venc, 28))
-        data_venc += relativedelta(months=1)
-        
-        # Limitar a N meses à frente
-        if data_venc > hoje + relativedelta(months=meses_ahead):
-            continue
-        
-        valor = float(lanc.get("valor", 0))
-        faturas_futuras[mes_ref]["lancamentos"].append(lanc)
-        faturas_futuras[mes_ref]["valor_total"] += valor
-        faturas_futuras[mes_ref]["mes_referencia"] = mes_ref
-        faturas_futuras[mes_ref]["data_vencimento"] = data_venc.strftime("%Y-%m-%d")
-    
-    # Converter para lista e ordenar por mês
-    resultado = []
-    for mes_ref in sorted(faturas_futuras.keys()):
-        fatura = faturas_futuras[mes_ref]
-        resultado.append({
-            "id": f"{cartao_id}_{mes_ref}_futura",
-            "cartao_id": cartao_id,
-            "mes_referencia": fatura["mes_referencia"],
-            "valor_total": fatura["valor_total"],
-            "data_vencimento": fatura["data_vencimento"],
-            "status": "futura",
-            "lancamentos": fatura["lancamentos"],
-            "lancamentos_ids": [l.get("id") for l in fatura["lancamentos"]],
-        })
-    
+
+    resultado = await projetar_faturas_futuras(cartao, meses_ahead, resumido)
     return {"faturas_futuras": resultado, "total": len(resultado)}
 
 
+@cartao_router.get("/{cartao_id}/faturas-futuras/{mes_referencia}/lancamentos", response_model=List[dict])
+async def listar_lancamentos_fatura_futura(cartao_id: str, mes_referencia: str):
+    """Lançamentos (parcelas) de uma fatura futura, sob demanda."""
+    cartao = await db.cartoes.find_one({"id": cartao_id})
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+    return await lancamentos_do_ciclo(cartao, mes_referencia)
+
+
 @cartao_router.get("/{cartao_id}/faturas-completas")
-async def listar_faturas_completas(cartao_id: str, incluir_futuras: bool = True):
+async def listar_faturas_completas(cartao_id: str, response: Response, incluir_futuras: bool = True):
     """
     Lista todas as faturas (passadas, atuais e futuras) de um cartão.
+    As faturas existentes e a projeção (cartão + parcelas) são consultadas em
+    paralelo; as durações vão no cabeçalho Server-Timing.
     """
-    # Faturas existentes (passadas e atuais)
-    cursor = db.faturas.find({"cartao_id": cartao_id}).sort("mes_referencia", -1)
-    faturas_existentes = []
-    async for doc in cursor:
-        doc["_id"] = str(doc["_id"])
-        doc["status"] = doc.get("status", "aberta")
-        faturas_existentes.append(doc)
-    
-    resultado = faturas_existentes.copy()
-    
-    # Adicionar faturas futuras se solicitado
+    cron = Cronometro("faturas-completas")
+
+    async def faturas_existentes() -> List[dict]:
+        cursor = db.faturas.find({"cartao_id": cartao_id}).sort("mes_referencia", -1)
+        faturas = []
+        async for doc in cursor:
+            doc["_id"] = str(doc["_id"])
+            doc["status"] = doc.get("status", "aberta")
+            faturas.append(doc)
+        return faturas
+
+    async def faturas_futuras() -> List[dict]:
+        cartao = await cron.medir("cartao", db.cartoes.find_one({"id": cartao_id}))
+        if not cartao:
+            return []  # Se cartão não existe, ignora
+        return await cron.medir("projecao", projetar_faturas_futuras(cartao, 6, resumido=True))
+
+    consultas = [cron.medir("faturas", faturas_existentes())]
     if incluir_futuras:
-        try:
-            futuras_data = await calcular_faturas_futuras(cartao_id, 6)
-            resultado.extend(futuras_data["faturas_futuras"])
-            # Ordenar por mês (mais recente primeiro)
-            resultado.sort(key=lambda x: x.get("mes_referencia", ""), reverse=True)
-        except HTTPException:
-            pass  # Se cartão não existe, ignora
-    
+        consultas.append(faturas_futuras())
+    resultados = await asyncio.gather(*consultas)
+
+    resultado = [fatura for parte in resultados for fatura in parte]
+    if incluir_futuras:
+        # Ordenar por mês (mais recente primeiro)
+        resultado.sort(key=lambda x: x.get("mes_referencia", ""), reverse=True)
+
+    cron.registrar(response)
     return resultado
 
 
 @cartao_router.get("/{cartao_id}/exportar-fatura/{mes_referencia}")
-async def exportar_fatura_csv(cartao_id: str, mes_referencia: str):
+async def exportar_fatura_csv(cartao_id: str, mes_referencia: str, formato: str = "csv"):
     """
-    Exporta uma fatura (passada ou futura) como CSV.
+    Exporta uma fatura (passada ou futura) como CSV ou XLSX, em streaming.
+    Fatura existente: todos os lançamentos do ciclo; futura: as parcelas pendentes.
     """
-    # Verificar se é fatura existente
-    fatura_existente = await db.faturas.find_one({
-        "cartao_id": cartao_id,
-        "mes_referencia": mes_referencia,
-    })
-    
-    lancamentos = []
-    valor_total = 0.0
-    data_vencimento = ""
-    status = "aberta"
-    
-    if fatura_existente:
-        # Fatura existente
-        lancamentos_ids = fatura_existente.get("lancamentos_ids", [])
-        cursor = db.lancamentos.find({"id": {"$in": lancamentos_ids}})
-        lancamentos = [doc async for doc in cursor]
+    if formato not in TIPOS_MIDIA:
+        raise HTTPException(status_code=400, detail="Formato deve ser 'csv' ou 'xlsx'")
+
+    cron = Cronometro("exportar-fatura")
+    # Cartão e fatura existente são independentes
+    cartao, fatura_existente = await asyncio.gather(
+        cron.medir("cartao", db.cartoes.find_one({"id": cartao_id})),
+        cron.medir(
+            "fatura",
+            db.faturas.find_one({"cartao_id": cartao_id, "mes_referencia": mes_referencia}),
+        ),
+    )
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+
+    if fatura_existente and fatura_existente.get("lancamentos_ids"):
         valor_total = fatura_existente.get("valor_total", 0.0)
         data_vencimento = fatura_existente.get("data_vencimento", "")
         status = fatura_existente.get("status", "aberta")
+        apenas_futuras = False
     else:
-        # Fatura futura - buscar parcelas do mês
-        cursor = db.lancamentos.find({
-            "forma": "credito",
-            "tipo": "saida",
-            "data": {"$regex": f"^{mes_referencia}"},
-            "$or": [
-                {"origem": "parcela_futura"},
-                {"parcelas_total": {"$exists": True}},
-            ]
-        })
-        lancamentos = [doc async for doc in cursor]
-        valor_total = sum(float(l.get("valor", 0)) for l in lancamentos)
-        
-        # Calcular data de vencimento
-        cartao = await db.cartoes.find_one({"id": cartao_id})
-        if cartao:
-            dia_venc = cartao.get("dia_vencimento", 12)
-            ano, mes_num = mes_referencia.split("-")
-            data_venc = datetime(int(ano), int(mes_num), min(dia_venc, 28))
-            data_venc += relativedelta(months=1)
-            data_vencimento = data_venc.strftime("%Y-%m-%d")
+        futuras = await cron.medir(
+            "projecao", projetar_faturas_futuras(cartao, meses_ahead=120, resumido=True)
+        )
+        fatura_futura = next((f for f in futuras if f["mes_referencia"] == mes_referencia), None)
+        if not fatura_futura:
+            raise HTTPException(status_code=404, detail="Fatura não encontrada ou sem lançamentos")
+        valor_total = fatura_futura["valor_total"]
+        data_vencimento = fatura_futura["data_vencimento"]
         status = "futura"
-    
-    if not lancamentos:
-        raise HTTPException(status_code=404, detail="Fatura não encontrada ou sem lançamentos")
-    
-    # Criar CSV
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=';')
-    
-    # Cabeçalho
-    writer.writerow(["FATURA DO CARTÃO DE CRÉDITO"])
-    writer.writerow([f"Mês de Referência: {mes_referencia}"])
-    writer.writerow([f"Data de Vencimento: {data_vencimento}"])
-    writer.writerow([f"Status: {status.upper()}"])
-    writer.writerow([f"Valor Total: R$ {valor_total:.2f}"])
-    writer.writerow([])
-    writer.writerow(["Data", "Descrição", "Categoria", "Valor", "Parcela"])
-    
-    # Lançamentos
-    for lanc in sorted(lancamentos, key=lambda x: x.get("data", "")):
-        data = lanc.get("data", "")
-        descricao = lanc.get("descricao", "")
-        categoria = lanc.get("categoria", "")
-        valor = lanc.get("valor", 0)
-        parcela = ""
-        if lanc.get("parcelas_total"):
-            parcela_atual = lanc.get("parcela_atual", 1)
-            parcela_total = lanc.get("parcelas_total", 1)
-            parcela = f"{parcela_atual}/{parcela_total}"
-        
-        writer.writerow([data, descricao, categoria, f"R$ {valor:.2f}", parcela])
-    
-    csv_content = output.getvalue()
-    output.close()
-    
-    # Retornar como download
-    return Response(
-        content=csv_content,
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f'attachment; filename="fatura_{cartao_id}_{mes_referencia}.csv"'
-        }
+        apenas_futuras = True
+
+    pipeline = await cron.medir(
+        "filtro", pipeline_lancamentos_ciclos(cartao, mes_referencia, mes_referencia, apenas_futuras)
+    )
+    cursor = db.lancamentos.aggregate(pipeline, allowDiskUse=True)
+
+    cabecalho = [
+        ["FATURA DO CARTÃO DE CRÉDITO"],
+        [f"Mês de Referência: {mes_referencia}"],
+        [f"Data de Vencimento: {data_vencimento}"],
+        [f"Status: {status.upper()}"],
+        [f"Valor Total: R$ {valor_total:.2f}"],
+        [],
+    ]
+    resposta = resposta_exportacao(
+        formato,
+        f"fatura_{cartao_id}_{mes_referencia}",
+        cursor,
+        cabecalho,
+        COLUNAS_FATURA,
     )
+    cron.registrar(resposta)
+    return resposta
 
+
+@cartao_router.get("/{cartao_id}/exportar-faturas")
+async def exportar_faturas_periodo(cartao_id: str, de: str, ate: str, formato: str = "csv"):
+    """
+    Exporta as faturas de vários meses (`de`..`ate`, YYYY-MM) num único arquivo,
+    com a coluna da fatura de cada lançamento, em streaming.
+    """
+    if formato not in TIPOS_MIDIA:
+        raise HTTPException(status_code=400, detail="Formato deve ser 'csv' ou 'xlsx'")
+    try:
+        if mes_para_indice(ate) < mes_para_indice(de):
+            raise HTTPException(status_code=400, detail="'ate' deve ser igual ou posterior a 'de'")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Meses devem estar no formato YYYY-MM")
+    cartao = await db.cartoes.find_one({"id": cartao_id})
+    if not cartao:
+        raise HTTPException(status_code=404, detail="Cartão não encontrado")
+
+    pipeline = await pipeline_lancamentos_ciclos(cartao, de, ate)
+    cursor = db.lancamentos.aggregate(pipeline, allowDiskUse=True)
+    cabecalho = [
+        [f"FATURAS DO CARTÃO {cartao.get('nome', cartao_id)}"],
+        [f"Período: {de} a {ate}"],
+        [],
+    ]
+    return resposta_exportacao(
+        formato,
+        f"faturas_{cartao_id}_{de}_{ate}",
+        cursor,
+        cabecalho,
+        [("mes_referencia", "Fatura")] + COLUNAS_FATURA,
+    )
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
-from fastapi import APIRouter
-from typing import Dict, List
+from fastapi import APIRouter, HTTPException
+from typing import Dict, List, Optional
 from server import db
+from utils.fixos import indice_para_mes, mes_para_indice
+from utils.parcelamento import parcelas_virtuais
+from utils.pivot import pivot_lancamentos
 from collections import defaultdict
+from datetime import datetime
 
 estatisticas_router = APIRouter(prefix="/api/estatisticas", tags=["estatisticas"])
 
@@ -28,9 +32,10 @@ async def get_estatisticas_dashboard(
     elif periodo_ano:
         filtro_data["data"] = {"$regex": f"^{periodo_ano}"}
     
-    # Buscar lançamentos
+    # Buscar lançamentos (mais as parcelas futuras dos planos de parcelamento do período)
     cursor = db.lancamentos.find(filtro_data)
     lancamentos = [doc async for doc in cursor]
+    lancamentos += await parcelas_virtuais(periodo_mes or periodo_ano or "")
     
     # Gastos por categoria
     gastos_por_categoria: Dict[str, float] = defaultdict(float)
@@ -90,3 +95,23 @@ async def get_estatisticas_dashboard(
         },
     }
 
+
+@estatisticas_router.get("/pivot")
+async def get_pivot(
+    de: Optional[str] = None,  # YYYY-MM
+    ate: Optional[str] = None,  # YYYY-MM (padrão: mês atual)
+    anos: int = 1,  # sem `de`: últimos N anos até `ate`
+    dividir_por: Optional[str] = None,  # 'responsavel' | 'forma'
+    tipo: str = "saida",
+    user_id: Optional[str] = None,
+):
+    """
+    Valor por categoria e mês (opcionalmente dividido por responsável ou forma),
+    em formato colunar: `valores[i][j]` é da linha `linhas[i]` no mês `colunas[j]`.
+    """
+    ate = ate or datetime.now().strftime("%Y-%m")
+    try:
+        de = de or indice_para_mes(mes_para_indice(ate) - 12 * max(anos, 1) + 1)
+        return await pivot_lancamentos(de, ate, dividir_por, tipo, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
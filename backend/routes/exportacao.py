@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from server import db
+from utils.exportacao import TIPOS_MIDIA, resposta_exportacao
+from utils.parcelamento import uniao_parcelas
+
+exportacao_router = APIRouter(prefix="/api/exportar", tags=["exportacao"])
+
+
+@exportacao_router.get("/lancamentos")
+async def exportar_lancamentos(
+    de: Optional[str] = None,
+    ate: Optional[str] = None,
+    cartao_id: Optional[str] = None,
+    categoria: Optional[str] = None,
+    responsavel: Optional[str] = None,
+    user_id: Optional[str] = None,
+    formato: str = "csv",
+):
+    """
+    Exporta lançamentos filtrados (período YYYY-MM-DD, cartão, categoria,
+    responsável) como CSV ou XLSX, lendo do cursor em streaming.
+    """
+    if formato not in TIPOS_MIDIA:
+        raise HTTPException(status_code=400, detail="Formato deve ser 'csv' ou 'xlsx'")
+
+    filtro: dict = {}
+    if de or ate:
+        filtro["data"] = {}
+        if de:
+            filtro["data"]["$gte"] = de
+        if ate:
+            filtro["data"]["$lte"] = ate
+    if cartao_id:
+        filtro["cartao_id"] = cartao_id
+    if categoria:
+        filtro["categoria"] = categoria
+    if responsavel:
+        filtro["responsavel"] = responsavel
+    if user_id:
+        filtro["user_id"] = user_id
+
+    pipeline = [
+        {"$match": filtro},
+        uniao_parcelas(filtro),
+        {"$sort": {"data": 1}},
+        {"$project": {"_id": 0}},
+    ]
+    cursor = db.lancamentos.aggregate(pipeline, allowDiskUse=True, batchSize=1000)
+    nome = f"lancamentos_{de or 'inicio'}_{ate or 'hoje'}"
+    return resposta_exportacao(formato, nome, cursor)
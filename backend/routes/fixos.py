@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from utils.assinaturas import detectar_assinaturas
+from utils.fixos import indice_para_mes, lancar_fixos, mes_para_indice, projetar_fixos
+
+fixos_router = APIRouter(prefix="/api/fixos", tags=["fixos"])
+
+
+@fixos_router.get("/projecao")
+async def projecao_fixos(de: Optional[str] = None, ate: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    Expande os fixos ativos mês a mês (padrão: 12 meses a partir do atual).
+    Retorna a matriz mês × fixo e os totais de entradas, saídas e saldo por mês.
+    """
+    de = de or datetime.now().strftime("%Y-%m")
+    try:
+        ate = ate or indice_para_mes(mes_para_indice(de) + 11)
+        return await projetar_fixos(de, ate, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@fixos_router.post("/lancar")
+async def lancar_fixos_agora():
+    """
+    Executa agora a rotina que grava os lançamentos mensais dos fixos
+    (normalmente rodada pelo agendador). Idempotente.
+    """
+    return await lancar_fixos()
+
+
+@fixos_router.get("/sugestoes")
+async def sugestoes_fixos(user_id: Optional[str] = None, confianca_minima: float = 0.5):
+    """
+    Assinaturas detectadas no histórico de lançamentos que ainda não são fixos.
+    Cada item traz o `fixo` sugerido (pronto para POST /api/fixos) e a confiança.
+    """
+    return await detectar_assinaturas(user_id, confianca_minima)
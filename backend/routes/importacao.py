@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import List
+import logging
+from typing import List, Optional
 
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, BackgroundTasks, UploadFile, File, HTTPException
 
 from models.importacao import TransacaoExtraida, RegraCategorizacao
 from utils.parsers import (
@@ -12,18 +13,47 @@ from utils.parsers import (
     parse_pdf_inter,
 )
 from utils.deduplicacao import verificar_duplicatas
-from utils.categorizacao import aplicar_regras
-from utils.responsavel import detectar_responsavel
+from utils.categorizacao import (
+    RegraInvalida,
+    OrcamentoRegras,
+    aplicar_regras,
+    filtro_mongo_regra,
+    invalidar_cache_regras,
+    validar_padrao,
+)
+from utils.responsavel import registrar_responsavel, sugerir_responsavel
+from utils.faturas import registrar_em_faturas
+from utils.parcelamento import (
+    confirmar_parcelas,
+    criar_plano,
+    expandir_plano,
+    gravar_planos,
+    localizar_parcelas_planejadas,
+    parcela_do_plano,
+)
+from utils.assinaturas import invalidar_assinaturas
+from utils.comerciante import normalizar_comerciante
+from utils.conciliacao import conciliar_pagamentos
+from utils.pivot import invalidar_pivot
+from utils.previsao import invalidar_previsao
+from utils.metas import registrar_em_metas
+from utils.saldos import registrar_em_saldos
+from utils.recategorizacao import categorias_alteradas
+from utils.tarefas import atualizar_progresso, concluir_tarefa, criar_tarefa, falhar_tarefa
 from server import db
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
 
 
 import_router = APIRouter(prefix="/api/importar-extrato", tags=["importacao"])
+logger = logging.getLogger(__name__)
+
+# Aplicação retroativa de regras (aprender-categoria)
+RECATEGORIZACAO_LIMITE_SINCRONO = 5000  # acima disso roda em segundo plano
+RECATEGORIZACAO_LOTE = 1000
+RECATEGORIZACAO_AMOSTRA = 20
 
 
 @import_router.post("", response_model=List[TransacaoExtraida])
-async def upload_extrato(file: UploadFile = File(...)):
+async def upload_extrato(file: UploadFile = File(...), user_id: Optional[str] = None):
     """
     Recebe um arquivo de extrato (PDF/CSV), detecta banco e formata as transações.
     NÃO grava no banco ainda, apenas retorna a prévia com flag de duplicadas.
@@ -50,20 +80,28 @@ async def upload_extrato(file: UploadFile = File(...)):
     else:
         raise HTTPException(status_code=400, detail=f"Tipo de arquivo não suportado: {file.content_type}")
 
+    for t in transacoes:
+        t.user_id = user_id
+
     transacoes = await verificar_duplicatas(transacoes)
 
-    # aplicar sugestão de categoria e responsável quando possível
+    # aplicar sugestão de categoria quando possível (o responsável é sugerido ao processar)
+    orcamento = OrcamentoRegras()
+    sem_orcamento = 0
     for t in transacoes:
-        if not t.is_duplicada:
-            # Categoria
-            if not t.categoria:
-                cat = await aplicar_regras(t)
-                if cat:
-                    t.categoria = cat
-            
-            # Responsável (adicionar campo ao modelo se necessário)
-            # Por enquanto, vamos detectar mas não adicionar ao modelo ainda
-            # responsavel = detectar_responsavel(t)
+        if t.is_duplicada or t.categoria:
+            continue
+        # regras avaliadas até esgotar o orçamento da importação
+        if orcamento.esgotado:
+            sem_orcamento += 1
+            continue
+        cat = await aplicar_regras(t, orcamento)
+        if cat:
+            t.categoria = cat
+    if sem_orcamento:
+        logger.warning(
+            f"Orçamento de regras esgotado em {nome!r}: {sem_orcamento} transações sem categoria sugerida"
+        )
 
     return transacoes
 
@@ -72,22 +110,29 @@ async def upload_extrato(file: UploadFile = File(...)):
 async def processar_importacao(transacoes: List[TransacaoExtraida]):
     """
     Recebe lista de transações (já categorizadas) e grava apenas as que não são duplicadas.
-    Cria lançamentos futuros para compras parceladas.
+    Compras parceladas ganham um plano em `planos_parcelamento` com as parcelas futuras.
     """
     if not transacoes:
-        return {"adicionadas": 0, "duplicadas": 0, "parcelas_criadas": 0}
+        return {"adicionadas": 0, "duplicadas": 0, "parcelas_criadas": 0, "faturas_pagas": 0, "metas_alertas": []}
 
     adicionadas = 0
     duplicadas = 0
     parcelas_criadas = 0
+    inseridos: List[dict] = []  # para atualizar as faturas de uma vez no fim
+    planos: List[dict] = []
+    confirmadas: List[tuple] = []  # (plano_id, número) de parcelas virtuais que chegaram no extrato
+    virtuais_confirmadas: List[dict] = []
+
+    # Parcelas de compras já planejadas ("Parcela 2 de 4"), numa consulta só
+    planejadas = await localizar_parcelas_planejadas(t for t in transacoes if not t.is_duplicada)
 
     for t in transacoes:
         if t.is_duplicada:
             duplicadas += 1
             continue
 
-        # Detectar responsável
-        responsavel = detectar_responsavel(t)
+        # Detectar responsável (palavras conhecidas + histórico do usuário)
+        responsavel = await sugerir_responsavel(t)
         
         # Detectar se é cartão de crédito
         forma = "credito" if "pix cred" in t.descricao.lower() or "cartão" in t.descricao.lower() else "pix"
@@ -103,71 +148,152 @@ async def processar_importacao(transacoes: List[TransacaoExtraida]):
             "origem": "importado",
             "responsavel": responsavel,
             "observacao": f"{t.banco_origem} - {t.arquivo_nome}",
+            "merchant_key": normalizar_comerciante(t.descricao),
         }
+        if t.user_id:
+            doc["user_id"] = t.user_id
         
         # Se tem parcelas, adicionar info
         if t.parcelas_total:
             doc["parcelas_total"] = t.parcelas_total
             doc["parcela_atual"] = t.parcela_atual or 1
         
+        if t.id in planejadas:
+            # confirma a parcela virtual: mesmo id, dados do extrato
+            plano, numero = planejadas[t.id]
+            virtual = parcela_do_plano(plano, numero)
+            doc.update(
+                id=virtual["id"],
+                plano_id=plano["id"],
+                categoria=plano.get("categoria") or doc["categoria"],
+                responsavel=plano.get("responsavel") or doc["responsavel"],
+            )
+            confirmadas.append((plano["id"], numero))
+            virtuais_confirmadas.append(virtual)
+
         await db.lancamentos.insert_one(doc)
+        registrar_responsavel([doc])
+        inseridos.append(doc)
         adicionadas += 1
 
-        # Se é compra parcelada e ainda não tem todas as parcelas, criar lançamentos futuros
+        # Compra parcelada na 1ª parcela: as futuras viram um plano (expandido sob demanda)
         if t.parcelas_total and t.parcelas_total > 1 and (not t.parcela_atual or t.parcela_atual == 1):
-            data_base = datetime.strptime(t.data, "%Y-%m-%d")
-            valor_parcela = t.valor / t.parcelas_total
-            
-            for i in range(2, t.parcelas_total + 1):
-                data_parcela = data_base + relativedelta(months=i-1)
-                parcela_id = f"{t.id}_parcela_{i}"
-                
-                # Verificar se já existe
-                existe = await db.lancamentos.find_one({"id": parcela_id})
-                if not existe:
-                    doc_parcela = {
-                        "id": parcela_id,
-                        "data": data_parcela.strftime("%Y-%m-%d"),
-                        "descricao": f"{t.descricao} (Parcela {i}/{t.parcelas_total})",
-                        "categoria": t.categoria or "Outros",
-                        "tipo": t.tipo,
-                        "valor": valor_parcela,
-                        "forma": forma,
-                        "origem": "parcela_futura",
-                        "responsavel": responsavel,
-                        "parcelas_total": t.parcelas_total,
-                        "parcela_atual": i,
-                        "observacao": f"Parcela {i} de {t.parcelas_total} - {t.banco_origem}",
-                    }
-                    await db.lancamentos.insert_one(doc_parcela)
-                    parcelas_criadas += 1
-
-    return {"adicionadas": adicionadas, "duplicadas": duplicadas, "parcelas_criadas": parcelas_criadas}
+            plano = criar_plano(doc, banco_origem=t.banco_origem)
+            planos.append(plano)
+            parcelas_criadas += t.parcelas_total - 1
+
+    await gravar_planos(planos)
+    await confirmar_parcelas(confirmadas)
+    await registrar_em_faturas(virtuais_confirmadas, delta=-1)
+    # parcelas virtuais entram nas faturas como os lançamentos
+    await registrar_em_faturas(inseridos + [p for plano in planos for p in expandir_plano(plano)])
+    # Pagamentos de fatura do lote quitam as faturas em aberto correspondentes
+    conciliacao = await conciliar_pagamentos(inseridos)
+    await registrar_em_saldos(inseridos)
+    eventos_metas = await registrar_em_metas(inseridos)
+    invalidar_previsao()
+    invalidar_assinaturas()
+    invalidar_pivot()
+
+    return {
+        "adicionadas": adicionadas,
+        "duplicadas": duplicadas,
+        "parcelas_criadas": parcelas_criadas,
+        "faturas_pagas": conciliacao["conciliados"],
+        "metas_alertas": eventos_metas,
+    }
+
+
+async def _recategorizar_em_lotes(tarefa_id: str, filtro: dict, categoria: str) -> None:
+    """Aplica a categoria nos lançamentos do filtro em lotes de `_id`, registrando progresso."""
+    processados = 0
+    atualizados = 0
+    lote: list = []
+    usuarios: set = set()
+
+    async def _aplicar_lote():
+        nonlocal processados, atualizados
+        res = await db.lancamentos.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in lote]}},
+            {"$set": {"categoria": categoria}},
+        )
+        processados += len(lote)
+        atualizados += res.modified_count
+        await atualizar_progresso(tarefa_id, processados)
+
+    try:
+        cursor = db.lancamentos.find(filtro, {"_id": 1, "user_id": 1}).batch_size(RECATEGORIZACAO_LOTE)
+        async for doc in cursor:
+            lote.append(doc)
+            usuarios.add(doc.get("user_id"))
+            if len(lote) >= RECATEGORIZACAO_LOTE:
+                await _aplicar_lote()
+                lote = []
+        if lote:
+            await _aplicar_lote()
+        await concluir_tarefa(tarefa_id, {"atualizados": atualizados})
+    except Exception as e:
+        await falhar_tarefa(tarefa_id, str(e))
+    finally:
+        # lotes já gravados (mesmo com falha no meio) mudaram o consumo das metas
+        await categorias_alteradas(usuarios)
 
 
 @import_router.post("/aprender-categoria")
-async def aprender_categoria(regra: RegraCategorizacao):
+async def aprender_categoria(
+    regra: RegraCategorizacao,
+    background_tasks: BackgroundTasks,
+    simular: bool = False,
+):
     """
-    Salva regra de categorização e aplica em transações sem categoria existentes.
+    Salva regra de categorização e aplica em lançamentos existentes que casam com ela.
+
+    - `simular=true`: não grava nada; retorna quantos lançamentos mudariam e uma amostra.
+    - Até RECATEGORIZACAO_LIMITE_SINCRONO lançamentos, aplica com um único `update_many`.
+    - Acima disso, aplica em segundo plano e retorna o id da tarefa (/api/tarefas/{id}).
     """
-    regra_dict = regra.model_dump()
-    await db.regras_categorizacao.insert_one(regra_dict)
+    try:
+        validar_padrao(regra.descricao_padrao, regra.tipo_match)
+    except RegraInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    padrao = regra.descricao_padrao
     categoria = regra.categoria
+    filtro = {
+        **filtro_mongo_regra(regra.descricao_padrao, regra.tipo_match),
+        "categoria": {"$ne": categoria},
+    }
+    if regra.user_id:
+        filtro["user_id"] = regra.user_id
+    afetados = await db.lancamentos.count_documents(filtro)
 
-    # aplica em lançamentos existentes sem categoria específica (simples, por substring)
-    cursor = db.lancamentos.find(
-        {
-            "descricao": {"$regex": padrao, "$options": "i"},
-        }
-    )
-    async for doc in cursor:
-        await db.lancamentos.update_one(
-            {"_id": doc["_id"]},
-            {"$set": {"categoria": categoria}},
-        )
+    if simular:
+        cursor = db.lancamentos.find(
+            filtro,
+            {"_id": 0, "id": 1, "data": 1, "descricao": 1, "categoria": 1, "valor": 1},
+        ).limit(RECATEGORIZACAO_AMOSTRA)
+        amostra = [doc async for doc in cursor]
+        return {"status": "simulacao", "afetados": afetados, "amostra": amostra}
 
-    return {"status": "ok"}
+    regra_dict = regra.model_dump()
+    await db.regras_categorizacao.insert_one(regra_dict)
+    invalidar_cache_regras(regra.user_id)
 
+    if afetados > RECATEGORIZACAO_LIMITE_SINCRONO:
+        tarefa_id = await criar_tarefa(
+            "aprender_categoria",
+            afetados,
+            {"regra_id": regra.id, "categoria": categoria},
+        )
+        background_tasks.add_task(_recategorizar_em_lotes, tarefa_id, filtro, categoria)
+        return {"status": "em_andamento", "afetados": afetados, "tarefa_id": tarefa_id}
 
+    # donos dos lançamentos afetados (sem `user_id` conta como None, que `distinct` omitiria)
+    usuarios = [
+        g["_id"]
+        async for g in db.lancamentos.aggregate(
+            [{"$match": filtro}, {"$group": {"_id": {"$ifNull": ["$user_id", None]}}}]
+        )
+    ]
+    resultado = await db.lancamentos.update_many(filtro, {"$set": {"categoria": categoria}})
+    await categorias_alteradas(usuarios)
+    return {"status": "ok", "atualizados": resultado.modified_count}
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from utils.carteira import avaliar_carteira, resumo_carteira, serie_carteira
+from utils.precos import carregar_precos, ultimos_precos
+
+investimentos_router = APIRouter(prefix="/api/investimentos", tags=["investimentos"])
+
+
+@investimentos_router.get("/carteira")
+async def carteira(user_id: Optional[str] = None):
+    """Total aportado por ativo (e total geral), sem baixar todos os investimentos."""
+    ativos = await resumo_carteira(user_id)
+    return {"ativos": ativos, "total_aportado": round(sum(a["total_aportado"] for a in ativos), 2)}
+
+
+@investimentos_router.get("/carteira/serie")
+async def carteira_serie(de: Optional[str] = None, ate: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    Aportes mensais e posição acumulada por ativo (YYYY-MM), em formato colunar:
+    `aportes[i][j]` e `posicao[i][j]` são do mês `meses[i]` e do ativo `ativos[j]`.
+    """
+    try:
+        return await serie_carteira(user_id, de, ate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@investimentos_router.get("/carteira/avaliacao")
+async def carteira_avaliacao(
+    de: Optional[str] = None, ate: Optional[str] = None, passo: int = 1, user_id: Optional[str] = None
+):
+    """
+    Valor de mercado diário por ativo (preços locais), em formato colunar:
+    `valor[i][j]` é o valor do ativo `ativos[j]` no dia `datas[i]`.
+    """
+    try:
+        return await avaliar_carteira(user_id, de, ate, passo)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@investimentos_router.get("/precos")
+async def precos():
+    """Último preço, primeira data e número de pontos de cada ativo da base local."""
+    return list((await asyncio.to_thread(ultimos_precos)).values())
+
+
+@investimentos_router.post("/precos/recarregar")
+async def recarregar_precos():
+    """Relê o diretório de preços (após incluir ou atualizar arquivos)."""
+    series = await asyncio.to_thread(carregar_precos, True)
+    return {"ativos": sorted(series)}
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, status
+from pymongo.errors import DuplicateKeyError
+
+from models.meta import Meta
+from server import db
+from utils.fixos import mes_para_indice
+from utils.metas import consumo_do_mes, invalidar_metas, reconstruir_consumo
+
+metas_router = APIRouter(prefix="/api/metas", tags=["metas"])
+
+EVENTOS_LIMITE_MAXIMO = 500
+
+
+def _validar_meta(meta: Meta) -> None:
+    if meta.valor_limite <= 0:
+        raise HTTPException(status_code=400, detail="'valor_limite' deve ser positivo")
+    if any(not 0 < limiar <= 10 for limiar in meta.limiares):
+        raise HTTPException(status_code=400, detail="Limiares devem ser frações do limite entre 0 e 10")
+
+
+@metas_router.get("")
+async def listar_metas(user_id: Optional[str] = None):
+    return await db.metas.find({"user_id": user_id}, {"_id": 0}).sort("categoria", 1).to_list(length=None)
+
+
+@metas_router.post("", response_model=Meta, status_code=status.HTTP_201_CREATED)
+async def criar_meta(meta: Meta):
+    _validar_meta(meta)
+    meta.limiares = sorted(set(meta.limiares))
+    try:
+        await db.metas.insert_one(meta.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"Já existe meta para a categoria '{meta.categoria}'")
+    invalidar_metas(meta.user_id)
+    return meta
+
+
+@metas_router.put("/{meta_id}", response_model=Meta)
+async def atualizar_meta(meta_id: str, meta: Meta):
+    _validar_meta(meta)
+    meta.id = meta_id
+    meta.limiares = sorted(set(meta.limiares))
+    try:
+        antiga = await db.metas.find_one_and_replace({"id": meta_id}, meta.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"Já existe meta para a categoria '{meta.categoria}'")
+    if antiga is None:
+        raise HTTPException(status_code=404, detail="Meta não encontrada")
+    invalidar_metas(antiga.get("user_id"), meta.user_id)
+    return meta
+
+
+@metas_router.delete("/{meta_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def excluir_meta(meta_id: str):
+    antiga = await db.metas.find_one_and_delete({"id": meta_id})
+    if antiga is None:
+        raise HTTPException(status_code=404, detail="Meta não encontrada")
+    invalidar_metas(antiga.get("user_id"))
+    return
+
+
+@metas_router.get("/consumo")
+async def consumo(mes: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    Todas as metas com o gasto do mês (padrão: atual), lido dos contadores
+    mantidos a cada escrita de lançamento, sem varrer `lancamentos`.
+    """
+    mes = mes or datetime.now().strftime("%Y-%m")
+    try:
+        mes_para_indice(mes)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Mês deve estar no formato YYYY-MM")
+    metas = await consumo_do_mes(mes, user_id)
+    return {
+        "mes": mes,
+        "metas": metas,
+        "total_limite": round(sum(m["valor_limite"] for m in metas), 2),
+        "total_gasto": round(sum(m["gasto"] for m in metas), 2),
+    }
+
+
+@metas_router.get("/eventos")
+async def eventos(user_id: Optional[str] = None, mes: Optional[str] = None, limite: int = 100):
+    """Limiares de meta cruzados (para alertas), do mais recente ao mais antigo."""
+    filtro: dict = {"user_id": user_id}
+    if mes:
+        filtro["mes"] = mes
+    cursor = db.metas_eventos.find(filtro, {"_id": 0}).sort("criado_em", -1)
+    return await cursor.limit(min(max(limite, 1), EVENTOS_LIMITE_MAXIMO)).to_list(length=None)
+
+
+@metas_router.post("/reconstruir")
+async def reconstruir(user_id: Optional[str] = None, todos: bool = False):
+    """Recalcula os contadores de consumo a partir dos lançamentos."""
+    return await reconstruir_consumo(user_id, todos)
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+from fastapi import APIRouter
+
+from server import db
+from utils.parcelamento import expandir_plano, migrar_parcelas_fisicas
+
+parcelamento_router = APIRouter(prefix="/api/parcelamentos", tags=["parcelamento"])
+
+
+@parcelamento_router.get("", response_model=List[dict])
+async def listar_planos(user_id: Optional[str] = None, expandir: bool = False):
+    """Lista os planos de parcelamento (com `expandir=true`, junto das parcelas virtuais)."""
+    filtro = {"user_id": user_id} if user_id else {}
+    planos = await db.planos_parcelamento.find(filtro, {"_id": 0}).sort("data_inicial", -1).to_list(length=None)
+    if expandir:
+        for plano in planos:
+            plano["parcelas"] = expandir_plano(plano)
+    return planos
+
+
+@parcelamento_router.post("/migrar")
+async def migrar_parcelas():
+    """
+    Converte os lançamentos `parcela_futura` antigos (um documento por parcela)
+    em planos de parcelamento. Pode ser executado mais de uma vez.
+    """
+    return await migrar_parcelas_fisicas()
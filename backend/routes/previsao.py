@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from utils.previsao import calcular_previsao
+
+previsao_router = APIRouter(prefix="/api/previsao", tags=["previsao"])
+
+
+@previsao_router.get("")
+async def previsao_fluxo_caixa(meses: int = 12, user_id: Optional[str] = None):
+    """
+    Saldo previsto ao fim de cada um dos próximos meses, com entradas, saídas
+    e a quebra por categoria e por fonte (faturas, agendados, fixos, média histórica).
+    """
+    try:
+        return await calcular_previsao(meses, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from typing import List
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from pydantic import BaseModel
+
+from server import db
+from utils.recategorizacao import aplicar_previa, gerar_previa
+from utils.tarefas import criar_tarefa, obter_tarefa, reabrir_tarefa
+
+recategorizacao_router = APIRouter(prefix="/api/recategorizacao", tags=["recategorizacao"])
+
+
+class AplicarRecategorizacaoRequest(BaseModel):
+    previa_id: str
+    regras: List[str]  # chaves de regra aceitas, como aparecem no diff da prévia
+
+
+@recategorizacao_router.post("/previa")
+async def iniciar_previa(background_tasks: BackgroundTasks):
+    """
+    Inicia a prévia de recategorização de todos os lançamentos com as regras atuais.
+    O diff por regra fica no resultado da tarefa (/api/tarefas/{id}).
+    """
+    total = await db.lancamentos.estimated_document_count()
+    tarefa_id = await criar_tarefa("recategorizacao_previa", total)
+    background_tasks.add_task(gerar_previa, tarefa_id)
+    return {"status": "em_andamento", "tarefa_id": tarefa_id, "total": total}
+
+
+@recategorizacao_router.post("/aplicar")
+async def iniciar_aplicacao(payload: AplicarRecategorizacaoRequest, background_tasks: BackgroundTasks):
+    """
+    Aplica as mudanças das regras aceitas de uma prévia concluída.
+    """
+    previa = await obter_tarefa(payload.previa_id)
+    if not previa or previa.get("tipo") != "recategorizacao_previa":
+        raise HTTPException(status_code=404, detail="Prévia não encontrada")
+    if previa.get("status") != "concluida":
+        raise HTTPException(status_code=409, detail="Prévia ainda não foi concluída")
+    if not payload.regras:
+        raise HTTPException(status_code=400, detail="Nenhuma regra aceita")
+
+    total = await db.lancamentos.estimated_document_count()
+    tarefa_id = await criar_tarefa(
+        "recategorizacao_aplicar",
+        total,
+        {"previa_id": payload.previa_id, "regras": payload.regras},
+    )
+    background_tasks.add_task(aplicar_previa, tarefa_id, set(payload.regras))
+    return {"status": "em_andamento", "tarefa_id": tarefa_id, "total": total}
+
+
+@recategorizacao_router.post("/{tarefa_id}/retomar")
+async def retomar(tarefa_id: str, background_tasks: BackgroundTasks):
+    """
+    Retoma uma prévia ou aplicação interrompida a partir do último checkpoint.
+    """
+    tarefa = await obter_tarefa(tarefa_id)
+    if not tarefa or not str(tarefa.get("tipo", "")).startswith("recategorizacao_"):
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    if tarefa.get("status") == "concluida":
+        raise HTTPException(status_code=409, detail="Tarefa já foi concluída")
+    if not await reabrir_tarefa(tarefa_id):
+        raise HTTPException(status_code=409, detail="Tarefa ainda está em execução")
+    if tarefa["tipo"] == "recategorizacao_previa":
+        background_tasks.add_task(gerar_previa, tarefa_id)
+    else:
+        regras = set(tarefa.get("parametros", {}).get("regras", []))
+        background_tasks.add_task(aplicar_previa, tarefa_id, regras)
+
+    return {"status": "em_andamento", "tarefa_id": tarefa_id, "processados": tarefa.get("processados", 0)}
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+
+from utils.saldos import dia_para_indice, indice_para_dia, obter_ledger, reconstruir_saldos
+
+saldos_router = APIRouter(prefix="/api/saldos", tags=["saldos"])
+
+SERIE_MAX_DIAS = 3660
+
+
+@saldos_router.get("")
+async def saldo_na_data(data: Optional[str] = None, user_id: Optional[str] = None):
+    """Saldo (fora do crédito) ao fim de uma data (padrão: hoje)."""
+    data = data or datetime.now().strftime("%Y-%m-%d")
+    try:
+        dia = dia_para_indice(data)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data deve estar no formato YYYY-MM-DD")
+    ledger = await obter_ledger(user_id)
+    return {"data": data, "saldo": round(ledger.saldo_em(dia), 2)}
+
+
+@saldos_router.get("/serie")
+async def serie_saldos(de: str, ate: str, user_id: Optional[str] = None):
+    """Saldo ao fim de cada dia entre `de` e `ate` (YYYY-MM-DD), em formato colunar."""
+    try:
+        inicio, fim = dia_para_indice(de), dia_para_indice(ate)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas devem estar no formato YYYY-MM-DD")
+    if fim < inicio:
+        raise HTTPException(status_code=400, detail="'ate' deve ser igual ou posterior a 'de'")
+    if fim - inicio + 1 > SERIE_MAX_DIAS:
+        raise HTTPException(status_code=400, detail=f"Intervalo máximo de {SERIE_MAX_DIAS} dias")
+
+    ledger = await obter_ledger(user_id)
+    return {
+        "datas": [indice_para_dia(d) for d in range(inicio, fim + 1)],
+        "saldos": ledger.serie(inicio, fim).round(2).tolist(),
+    }
+
+
+@saldos_router.post("/reconstruir")
+async def reconstruir(user_id: Optional[str] = None, todos: bool = False):
+    """Recalcula o livro de saldos diários a partir dos lançamentos."""
+    return await reconstruir_saldos(user_id, todos)
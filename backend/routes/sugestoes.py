@@ -7,6 +7,7 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from utils.categorizacao import aplicar_regras, sugerir_categoria_por_padrao
+from utils.responsavel import sugerir_responsavel
 from models.importacao import TransacaoExtraida
 
 sugestoes_router = APIRouter(prefix="/api", tags=["sugestoes"])
@@ -17,18 +18,20 @@ class SugestaoRequest(BaseModel):
     valor: Optional[float] = None
     tipo: Optional[str] = None  # 'entrada' | 'saida'
     forma: Optional[str] = None  # 'pix' | 'debito' | 'credito' | etc.
+    user_id: Optional[str] = None  # escopo das regras aprendidas
 
 
 class SugestaoResponse(BaseModel):
     categoria_sugerida: Optional[str] = None
-    responsavel_sugerido: Optional[str] = None  # Futuro: aprender com histórico
+    responsavel_sugerido: Optional[str] = None  # palavras conhecidas + histórico
 
 
 @sugestoes_router.post("/sugerir-lancamento", response_model=SugestaoResponse)
 async def sugerir_lancamento(request: SugestaoRequest):
     """
     Sugere categoria e responsável para um lançamento baseado na descrição.
-    Usa as regras aprendidas (regras_categorizacao) + palavras padrão.
+    Usa as regras aprendidas (regras_categorizacao) + palavras padrão, e o
+    índice de responsáveis aprendido do histórico de lançamentos.
     """
     if not request.descricao or len(request.descricao.strip()) < 2:
         return SugestaoResponse()
@@ -41,13 +44,14 @@ async def sugerir_lancamento(request: SugestaoRequest):
         tipo=request.tipo or "saida",
         banco_origem="manual",
         arquivo_nome="",
+        user_id=request.user_id,
     )
 
     # Aplica regras aprendidas + palavras padrão
     categoria_sugerida = await aplicar_regras(transacao_temp)
 
-    # Por enquanto, responsável sempre None (futuro: aprender com histórico)
-    responsavel_sugerido = None
+    # Responsável: palavras conhecidas, depois frequência no histórico (em memória)
+    responsavel_sugerido = await sugerir_responsavel(transacao_temp)
 
     return SugestaoResponse(
         categoria_sugerida=categoria_sugerida,
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from fastapi import APIRouter, HTTPException
+
+from utils.tarefas import obter_tarefa
+
+tarefas_router = APIRouter(prefix="/api/tarefas", tags=["tarefas"])
+
+
+@tarefas_router.get("/{tarefa_id}")
+async def status_tarefa(tarefa_id: str):
+    """
+    Retorna status e progresso de uma tarefa em segundo plano
+    (recategorização, backfills etc.).
+    """
+    tarefa = await obter_tarefa(tarefa_id)
+    if not tarefa:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    if tarefa.get("checkpoint") is not None:
+        tarefa["checkpoint"] = str(tarefa["checkpoint"])
+    return tarefa
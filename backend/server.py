@@ -45,6 +45,8 @@ class Lancamento(BaseModel):
     responsavel: Optional[str] = None # 'Davi' | 'Ana' | 'Outro'
     origem: Optional[str] = None  # 'manual' | 'fixo'
     observacao: Optional[str] = None
+    cartao_id: Optional[str] = None  # quando forma == 'credito'
+    user_id: Optional[str] = None
 
 class Fixo(BaseModel):
     model_config = ConfigDict(extra="ignore", populate_by_name=True, arbitrary_types_allowed=True)
@@ -59,6 +61,7 @@ class Fixo(BaseModel):
     mesInicio: str  # YYYY-MM
     mesFim: Optional[str] = None
     ativo: bool = True
+    user_id: Optional[str] = None
 
 class Investimento(BaseModel):
     model_config = ConfigDict(extra="ignore", populate_by_name=True, arbitrary_types_allowed=True)
@@ -69,6 +72,7 @@ class Investimento(BaseModel):
     valor: float
     origem: Optional[str] = None
     observacao: Optional[str] = None
+    user_id: Optional[str] = None
 
 # Helper to serialize mongo docs
 def mongo_to_dict(doc):
@@ -89,7 +93,9 @@ async def health():
 @api_router.get("/lancamentos", response_model=List[Lancamento])
 async def get_all_lancamentos():
     lancamentos_cursor = db.lancamentos.find({})
-    return [mongo_to_dict(l) async for l in lancamentos_cursor]
+    lancamentos = [mongo_to_dict(l) async for l in lancamentos_cursor]
+    # parcelas futuras dos planos de parcelamento
+    return lancamentos + await parcelas_virtuais()
 
 @api_router.get("/lancamentos/busca")
 async def buscar_lancamentos(q: str = "", pagina: int = 1, limite: int = 50):
@@ -115,14 +121,22 @@ async def buscar_lancamentos(q: str = "", pagina: int = 1, limite: int = 50):
         ]
     }
     
-    # Contar total
-    total = await db.lancamentos.count_documents(query)
-    
-    # Buscar com paginação
+    # Contar total e buscar com paginação numa agregação (inclui as parcelas virtuais)
     skip = (pagina - 1) * limite
-    lancamentos_cursor = db.lancamentos.find(query).sort("data", -1).skip(skip).limit(limite)
-    
-    resultados = [mongo_to_dict(l) async for l in lancamentos_cursor]
+    pipeline = [
+        {"$match": query},
+        uniao_parcelas(query),
+        {"$sort": {"data": -1}},
+        {
+            "$facet": {
+                "total": [{"$count": "n"}],
+                "resultados": [{"$skip": skip}, {"$limit": limite}, {"$project": {"_id": 0}}],
+            }
+        },
+    ]
+    pagina_docs = (await db.lancamentos.aggregate(pipeline).to_list(length=1))[0]
+    total = pagina_docs["total"][0]["n"] if pagina_docs["total"] else 0
+    resultados = pagina_docs["resultados"]
     
     return {
         "resultados": resultados,
@@ -134,21 +148,55 @@ async def buscar_lancamentos(q: str = "", pagina: int = 1, limite: int = 50):
 
 @api_router.post("/lancamentos", response_model=Lancamento, status_code=status.HTTP_201_CREATED)
 async def create_lancamento(lancamento: Lancamento):
-    await db.lancamentos.insert_one(lancamento.model_dump(by_alias=True))
+    doc = lancamento.model_dump(by_alias=True)
+    com_merchant_key([doc])
+    await db.lancamentos.insert_one(doc)
+    registrar_responsavel([doc])
+    await registrar_em_faturas([doc])
+    await registrar_em_saldos([doc])
+    await registrar_em_metas([doc])
+    invalidar_previsao(doc.get("user_id"))
+    invalidar_pivot()
     return lancamento
 
 @api_router.put("/lancamentos/{lancamento_id}", response_model=Lancamento)
 async def update_lancamento(lancamento_id: str, lancamento_data: Lancamento):
-    result = await db.lancamentos.replace_one({"id": lancamento_id}, lancamento_data.model_dump(by_alias=True))
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Lancamento not found")
+    doc = lancamento_data.model_dump(by_alias=True)
+    com_merchant_key([doc])
+    antigo = await db.lancamentos.find_one_and_replace({"id": lancamento_id}, doc)
+    if antigo is None:
+        # parcela virtual: sai do plano e vira um lançamento físico
+        antigo = await separar_parcela(lancamento_id)
+        if antigo is None:
+            raise HTTPException(status_code=404, detail="Lancamento not found")
+        doc["id"] = lancamento_id
+        await db.lancamentos.insert_one(doc)
+    registrar_responsavel([antigo], delta=-1)
+    registrar_responsavel([doc])
+    await registrar_em_faturas([antigo], delta=-1)
+    await registrar_em_faturas([doc])
+    await registrar_em_saldos([antigo], delta=-1)
+    await registrar_em_saldos([doc])
+    await registrar_em_metas([antigo], delta=-1)
+    await registrar_em_metas([doc])
+    invalidar_previsao(antigo.get("user_id"))
+    invalidar_previsao(doc.get("user_id"))
+    invalidar_pivot()
     return lancamento_data
 
 @api_router.delete("/lancamentos/{lancamento_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_lancamento(lancamento_id: str):
-    result = await db.lancamentos.delete_one({"id": lancamento_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Lancamento not found")
+    antigo = await db.lancamentos.find_one_and_delete({"id": lancamento_id})
+    if antigo is None:
+        antigo = await separar_parcela(lancamento_id)
+        if antigo is None:
+            raise HTTPException(status_code=404, detail="Lancamento not found")
+    registrar_responsavel([antigo], delta=-1)
+    await registrar_em_faturas([antigo], delta=-1)
+    await registrar_em_saldos([antigo], delta=-1)
+    await registrar_em_metas([antigo], delta=-1)
+    invalidar_previsao(antigo.get("user_id"))
+    invalidar_pivot()
     return
 
 # --- Fixos CRUD ---
@@ -160,20 +208,28 @@ async def get_all_fixos():
 @api_router.post("/fixos", response_model=Fixo, status_code=status.HTTP_201_CREATED)
 async def create_fixo(fixo: Fixo):
     await db.fixos.insert_one(fixo.model_dump(by_alias=True))
+    invalidar_fixos(fixo.user_id)
+    invalidar_previsao(fixo.user_id)
     return fixo
 
 @api_router.put("/fixos/{fixo_id}", response_model=Fixo)
 async def update_fixo(fixo_id: str, fixo_data: Fixo):
-    result = await db.fixos.replace_one({"id": fixo_id}, fixo_data.model_dump(by_alias=True))
-    if result.matched_count == 0:
+    # $set (e não replace) preserva o `lancado_ate` mantido por lancar_fixos
+    antigo = await db.fixos.find_one_and_update({"id": fixo_id}, {"$set": fixo_data.model_dump(by_alias=True)})
+    if antigo is None:
         raise HTTPException(status_code=404, detail="Fixo not found")
+    invalidar_fixos(antigo.get("user_id"), fixo_data.user_id)
+    invalidar_previsao(antigo.get("user_id"))
+    invalidar_previsao(fixo_data.user_id)
     return fixo_data
 
 @api_router.delete("/fixos/{fixo_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_fixo(fixo_id: str):
-    result = await db.fixos.delete_one({"id": fixo_id})
-    if result.deleted_count == 0:
+    antigo = await db.fixos.find_one_and_delete({"id": fixo_id})
+    if antigo is None:
         raise HTTPException(status_code=404, detail="Fixo not found")
+    invalidar_fixos(antigo.get("user_id"))
+    invalidar_previsao(antigo.get("user_id"))
     return
 
 # --- Investimentos CRUD ---
@@ -220,6 +276,27 @@ from routes.sugestoes import sugestoes_router
 from routes.admin import admin_router
 from routes.estatisticas import estatisticas_router
 from routes.cartao import cartao_router
+from routes.tarefas import tarefas_router
+from routes.recategorizacao import recategorizacao_router
+from routes.exportacao import exportacao_router
+from routes.parcelamento import parcelamento_router
+from routes.fixos import fixos_router
+from routes.previsao import previsao_router
+from routes.saldos import saldos_router
+from routes.investimentos import investimentos_router
+from routes.metas import metas_router
+from utils.indices import criar_indices
+from utils.responsavel import registrar_responsavel
+from utils.comerciante import com_merchant_key, preencher_merchant_keys
+from utils.parcelamento import parcelas_virtuais, separar_parcela, uniao_parcelas
+from utils.fixos import invalidar_fixos, lancar_fixos
+from utils.previsao import invalidar_previsao
+from utils.pivot import invalidar_pivot
+from utils.saldos import registrar_em_saldos
+from utils.metas import registrar_em_metas
+from utils.faturas import precomputar_alertas, registrar_em_faturas, transicionar_status_faturas
+from utils.agendador import iniciar_agendador, parar_agendador, registrar_rotina
+from utils.tarefas import interromper_tarefas_inativas
 
 app.include_router(upload_router)
 app.include_router(import_router)
@@ -227,6 +304,15 @@ app.include_router(sugestoes_router)
 app.include_router(admin_router)
 app.include_router(estatisticas_router)
 app.include_router(cartao_router)
+app.include_router(tarefas_router)
+app.include_router(recategorizacao_router)
+app.include_router(exportacao_router)
+app.include_router(parcelamento_router)
+app.include_router(fixos_router)
+app.include_router(previsao_router)
+app.include_router(saldos_router)
+app.include_router(investimentos_router)
+app.include_router(metas_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -252,6 +338,26 @@ async def startup_db_client():
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
 
+    try:
+        await criar_indices()
+    except Exception as e:
+        logger.error(f"Failed to create MongoDB indexes: {e}")
+
+    try:
+        # tarefas órfãs de um worker que reiniciou
+        await interromper_tarefas_inativas()
+    except Exception as e:
+        logger.error(f"Failed to sweep stale tasks: {e}")
+
+    # Rotinas periódicas (executadas só pelo worker líder)
+    registrar_rotina("faturas_status", 3600, transicionar_status_faturas)
+    registrar_rotina("faturas_alertas", 900, precomputar_alertas)
+    registrar_rotina("fixos_lancamentos", 3600, lancar_fixos)
+    registrar_rotina("merchant_keys", 600, preencher_merchant_keys)
+    registrar_rotina("tarefas_inativas", 600, interromper_tarefas_inativas)
+    iniciar_agendador()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await parar_agendador()
     client.close()
\ No newline at end of file
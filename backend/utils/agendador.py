@@ -0,0 +1,142 @@
+"""
+Agendador periódico em processo (asyncio).
+
+Com vários workers, só o que detém o lock `agendador` em `locks` executa as
+rotinas; o lock expira se o líder parar de renová-lo, e outro worker assume.
+Antes de cada rotina o líder renova o lock e reivindica a rotina em
+`agendador_execucoes` com uma troca atômica de `proxima` (próxima execução
+permitida): se um tick longo fizer o lock expirar, o novo líder não roda a
+mesma rotina em paralelo, e uma troca de líder não a faz rodar de novo antes
+do intervalo.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from server import db
+
+logger = logging.getLogger(__name__)
+
+AGENDADOR_TICK = int(os.environ.get("AGENDADOR_TICK", "60"))  # segundos entre verificações
+AGENDADOR_LOCK_TTL = AGENDADOR_TICK * 3  # líder que não renova nesse prazo perde o lock
+
+_WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# nome -> (intervalo em segundos, rotina)
+_rotinas: Dict[str, tuple] = {}
+_task: Optional[asyncio.Task] = None
+
+
+def registrar_rotina(nome: str, intervalo: int, rotina: Callable[[], Awaitable[Optional[dict]]]) -> None:
+    """Registra uma rotina para rodar a cada `intervalo` segundos (no líder)."""
+    _rotinas[nome] = (intervalo, rotina)
+
+
+async def _obter_lideranca() -> bool:
+    """Adquire ou renova o lock de líder. Retorna True se este worker é o líder."""
+    agora = datetime.utcnow()
+    try:
+        await db.locks.find_one_and_update(
+            {"_id": "agendador", "$or": [{"dono": _WORKER_ID}, {"expira_em": {"$lt": agora}}]},
+            {"$set": {"dono": _WORKER_ID, "expira_em": agora + timedelta(seconds=AGENDADOR_LOCK_TTL)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # lock existe, é de outro worker e ainda não expirou
+        return False
+
+
+async def _reivindicar(nome: str, intervalo: int) -> bool:
+    """
+    Marca a rotina como em execução por este worker, se já estiver na hora dela.
+    Atômico: entre workers concorrentes, só um recebe True.
+    """
+    agora = datetime.utcnow()
+    try:
+        await db.agendador_execucoes.find_one_and_update(
+            {
+                "_id": nome,
+                "$or": [
+                    {"proxima": {"$lte": agora}},
+                    # registros anteriores a `proxima`
+                    {
+                        "proxima": {"$exists": False},
+                        "ultima_execucao": {"$not": {"$gt": agora - timedelta(seconds=intervalo)}},
+                    },
+                ],
+            },
+            {"$set": {"proxima": agora + timedelta(seconds=intervalo), "worker": _WORKER_ID}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # registro existe e a rotina não está na hora (ou outro worker acabou de reivindicá-la)
+        return False
+
+
+async def _executar_pendentes() -> None:
+    for nome, (intervalo, rotina) in _rotinas.items():
+        # rotinas anteriores podem ter demorado: renova o lock antes de cada uma
+        if not await _obter_lideranca():
+            return
+        if not await _reivindicar(nome, intervalo):
+            continue
+
+        agora = datetime.utcnow()
+        try:
+            resultado = await rotina()
+            erro = None
+        except Exception as e:
+            logger.error(f"Rotina {nome} falhou: {e}")
+            resultado, erro = None, str(e)
+
+        await db.agendador_execucoes.update_one(
+            {"_id": nome},
+            {"$set": {"ultima_execucao": agora, "resultado": resultado, "erro": erro, "worker": _WORKER_ID}},
+            upsert=True,
+        )
+
+
+async def _loop() -> None:
+    while True:
+        try:
+            await _executar_pendentes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erro no agendador: {e}")
+        await asyncio.sleep(AGENDADOR_TICK)
+
+
+def iniciar_agendador() -> None:
+    """Inicia o loop em segundo plano (desligável com AGENDADOR_ATIVO=false)."""
+    global _task
+    if os.environ.get("AGENDADOR_ATIVO", "true").lower() in ("false", "0", "no"):
+        logger.info("Agendador desativado por AGENDADOR_ATIVO")
+        return
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_loop())
+        logger.info(f"Agendador iniciado ({_WORKER_ID}) com rotinas: {', '.join(_rotinas)}")
+
+
+async def parar_agendador() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    # libera o lock para outro worker assumir sem esperar expirar
+    await db.locks.delete_one({"_id": "agendador", "dono": _WORKER_ID})
@@ -0,0 +1,166 @@
+"""
+Detecção de assinaturas (cobranças mensais) que não estão em `fixos`.
+
+Os gastos dos últimos ASSINATURAS_MESES_HISTORICO meses são agrupados por
+(usuário, `merchant_key`) num DataFrame; intervalos entre cobranças
+e estabilidade do valor saem de `groupby().diff()`/`transform()`, sem laço
+por grupo. Um grupo vira sugestão de Fixo quando o intervalo mediano é mensal,
+há ao menos ASSINATURAS_MIN_COBRANCAS cobranças e a última é recente.
+
+`confianca` (0 a 1) combina a regularidade dos intervalos, a estabilidade do
+valor e o número de cobranças. A análise fica em cache até a próxima
+importação (`invalidar_assinaturas`) ou ASSINATURAS_CACHE_TTL; os fixos já
+cadastrados são descontados a cada consulta.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from server import db
+from utils.comerciante import normalizar_comerciante
+from utils.fixos import carregar_fixos
+
+ASSINATURAS_CACHE_TTL = 6 * 3600
+ASSINATURAS_MESES_HISTORICO = 24
+ASSINATURAS_MIN_COBRANCAS = 3
+ASSINATURAS_INTERVALO_MENSAL = (26, 35)  # dias entre cobranças consecutivas
+ASSINATURAS_TOLERANCIA_VALOR = 0.1  # variação aceita em torno do valor mediano
+ASSINATURAS_DIAS_INATIVA = 45  # sem cobrança há mais tempo: assinatura encerrada
+
+_CAMPOS = {
+    "_id": 0,
+    "data": 1,
+    "descricao": 1,
+    "merchant_key": 1,
+    "valor": 1,
+    "categoria": 1,
+    "responsavel": 1,
+    "user_id": 1,
+}
+
+# user_id -> (sugestões, calculadas_em)
+_assinaturas_cache: Dict[Optional[str], tuple] = {}
+
+
+def invalidar_assinaturas() -> None:
+    """Descarta as análises em cache (chamada após importações)."""
+    _assinaturas_cache.clear()
+
+
+def _analisar(docs: List[dict], hoje: datetime) -> List[dict]:
+    """Sugestões de Fixo a partir dos gastos (`docs`), vetorizado por grupo."""
+    if not docs:
+        return []
+    df = pd.DataFrame(docs)
+    for coluna in ("categoria", "responsavel", "user_id", "merchant_key"):
+        if coluna not in df:
+            df[coluna] = None
+
+    # lançamentos ainda sem `merchant_key`: normaliza cada descrição distinta uma vez só
+    sem_chave = df["merchant_key"].isna()
+    chaves = {d: normalizar_comerciante(d) for d in df.loc[sem_chave, "descricao"].dropna().unique()}
+    df["comerciante"] = df["merchant_key"].where(~sem_chave, df["descricao"].map(chaves))
+    df["dia"] = pd.to_datetime(df["data"].str[:10], errors="coerce")
+    df["valor"] = pd.to_numeric(df["valor"], errors="coerce")
+    df["usuario"] = df["user_id"].fillna("")
+    df = df[(df["comerciante"].fillna("") != "") & df["dia"].notna() & (df["valor"] > 0)]
+    if df.empty:
+        return []
+
+    df = df.sort_values(["usuario", "comerciante", "dia"], kind="stable")
+    grupos = df.groupby(["usuario", "comerciante"], sort=False)
+    df["intervalo"] = grupos["dia"].diff().dt.days
+    df["intervalo_mensal"] = df["intervalo"].between(*ASSINATURAS_INTERVALO_MENSAL)
+    mediana = grupos["valor"].transform("median")
+    df["valor_estavel"] = (df["valor"] - mediana).abs() <= ASSINATURAS_TOLERANCIA_VALOR * mediana
+    df["dia_mes"] = df["dia"].dt.day
+
+    stats = grupos.agg(
+        cobrancas=("valor", "size"),
+        intervalo_mediano=("intervalo", "median"),
+        intervalos_mensais=("intervalo_mensal", "sum"),
+        estabilidade=("valor_estavel", "mean"),
+        valor=("valor", "last"),
+        descricao=("descricao", "last"),
+        categoria=("categoria", "last"),
+        responsavel=("responsavel", "last"),
+        user_id=("user_id", "last"),
+        dia_vencimento=("dia_mes", "median"),
+        primeira=("dia", "min"),
+        ultima=("dia", "max"),
+    ).reset_index()
+
+    stats = stats[
+        (stats["cobrancas"] >= ASSINATURAS_MIN_COBRANCAS)
+        & stats["intervalo_mediano"].between(*ASSINATURAS_INTERVALO_MENSAL)
+        & (stats["ultima"] >= hoje - timedelta(days=ASSINATURAS_DIAS_INATIVA))
+    ]
+    if stats.empty:
+        return []
+
+    regularidade = stats["intervalos_mensais"] / (stats["cobrancas"] - 1)
+    volume = ((stats["cobrancas"] - 1) / 5).clip(upper=1)
+    stats = stats.assign(
+        confianca=(0.5 * regularidade + 0.3 * stats["estabilidade"] + 0.2 * volume).round(2)
+    ).sort_values("confianca", ascending=False)
+
+    # grupos só com None viram NaN no `last`: de volta a None antes dos padrões (NaN não vai para JSON)
+    opcionais = ["categoria", "responsavel", "user_id"]
+    stats[opcionais] = stats[opcionais].astype(object).where(pd.notna(stats[opcionais]), None)
+    return [
+        {
+            "fixo": {
+                "descricao": s.descricao,
+                "categoria": s.categoria or "Outros",
+                "tipo": "saida",
+                "valor": round(float(s.valor), 2),
+                "responsavel": s.responsavel or "Outro",
+                "diaVencimento": int(s.dia_vencimento),
+                "mesInicio": s.primeira.strftime("%Y-%m"),
+                "user_id": s.user_id,
+            },
+            "comerciante": s.comerciante,
+            "confianca": float(s.confianca),
+            "cobrancas": int(s.cobrancas),
+            "intervalo_mediano": float(s.intervalo_mediano),
+            "ultima_cobranca": s.ultima.strftime("%Y-%m-%d"),
+        }
+        for s in stats.itertuples(index=False)
+    ]
+
+
+async def detectar_assinaturas(user_id: Optional[str] = None, confianca_minima: float = 0.0) -> List[dict]:
+    """
+    Sugestões de Fixo para cobranças mensais recorrentes ainda não cadastradas,
+    da maior para a menor confiança.
+    """
+    em_cache = _assinaturas_cache.get(user_id)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= ASSINATURAS_CACHE_TTL:
+        sugestoes = em_cache[0]
+    else:
+        hoje = datetime.now()
+        inicio = (hoje - relativedelta(months=ASSINATURAS_MESES_HISTORICO)).strftime("%Y-%m-%d")
+        filtro = {
+            "tipo": "saida",
+            "data": {"$gte": inicio},
+            "origem": {"$nin": ["fixo", "parcela_futura"]},
+            "parcelas_total": {"$not": {"$gt": 1}},
+        }
+        if user_id:
+            filtro["user_id"] = user_id
+        docs = await db.lancamentos.find(filtro, _CAMPOS).to_list(length=None)
+        # pandas fora do event loop
+        sugestoes = await asyncio.to_thread(_analisar, docs, hoje)
+        _assinaturas_cache[user_id] = (sugestoes, time.monotonic())
+
+    cadastrados = {normalizar_comerciante(f.get("descricao") or "") for f in (await carregar_fixos(user_id)).fixos}
+    return [
+        s for s in sugestoes if s["confianca"] >= confianca_minima and s["comerciante"] not in cadastrados
+    ]
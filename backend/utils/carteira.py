@@ -0,0 +1,184 @@
+"""
+Carteira de investimentos: aportes por ativo ao longo do tempo.
+
+Uma agregação soma os aportes (`investimentos.valor`, em BRL) por ativo e mês;
+o NumPy monta a matriz mês × ativo e as posições acumuladas com `cumsum`.
+
+`avaliar_carteira` marca a carteira a mercado com a base local de preços
+(`utils.precos`): a quantidade de cada aporte é o valor dividido pelo preço
+do dia do aporte, e o valor em cada dia é a quantidade acumulada vezes o
+preço do dia, tudo com buscas binárias e multiplicações vetorizadas.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+from server import db
+from utils.fixos import indice_para_mes, mes_para_indice
+from utils.precos import carregar_precos, datas_para_dias
+
+AVALIACAO_MAX_PONTOS = 20000
+
+
+async def _aportes_por_mes(user_id: Optional[str], ate: Optional[str] = None) -> List[dict]:
+    filtro: dict = {"user_id": user_id} if user_id else {}
+    if ate:
+        filtro["data"] = {"$lte": f"{ate}-31"}
+    pipeline = [
+        {"$match": filtro},
+        {
+            "$group": {
+                "_id": {"ativo": "$ativo", "mes": {"$substrBytes": ["$data", 0, 7]}},
+                "valor": {"$sum": "$valor"},
+                "quantidade": {"$sum": 1},
+            }
+        },
+    ]
+    return await db.investimentos.aggregate(pipeline).to_list(length=None)
+
+
+async def serie_carteira(
+    user_id: Optional[str] = None, de: Optional[str] = None, ate: Optional[str] = None
+) -> dict:
+    """
+    Aportes mensais e posição acumulada (aportada) por ativo, de `de` a `ate`
+    (YYYY-MM; padrão: do primeiro ao último aporte). A posição inclui os
+    aportes anteriores a `de`.
+    """
+    grupos = await _aportes_por_mes(user_id, ate)
+    grupos = [g for g in grupos if g["_id"].get("mes")]
+    if not grupos:
+        return {"meses": [], "ativos": [], "aportes": [], "posicao": [], "total": []}
+
+    ativos = sorted({g["_id"]["ativo"] for g in grupos})
+    coluna = {a: j for j, a in enumerate(ativos)}
+    meses_idx = np.array([mes_para_indice(g["_id"]["mes"]) for g in grupos])
+    primeiro = int(meses_idx.min())
+    ultimo = max(int(meses_idx.max()), mes_para_indice(ate) if ate else 0)
+
+    aportes = np.zeros((ultimo - primeiro + 1, len(ativos)))
+    np.add.at(
+        aportes,
+        (meses_idx - primeiro, [coluna[g["_id"]["ativo"]] for g in grupos]),
+        [float(g["valor"]) for g in grupos],
+    )
+    posicao = np.cumsum(aportes, axis=0)
+
+    inicio = max(mes_para_indice(de) - primeiro, 0) if de else 0
+    aportes, posicao = aportes[inicio:], posicao[inicio:]
+    return {
+        "meses": [indice_para_mes(i) for i in range(primeiro + inicio, ultimo + 1)],
+        "ativos": ativos,
+        "aportes": aportes.round(2).tolist(),
+        "posicao": posicao.round(2).tolist(),
+        "total": posicao.sum(axis=1).round(2).tolist(),
+    }
+
+
+async def resumo_carteira(user_id: Optional[str] = None) -> List[dict]:
+    """Total aportado, número de aportes e primeiro/último aporte por ativo."""
+    filtro = {"user_id": user_id} if user_id else {}
+    pipeline = [
+        {"$match": filtro},
+        {
+            "$group": {
+                "_id": "$ativo",
+                "total_aportado": {"$sum": "$valor"},
+                "aportes": {"$sum": 1},
+                "primeiro_aporte": {"$min": "$data"},
+                "ultimo_aporte": {"$max": "$data"},
+            }
+        },
+        {"$sort": {"total_aportado": -1}},
+        {
+            "$project": {
+                "_id": 0,
+                "ativo": "$_id",
+                "total_aportado": 1,
+                "aportes": 1,
+                "primeiro_aporte": 1,
+                "ultimo_aporte": 1,
+            }
+        },
+    ]
+    return await db.investimentos.aggregate(pipeline).to_list(length=None)
+
+
+async def _aportes_por_dia(user_id: Optional[str], ate: str) -> List[dict]:
+    pipeline = [
+        {"$match": {"user_id": user_id} if user_id else {}},
+        {
+            "$group": {
+                "_id": {"ativo": "$ativo", "dia": {"$substrBytes": ["$data", 0, 10]}},
+                "valor": {"$sum": "$valor"},
+            }
+        },
+        {"$match": {"_id.dia": {"$lte": ate}}},
+    ]
+    return await db.investimentos.aggregate(pipeline).to_list(length=None)
+
+
+async def avaliar_carteira(
+    user_id: Optional[str] = None, de: Optional[str] = None, ate: Optional[str] = None, passo: int = 1
+) -> dict:
+    """
+    Valor de mercado por ativo em cada dia de `de` a `ate` (YYYY-MM-DD; padrão:
+    do primeiro aporte até hoje), a cada `passo` dias, junto do total aportado
+    até o dia. Ativos sem arquivo de preços vão em `sem_preco`.
+    """
+    ate = ate or datetime.now().strftime("%Y-%m-%d")
+    series, grupos = await asyncio.gather(asyncio.to_thread(carregar_precos), _aportes_por_dia(user_id, ate))
+
+    por_ativo: dict = defaultdict(list)
+    for g in grupos:
+        if g["_id"].get("dia"):
+            por_ativo[str(g["_id"].get("ativo") or "").upper()].append((g["_id"]["dia"], float(g["valor"])))
+    vazio = {"datas": [], "ativos": [], "valor": [], "total": [], "aportado": [], "resultado": [], "sem_preco": []}
+    if not por_ativo:
+        return vazio
+
+    try:
+        primeiro = min(dia for aportes in por_ativo.values() for dia, _ in aportes)
+        inicio, fim = (int(d) for d in datas_para_dias([de or primeiro, ate]))
+    except ValueError:
+        raise ValueError("Datas devem estar no formato YYYY-MM-DD")
+    if passo < 1:
+        raise ValueError("'passo' deve ser positivo")
+    if fim < inicio:
+        raise ValueError("'ate' deve ser igual ou posterior a 'de'")
+    if (fim - inicio) // passo + 1 > AVALIACAO_MAX_PONTOS:
+        raise ValueError(f"Máximo de {AVALIACAO_MAX_PONTOS} pontos; aumente 'passo' ou reduza o intervalo")
+
+    ativos = sorted(a for a in por_ativo if a in series)
+    dias = np.arange(inicio, fim + 1, passo, dtype=np.int64)
+    valor = np.zeros((len(dias), len(ativos)))
+    aportado = np.zeros(len(dias))
+
+    for j, ativo in enumerate(ativos):
+        serie = series[ativo]
+        aportes = sorted(por_ativo[ativo])
+        dias_aporte = datas_para_dias([dia for dia, _ in aportes])
+        valores = np.array([v for _, v in aportes])
+        # cotas acumuladas e aportado acumulado até cada dia pedido
+        cotas = np.concatenate(([0.0], np.cumsum(valores / serie.precos_em(dias_aporte))))
+        acumulado = np.concatenate(([0.0], np.cumsum(valores)))
+        ate_dia = np.searchsorted(dias_aporte, dias, side="right")
+        valor[:, j] = cotas[ate_dia] * serie.precos_em(dias)
+        aportado += acumulado[ate_dia]
+
+    total = valor.sum(axis=1)
+    return {
+        "datas": np.datetime_as_string(dias.astype("datetime64[D]")).tolist(),
+        "ativos": ativos,
+        "valor": valor.round(2).tolist(),
+        "total": total.round(2).tolist(),
+        "aportado": aportado.round(2).tolist(),
+        "resultado": (total - aportado).round(2).tolist(),
+        "sem_preco": sorted(a for a in por_ativo if a not in series),
+    }
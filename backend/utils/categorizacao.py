@@ -1,10 +1,34 @@
 from __future__ import annotations
 
-from typing import Optional, List
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, List, Pattern, Tuple
 
 from models.importacao import TransacaoExtraida
 from server import db
 
+logger = logging.getLogger(__name__)
+
+# Limites de segurança para regras do tipo 'regex'
+REGEX_TAMANHO_MAXIMO = 200
+REGEX_ORCAMENTO_MS = 5.0  # acima disso, a avaliação de uma descrição é registrada no log
+REGEX_ORCAMENTO_IMPORTACAO_MS = 2000.0  # tempo total de regras por importação; depois, sem categoria
+DESCRICAO_TAMANHO_MAXIMO = 512  # descrições maiores são truncadas antes do match
+REGRAS_CACHE_TTL = 60  # segundos até recarregar as regras do banco
+REGRAS_CACHE_MAX_USUARIOS = 256  # usuários com regras compiladas em memória
+
+# Construções proibidas em regras 'regex': grupos nomeados e backreferences
+# quebram o padrão combinado; quantificador aplicado a grupo que já termina
+# em quantificador (ex: "(a+)+") é a forma clássica de backtracking exponencial.
+_REGEX_PROIBIDO = re.compile(
+    r"\\[1-9]|\\[gk]<|\(\?P[<=]|[+*}]\)[+*{]"
+)
+
+# Entradas usadas para medir o custo de um padrão antes de aceitá-lo
+_SONDAS_BACKTRACKING = ("a", "0", " ", "ab")
+
 
 PALAVRAS_PADRAO = {
     # Utilidades
@@ -90,37 +114,243 @@ PALAVRAS_PADRAO = {
 }
 
 
-async def aplicar_regras(transacao: TransacaoExtraida) -> Optional[str]:
+class RegraInvalida(ValueError):
+    """Padrão de regra de categorização rejeitado na validação."""
+
+
+def validar_padrao(padrao: str, tipo_match: str = "substring") -> None:
+    """
+    Valida o padrão de uma regra antes de salvá-la.
+    Para 'regex', verifica sintaxe, construções proibidas e o custo de avaliação
+    em entradas repetitivas (onde o backtracking exponencial aparece).
+    """
+    if not padrao or not padrao.strip():
+        raise RegraInvalida("Padrão da regra não pode ser vazio.")
+    if tipo_match not in ("substring", "exato", "regex"):
+        raise RegraInvalida(f"tipo_match inválido: {tipo_match}")
+    if tipo_match != "regex":
+        return
+
+    if len(padrao) > REGEX_TAMANHO_MAXIMO:
+        raise RegraInvalida(f"Regex maior que {REGEX_TAMANHO_MAXIMO} caracteres.")
+    if _REGEX_PROIBIDO.search(padrao):
+        raise RegraInvalida(
+            "Regex com grupos nomeados, backreferences ou quantificadores aninhados não é suportada."
+        )
+
+    try:
+        compilado = re.compile(f"(?P<r0>{padrao})", re.IGNORECASE | re.DOTALL)
+    except re.error as e:
+        raise RegraInvalida(f"Regex inválida: {e}") from e
+
+    if compilado.search(""):
+        raise RegraInvalida("Regex casa com texto vazio (categorizaria qualquer transação).")
+
+    for base in _SONDAS_BACKTRACKING:
+        for tamanho in (8, 16, 24):
+            sonda = base * (tamanho // len(base)) + "!"
+            inicio = time.perf_counter()
+            compilado.search(sonda)
+            if (time.perf_counter() - inicio) * 1000 > REGEX_ORCAMENTO_MS:
+                raise RegraInvalida("Regex muito custosa para avaliar (backtracking excessivo).")
+
+
+def _fonte_regra(padrao: str, tipo_match: str) -> str:
+    """Traduz uma regra para o trecho de regex equivalente."""
+    if tipo_match == "regex":
+        return padrao
+    if tipo_match == "exato":
+        return rf"\A{re.escape(padrao)}\Z"
+    return re.escape(padrao)
+
+
+def filtro_mongo_regra(padrao: str, tipo_match: str) -> dict:
+    """
+    Filtro de `lancamentos` equivalente à regra, para aplicá-la em lote no Mongo.
+    Padrões de substring/exato são escapados; regex é usada como foi validada.
+    """
+    return {"descricao": {"$regex": _fonte_regra(padrao, tipo_match), "$options": "i"}}
+
+
+class OrcamentoRegras:
     """
-    Aplica regras salvas em `regras_categorizacao` (por enquanto sem separar por usuário).
+    Tempo de avaliação de regras ainda disponível numa importação. O `re` não
+    interrompe um match em andamento, então o limite vale entre descrições:
+    esgotado, as transações restantes ficam sem categoria sugerida.
     """
-    regras_cursor = db.regras_categorizacao.find({})
+
+    __slots__ = ("restante_ms",)
+
+    def __init__(self, total_ms: float = REGEX_ORCAMENTO_IMPORTACAO_MS):
+        self.restante_ms = total_ms
+
+    @property
+    def esgotado(self) -> bool:
+        return self.restante_ms <= 0
+
+
+class RegrasCompiladas:
+    """
+    Conjunto de regras compilado em um único padrão.
+
+    Cada regra vira uma alternativa `(?=.*?(?P<rN>...))`; como as alternativas
+    são tentadas na ordem das regras, um único `match` devolve a primeira
+    regra que casa, preservando a prioridade da iteração regra a regra.
+    """
+
+    __slots__ = ("padrao", "categorias", "chaves")
+
+    def __init__(self, regras: List[dict]):
+        fontes: List[str] = []
+        self.categorias: List[str] = []
+        self.chaves: List[str] = []  # identifica a regra que casou (ex: no diff de recategorização)
+
+        for regra in regras:
+            padrao = str(regra.get("descricao_padrao", ""))
+            tipo_match = regra.get("tipo_match", "substring")
+            categoria = regra.get("categoria")
+
+            if not categoria or not padrao:
+                continue
+
+            try:
+                validar_padrao(padrao, tipo_match)
+            except RegraInvalida as e:
+                logger.warning(f"Regra de categorização ignorada ({padrao!r}): {e}")
+                continue
+
+            nome = f"r{len(self.categorias)}"
+            fontes.append(f"(?=.*?(?P<{nome}>{_fonte_regra(padrao, tipo_match)}))")
+            self.categorias.append(categoria)
+            self.chaves.append(f"regra:{regra.get('id') or padrao}")
+
+        self.padrao: Optional[Pattern[str]] = (
+            re.compile("|".join(fontes), re.IGNORECASE | re.DOTALL) if fontes else None
+        )
+
+    def categorizar(self, descricao: str) -> Optional[str]:
+        indice = self.identificar(descricao)
+        return None if indice is None else self.categorias[indice]
+
+    def identificar(self, descricao: str, orcamento: Optional[OrcamentoRegras] = None) -> Optional[int]:
+        """
+        Índice da primeira regra que casa com a descrição, ou None. Com
+        `orcamento`, desconta o tempo gasto e não avalia nada se já esgotado.
+        """
+        if self.padrao is None or (orcamento is not None and orcamento.esgotado):
+            return None
+
+        desc = descricao[:DESCRICAO_TAMANHO_MAXIMO]
+        inicio = time.perf_counter()
+        match = self.padrao.match(desc)
+        decorrido_ms = (time.perf_counter() - inicio) * 1000
+        if orcamento is not None:
+            orcamento.restante_ms -= decorrido_ms
+        if decorrido_ms > REGEX_ORCAMENTO_MS:
+            logger.warning(
+                f"Regras de categorização levaram {decorrido_ms:.1f} ms para {desc[:60]!r}"
+            )
+
+        if not match or not match.lastgroup:
+            return None
+        return int(match.lastgroup[1:])
+
+
+# Cache LRU de regras compiladas por usuário: user_id -> (regras, carregado_em).
+# A chave None guarda o conjunto de quem não informa usuário (todas as regras).
+_regras_cache: "OrderedDict[Optional[str], Tuple[RegrasCompiladas, float]]" = OrderedDict()
+
+
+async def carregar_regras(user_id: Optional[str] = None) -> RegrasCompiladas:
+    """
+    Retorna as regras do usuário já compiladas: primeiro as dele, depois as
+    compartilhadas (sem `user_id`), em ordem de criação. A busca usa o índice
+    (user_id, criado_em), então o custo depende só das regras desse usuário.
+    Sem `user_id` (o frontend ainda não o envia), usa as regras de todos.
+
+    O resultado fica em cache por REGRAS_CACHE_TTL segundos (ou até
+    `invalidar_cache_regras`); com mais de REGRAS_CACHE_MAX_USUARIOS usuários,
+    os menos usados recentemente são descartados.
+    """
+    agora = time.monotonic()
+    entrada = _regras_cache.get(user_id)
+    if entrada is not None and agora - entrada[1] <= REGRAS_CACHE_TTL:
+        _regras_cache.move_to_end(user_id)
+        return entrada[0]
+
+    filtro = {"user_id": {"$in": [user_id, None]}} if user_id is not None else {}
+    regras_cursor = db.regras_categorizacao.find(
+        filtro,
+        {"_id": 0, "id": 1, "user_id": 1, "descricao_padrao": 1, "tipo_match": 1, "categoria": 1},
+    ).sort("criado_em", 1)
     regras: List[dict] = [r async for r in regras_cursor]
+    # regras com dono têm prioridade sobre as compartilhadas
+    regras.sort(key=lambda r: r.get("user_id") is None)
 
-    desc = transacao.descricao.lower()
+    compiladas = RegrasCompiladas(regras)
+    _regras_cache[user_id] = (compiladas, agora)
+    _regras_cache.move_to_end(user_id)
+    while len(_regras_cache) > REGRAS_CACHE_MAX_USUARIOS:
+        _regras_cache.popitem(last=False)
 
-    for regra in regras:
-        padrao = str(regra.get("descricao_padrao", "")).lower()
-        tipo_match = regra.get("tipo_match", "substring")
-        categoria = regra.get("categoria")
+    return compiladas
 
-        if not categoria or not padrao:
-            continue
 
-        if tipo_match == "substring" and padrao in desc:
-            return categoria
-        if tipo_match == "exato" and padrao == desc:
-            return categoria
+def invalidar_cache_regras(user_id: Optional[str] = None) -> None:
+    """
+    Descarta as regras compiladas do usuário; a próxima chamada recarrega do banco.
+    Regras compartilhadas (user_id None) fazem parte do conjunto de todos, então
+    invalidá-las limpa o cache inteiro; as de um usuário também estão no
+    conjunto sem usuário (chave None).
+    """
+    if user_id is None:
+        _regras_cache.clear()
+    else:
+        _regras_cache.pop(user_id, None)
+        _regras_cache.pop(None, None)
+
+
+async def aplicar_regras(
+    transacao: TransacaoExtraida, orcamento: Optional[OrcamentoRegras] = None
+) -> Optional[str]:
+    """
+    Aplica as regras de `regras_categorizacao` do usuário da transação
+    (mais as compartilhadas) e, se nenhuma casar, as palavras padrão.
+    Com `orcamento` esgotado, retorna None sem avaliar nada.
+    """
+    if orcamento is not None and orcamento.esgotado:
+        return None
+    regras = await carregar_regras(transacao.user_id)
+    indice = regras.identificar(transacao.descricao, orcamento)
+    if indice is not None:
+        return regras.categorias[indice]
 
     # fallback: regras padrão
     return sugerir_categoria_por_padrao(transacao.descricao)
 
 
 def sugerir_categoria_por_padrao(descricao: str) -> Optional[str]:
+    resultado = categorizar_com_origem_padrao(descricao)
+    return resultado[0] if resultado else None
+
+
+def categorizar_com_origem_padrao(descricao: str) -> Optional[Tuple[str, str]]:
+    """Como `sugerir_categoria_por_padrao`, mas também retorna a chave da palavra que casou."""
     desc = descricao.lower()
     for palavra, categoria in PALAVRAS_PADRAO.items():
         if palavra in desc:
-            return categoria
+            return categoria, f"padrao:{palavra}"
     return None
 
 
+def categorizar_com_origem(regras: RegrasCompiladas, descricao: str) -> Optional[Tuple[str, str]]:
+    """
+    Aplica regras aprendidas + palavras padrão e retorna (categoria, chave da regra).
+    Mesma ordem de `aplicar_regras`; usado por jobs que precisam saber qual regra decidiu.
+    """
+    indice = regras.identificar(descricao)
+    if indice is not None:
+        return regras.categorias[indice], regras.chaves[indice]
+    return categorizar_com_origem_padrao(descricao)
+
+
@@ -0,0 +1,110 @@
+"""
+Chave canônica do comerciante (`merchant_key`) de um lançamento.
+
+"Pix enviado - Mercado Sol Nascente 12/03" e "Compra no débito - IFOOD *ABC123"
+viram "mercado sol nascente" e "ifood": sem acentos, prefixos de meio de
+pagamento (Pix, TED, compra no débito...), datas, marcas de parcela, ids e
+números. A chave é gravada em cada lançamento (importação e CRUD) e indexada,
+para agrupar, deduplicar e buscar por igualdade em vez de varrer o texto.
+
+`preencher_merchant_keys` (rotina do agendador) grava a chave nos lançamentos
+antigos em lotes. Os planos de parcelamento guardam a mesma chave em
+`comerciante` (copiada para as parcelas virtuais).
+"""
+
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Iterable, Tuple
+
+from pymongo import UpdateOne
+
+from server import db
+
+MERCHANT_KEY_LOTE = 1000
+MERCHANT_KEY_MAX_LOTES = 50  # por execução da rotina; o restante fica para a próxima
+
+_DATAS = re.compile(r"\b\d{4}-\d{2}-\d{2}\b|\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b")
+_MARCA_PARCELA = re.compile(r"parcela\s+\d+\s+de\s+\d+|em\s+\d+x|\d+\s*/\s*\d+")
+_COM_DIGITOS = re.compile(r"\S*\d\S*")  # ids, códigos de autorização, CPF/CNPJ, valores
+_PREFIXO = re.compile(
+    r"^(?:"
+    r"pix (?:enviado|recebido|agendado|cred)"
+    r"|(?:ted|doc) (?:enviad[oa]|recebid[oa])"
+    r"|transferencia (?:enviada|recebida)(?: pelo pix)?"
+    r"|compra (?:no|de|com) (?:debito|credito|cartao)"
+    r"|compra no cartao"
+    r"|pagamento (?:efetuado|de boleto|pix)"
+    r"|debito automatico"
+    r"|pix|ted|doc|compra|pagto"
+    r")(?: |$)"
+)
+_SUFIXOS = {"ltda", "me", "eireli", "epp", "sa"}
+
+
+def chave_comerciante(descricao: str) -> Tuple[str, bool]:
+    """
+    Chave do comerciante da descrição e se ela identifica um comerciante:
+    False quando só sobrou o meio de pagamento ("Pix enviado 123.456.789-00"
+    vira "pix enviado", igual para qualquer destinatário).
+    """
+    texto = unicodedata.normalize("NFKD", (descricao or "").lower())
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    texto = _DATAS.sub(" ", texto)
+    texto = _MARCA_PARCELA.sub(" ", texto)
+    texto = _COM_DIGITOS.sub(" ", texto)
+    palavras = " ".join(re.findall(r"[a-z]+", texto))
+
+    chave = palavras
+    while True:
+        sem_prefixo = _PREFIXO.sub("", chave, count=1)
+        if sem_prefixo == chave:
+            break
+        chave = sem_prefixo
+    termos = chave.split()
+    while termos and termos[-1] in _SUFIXOS:
+        termos.pop()
+    # descrição só com o meio de pagamento ("Pix enviado"): fica como está
+    if termos:
+        return " ".join(termos), True
+    return palavras, False
+
+
+def normalizar_comerciante(descricao: str) -> str:
+    """Chave do comerciante da descrição (vazia só se não sobrar nenhuma palavra)."""
+    return chave_comerciante(descricao)[0]
+
+
+def com_merchant_key(docs: Iterable[dict]) -> None:
+    """Grava `merchant_key` em cada documento (antes do insert)."""
+    for doc in docs:
+        doc["merchant_key"] = normalizar_comerciante(doc.get("descricao", ""))
+
+
+async def preencher_merchant_keys() -> dict:
+    """
+    Rotina do agendador: grava `merchant_key` nos lançamentos que ainda não
+    têm, em lotes de MERCHANT_KEY_LOTE (um bulk_write por lote). Depois de
+    concluído o preenchimento, cada execução é uma consulta vazia no índice.
+    """
+    atualizados = 0
+    for _ in range(MERCHANT_KEY_MAX_LOTES):
+        lote = await db.lancamentos.find(
+            {"merchant_key": {"$exists": False}}, {"_id": 1, "descricao": 1}
+        ).limit(MERCHANT_KEY_LOTE).to_list(length=MERCHANT_KEY_LOTE)
+        if not lote:
+            break
+        await db.lancamentos.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"merchant_key": normalizar_comerciante(doc.get("descricao", ""))}},
+                )
+                for doc in lote
+            ],
+            ordered=False,
+        )
+        atualizados += len(lote)
+
+    return {"atualizados": atualizados}
@@ -0,0 +1,143 @@
+"""
+Conciliação de pagamentos de fatura importados com `faturas`.
+
+Os lançamentos de pagamento ("pagamento fatura", "pagamento online de fatura")
+de um lote de importação são casados, de uma vez, com as faturas em aberto:
+hash join por (dono, saldo em centavos) e, entre os candidatos, a fatura com
+vencimento mais próximo dentro da janela. As faturas pagas e os lançamentos
+conciliados são gravados com um `bulk_write` cada.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from server import db
+from utils.categorizacao import PALAVRAS_PADRAO
+from utils.faturas import invalidar_limites
+
+# Pagamento feito até X dias antes ou Y dias depois do vencimento
+CONCILIACAO_DIAS_ANTES = 15
+CONCILIACAO_DIAS_DEPOIS = 10
+
+PALAVRAS_PAGAMENTO_FATURA = tuple(
+    palavra for palavra, categoria in PALAVRAS_PADRAO.items()
+    if categoria == "Dívidas" and "fatura" in palavra
+)
+
+
+def eh_pagamento_fatura(doc: dict) -> bool:
+    descricao = str(doc.get("descricao", "")).lower()
+    return doc.get("tipo") == "saida" and any(p in descricao for p in PALAVRAS_PAGAMENTO_FATURA)
+
+
+def _centavos(valor) -> int:
+    return int(round(float(valor or 0) * 100))
+
+
+async def _faturas_em_aberto(de: str, ate: str) -> Dict[Tuple[Optional[str], int], List[dict]]:
+    """Tabela hash (user_id do cartão, saldo em centavos) -> faturas, por vencimento."""
+    pipeline = [
+        {
+            "$match": {
+                "status": {"$in": ["aberta", "vencida"]},
+                "data_vencimento": {"$gte": de, "$lte": ate},
+                "valor_total": {"$gt": 0},
+            }
+        },
+        {"$lookup": {"from": "cartoes", "localField": "cartao_id", "foreignField": "id", "as": "cartao"}},
+        {
+            "$project": {
+                "_id": 0,
+                "id": 1,
+                "valor_total": 1,
+                "valor_pago": 1,
+                "data_vencimento": 1,
+                "user_id": {"$ifNull": [{"$first": "$cartao.user_id"}, None]},
+            }
+        },
+        {"$sort": {"data_vencimento": 1}},
+    ]
+    tabela: Dict[Tuple[Optional[str], int], List[dict]] = defaultdict(list)
+    async for fatura in db.faturas.aggregate(pipeline):
+        saldo = _centavos(fatura["valor_total"]) - _centavos(fatura.get("valor_pago"))
+        if saldo > 0:
+            tabela[(fatura["user_id"], saldo)].append(fatura)
+    return tabela
+
+
+def _mais_proxima(candidatas: List[dict], data: str) -> Optional[dict]:
+    """Fatura com vencimento mais próximo do pagamento, dentro da janela."""
+    pagamento = datetime.strptime(data, "%Y-%m-%d")
+    melhor, menor_distancia = None, None
+    for fatura in candidatas:
+        dias = (datetime.strptime(fatura["data_vencimento"], "%Y-%m-%d") - pagamento).days
+        if not -CONCILIACAO_DIAS_DEPOIS <= dias <= CONCILIACAO_DIAS_ANTES:
+            continue
+        if menor_distancia is None or abs(dias) < menor_distancia:
+            melhor, menor_distancia = fatura, abs(dias)
+    return melhor
+
+
+async def conciliar_pagamentos(docs: Iterable[dict]) -> dict:
+    """
+    Marca como pagas as faturas quitadas pelos pagamentos do lote (valor igual
+    ao saldo em aberto e data dentro da janela do vencimento). Cada fatura é
+    casada com no máximo um pagamento; pagamentos sem par ficam como estão.
+    """
+    pagamentos = sorted((d for d in docs if eh_pagamento_fatura(d)), key=lambda d: d["data"])
+    if not pagamentos:
+        return {"conciliados": 0, "faturas": []}
+
+    de = (datetime.strptime(pagamentos[0]["data"], "%Y-%m-%d") - timedelta(days=CONCILIACAO_DIAS_DEPOIS))
+    ate = (datetime.strptime(pagamentos[-1]["data"], "%Y-%m-%d") + timedelta(days=CONCILIACAO_DIAS_ANTES))
+    tabela = await _faturas_em_aberto(de.strftime("%Y-%m-%d"), ate.strftime("%Y-%m-%d"))
+
+    pagas: List[str] = []
+    ops_faturas: List[UpdateOne] = []
+    ops_lancamentos: List[UpdateOne] = []
+    for pagamento in pagamentos:
+        candidatas = tabela.get((pagamento.get("user_id"), _centavos(pagamento["valor"])))
+        if not candidatas:
+            continue
+        fatura = _mais_proxima(candidatas, pagamento["data"])
+        if fatura is None:
+            continue
+        candidatas.remove(fatura)
+        pagas.append(fatura["id"])
+
+        ops_faturas.append(
+            UpdateOne(
+                # status no filtro: uma fatura paga em paralelo não é paga de novo
+                {"id": fatura["id"], "status": {"$in": ["aberta", "vencida"]}},
+                {
+                    "$set": {
+                        "valor_pago": fatura["valor_total"],
+                        "status": "paga",
+                        "pago_em": datetime.strptime(pagamento["data"], "%Y-%m-%d"),
+                        "pagamento_id": pagamento["id"],
+                    }
+                },
+            )
+        )
+        ops_lancamentos.append(UpdateOne({"id": pagamento["id"]}, {"$set": {"fatura_id": fatura["id"]}}))
+
+    if not ops_faturas:
+        return {"conciliados": 0, "faturas": []}
+
+    res = await db.faturas.bulk_write(ops_faturas, ordered=False)
+    await db.lancamentos.bulk_write(ops_lancamentos, ordered=False)
+
+    invalidar_limites()
+    # import local: utils.previsao importa este módulo
+    from utils.previsao import invalidar_previsao
+
+    invalidar_previsao()
+    # alertas pré-calculados não devem mais mostrar as faturas pagas
+    await db.alertas.update_many({}, {"$pull": {"faturas": {"id": {"$in": pagas}}}})
+
+    return {"conciliados": res.modified_count, "faturas": pagas}
@@ -5,6 +5,7 @@ from difflib import SequenceMatcher
 
 from models.importacao import TransacaoExtraida
 from server import db
+from utils.comerciante import chave_comerciante
 
 
 async def verificar_duplicatas(
@@ -38,6 +39,7 @@ async def verificar_duplicatas(
     nomes_internos = ["ana jullya", "ana lima", "davi miranda", "davi stark"]
     
     for t in transacoes:
+        chave, identifica_comerciante = chave_comerciante(t.descricao)
         # Verificar duplicatas exatas
         for e in existentes:
             if e.get("data") != t.data:
@@ -45,6 +47,13 @@ async def verificar_duplicatas(
             if abs(float(e.get("valor", 0)) - float(t.valor)) > 0.01:
                 continue
 
+            # mesmo comerciante normalizado e mesmo tipo: duplicata sem comparar o texto
+            # (só se a chave não for apenas o meio de pagamento, como "pix enviado")
+            if identifica_comerciante and e.get("merchant_key") == chave and e.get("tipo") == t.tipo:
+                t.is_duplicada = True
+                t.transacao_existente_id = e.get("id") or str(e.get("_id"))
+                break
+
             desc_existente = str(e.get("descricao", "")).lower()
             desc_nova = t.descricao.lower()
             similaridade = SequenceMatcher(None, desc_existente, desc_nova).ratio()
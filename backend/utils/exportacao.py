@@ -0,0 +1,200 @@
+"""
+Exportação em streaming (CSV/XLSX) de lançamentos.
+
+As linhas são lidas do cursor do Motor e escritas em blocos direto na resposta
+(`StreamingResponse`), então a memória usada não depende do tamanho do período.
+O XLSX é montado sem dependências extras: um zip gravado em modo sem seek, com a
+planilha em XML de strings inline, esvaziado a cada bloco de linhas.
+"""
+
+from __future__ import annotations
+
+import csv
+import io
+import re
+import zipfile
+from typing import AsyncIterator, List, Sequence
+from xml.sax.saxutils import escape
+
+from fastapi.responses import StreamingResponse
+
+EXPORTACAO_LOTE = 500  # linhas por bloco enviado ao cliente
+
+COLUNAS_LANCAMENTO = [
+    ("data", "Data"),
+    ("descricao", "Descrição"),
+    ("categoria", "Categoria"),
+    ("tipo", "Tipo"),
+    ("valor", "Valor"),
+    ("forma", "Forma"),
+    ("responsavel", "Responsável"),
+    ("parcela", "Parcela"),
+]
+
+TIPOS_MIDIA = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Caracteres de controle não são permitidos em XML
+_XML_INVALIDO = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _valor_coluna(doc: dict, campo: str):
+    if campo == "parcela":
+        if doc.get("parcelas_total"):
+            return f"{doc.get('parcela_atual', 1)}/{doc.get('parcelas_total', 1)}"
+        return ""
+    if campo == "valor":
+        return float(doc.get("valor", 0) or 0)
+    valor = doc.get(campo)
+    return "" if valor is None else valor
+
+
+async def _blocos(cursor, colunas: Sequence[tuple]) -> AsyncIterator[List[list]]:
+    bloco: List[list] = []
+    async for doc in cursor:
+        bloco.append([_valor_coluna(doc, campo) for campo, _ in colunas])
+        if len(bloco) >= EXPORTACAO_LOTE:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+async def gerar_csv(cabecalho: List[list], colunas: Sequence[tuple], cursor) -> AsyncIterator[bytes]:
+    """CSV separado por ';' (como o export de fatura), em blocos de EXPORTACAO_LOTE linhas."""
+    saida = io.StringIO()
+    writer = csv.writer(saida, delimiter=";")
+
+    for linha in cabecalho:
+        writer.writerow(linha)
+    writer.writerow([titulo for _, titulo in colunas])
+
+    async for bloco in _blocos(cursor, colunas):
+        for linha in bloco:
+            writer.writerow(
+                [f"R$ {v:.2f}" if campo == "valor" else v for (campo, _), v in zip(colunas, linha)]
+            )
+        yield saida.getvalue().encode("utf-8")
+        saida.seek(0)
+        saida.truncate()
+
+    if saida.tell():
+        yield saida.getvalue().encode("utf-8")
+
+
+class _SaidaZip(io.RawIOBase):
+    """Destino sem seek para o ZipFile; os bytes são drenados a cada bloco."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._posicao = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, dados) -> int:
+        self._buffer.extend(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def drenar(self) -> bytes:
+        dados = bytes(self._buffer)
+        self._buffer.clear()
+        return dados
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    "</Types>"
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Lancamentos" sheetId="1" r:id="rId1"/></sheets>'
+    "</workbook>"
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    "</Relationships>"
+)
+
+
+def _linha_xml(valores: Sequence) -> str:
+    celulas = []
+    for valor in valores:
+        if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            celulas.append(f'<c t="n"><v>{valor}</v></c>')
+        else:
+            texto = escape(_XML_INVALIDO.sub("", str(valor)))
+            celulas.append(f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>')
+    return f"<row>{''.join(celulas)}</row>"
+
+
+async def gerar_xlsx(cabecalho: List[list], colunas: Sequence[tuple], cursor) -> AsyncIterator[bytes]:
+    """Planilha XLSX com uma aba, escrita em streaming."""
+    saida = _SaidaZip()
+    with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK)
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as planilha:
+            planilha.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for linha in cabecalho:
+                planilha.write(_linha_xml(linha).encode("utf-8"))
+            planilha.write(_linha_xml([titulo for _, titulo in colunas]).encode("utf-8"))
+            yield saida.drenar()
+
+            async for bloco in _blocos(cursor, colunas):
+                planilha.write("".join(_linha_xml(linha) for linha in bloco).encode("utf-8"))
+                yield saida.drenar()
+
+            planilha.write(b"</sheetData></worksheet>")
+
+    yield saida.drenar()
+
+
+def resposta_exportacao(
+    formato: str,
+    nome_arquivo: str,
+    cursor,
+    cabecalho: List[list] | None = None,
+    colunas: Sequence[tuple] = COLUNAS_LANCAMENTO,
+) -> StreamingResponse:
+    """Monta a `StreamingResponse` de download no formato pedido ('csv' ou 'xlsx')."""
+    gerador = gerar_xlsx if formato == "xlsx" else gerar_csv
+    extensao = "xlsx" if formato == "xlsx" else "csv"
+    return StreamingResponse(
+        gerador(cabecalho or [], colunas, cursor),
+        media_type=TIPOS_MIDIA[extensao],
+        headers={"Content-Disposition": f'attachment; filename="{nome_arquivo}.{extensao}"'},
+    )
@@ -0,0 +1,635 @@
+"""
+Motor de ciclos de fatura do cartão de crédito.
+
+Cada cartão fecha no `dia_fechamento` (véspera do `melhor_dia_compra`) e vence no
+`dia_vencimento`. Uma compra feita até o fechamento entra na fatura que fecha
+naquele mês; depois dele, na do mês seguinte. `mes_referencia` é o mês de
+fechamento do ciclo, e o vencimento cai no mesmo mês (se o dia de vencimento
+for depois do fechamento) ou no seguinte.
+
+As parcelas futuras dos planos de parcelamento entram nas agregações como
+lançamentos, via `uniao_parcelas`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import calendar
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from dateutil.relativedelta import relativedelta
+from pymongo import DeleteMany, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from server import db
+from utils.parcelamento import uniao_parcelas
+from utils.saldos import data_valida
+
+# Sem `melhor_dia_compra`, assume fechamento uma semana antes do vencimento
+FECHAMENTO_ANTES_VENCIMENTO = 7
+
+# Projeção de faturas futuras: cache por cartão, invalidado nas escritas de crédito
+PROJECAO_CACHE_TTL = 300  # segundos; cobre escritas feitas por outros workers
+PROJECAO_CACHE_MAX = 256  # entradas (cartão × parâmetros × dia) mantidas
+
+# Resumo de limite usado por cartão: cache único, invalidado nas escritas de crédito
+LIMITES_CACHE_TTL = 300
+
+# Alertas pré-calculados pelo agendador cobrem vencimentos até esta janela
+ALERTAS_JANELA_DIAS = 30
+
+# Campos de lançamento devolvidos nas faturas (evita trafegar o documento inteiro)
+PROJECAO_LANCAMENTO = {
+    "_id": 0,
+    "id": 1,
+    "data": 1,
+    "descricao": 1,
+    "categoria": 1,
+    "valor": 1,
+    "responsavel": 1,
+    "parcela_atual": 1,
+    "parcelas_total": 1,
+}
+
+
+def dia_fechamento(cartao: dict) -> int:
+    """Dia do mês em que a fatura fecha (1-31)."""
+    melhor_dia = cartao.get("melhor_dia_compra")
+    if melhor_dia:
+        # melhor dia 1 = fecha no último dia do mês anterior
+        return int(melhor_dia) - 1 if int(melhor_dia) > 1 else 31
+
+    fechamento = int(cartao.get("dia_vencimento", 12)) - FECHAMENTO_ANTES_VENCIMENTO
+    return fechamento if fechamento > 0 else fechamento + 30
+
+
+def _vence_no_mes_seguinte(cartao: dict) -> bool:
+    return int(cartao.get("dia_vencimento", 12)) <= dia_fechamento(cartao)
+
+
+def mes_referencia_da_compra(data: str, cartao: dict) -> str:
+    """Mês (YYYY-MM) do ciclo em que uma compra feita em `data` (YYYY-MM-DD) é cobrada."""
+    compra = datetime.strptime(data[:10], "%Y-%m-%d")
+    if compra.day > dia_fechamento(cartao):
+        compra = compra.replace(day=1) + relativedelta(months=1)
+    return compra.strftime("%Y-%m")
+
+
+def data_vencimento_ciclo(mes_referencia: str, cartao: dict) -> str:
+    """Data de vencimento (YYYY-MM-DD) da fatura que fecha em `mes_referencia`."""
+    ano, mes = (int(p) for p in mes_referencia.split("-"))
+    vencimento = datetime(ano, mes, 1)
+    if _vence_no_mes_seguinte(cartao):
+        vencimento += relativedelta(months=1)
+    ultimo_dia = calendar.monthrange(vencimento.year, vencimento.month)[1]
+    dia = min(int(cartao.get("dia_vencimento", 12)), ultimo_dia)
+    return vencimento.replace(day=dia).strftime("%Y-%m-%d")
+
+
+def ciclo_atual(cartao: dict, hoje: Optional[datetime] = None) -> str:
+    """mes_referencia do ciclo aberto hoje."""
+    return mes_referencia_da_compra((hoje or datetime.now()).strftime("%Y-%m-%d"), cartao)
+
+
+def fatura_id(cartao_id: str, mes_referencia: str) -> str:
+    return f"{cartao_id}_{mes_referencia}"
+
+
+async def filtro_lancamentos_cartao(cartao: dict) -> dict:
+    """
+    Filtro dos lançamentos de crédito atribuídos ao cartão: os que têm seu
+    `cartao_id` e os de crédito sem cartão informado (ex: importados de extrato)
+    quando este é o único candidato do dono do lançamento.
+    Mesma regra de `cartao_do_lancamento`.
+    """
+    user_id = cartao.get("user_id")
+    sem_cartao: Optional[dict] = None
+
+    if cartao.get("ativo", True):
+        if user_id:
+            if await db.cartoes.count_documents({"user_id": user_id, "ativo": True}) <= 1:
+                sem_cartao = {"cartao_id": None, "user_id": user_id}
+        else:
+            # cartão sem usuário: atende quem não tem cartão próprio
+            sem_usuario, donos_com_cartao = await asyncio.gather(
+                db.cartoes.count_documents({"user_id": None, "ativo": True}),
+                db.cartoes.distinct("user_id", {"user_id": {"$ne": None}, "ativo": True}),
+            )
+            if sem_usuario <= 1:
+                sem_cartao = {"cartao_id": None, "user_id": {"$nin": donos_com_cartao}}
+
+    filtro: dict = {"forma": "credito", "tipo": "saida"}
+    if sem_cartao:
+        filtro["$or"] = [{"cartao_id": cartao["id"]}, sem_cartao]
+    else:
+        filtro["cartao_id"] = cartao["id"]
+    return filtro
+
+
+def cartao_do_lancamento(doc: dict, cartoes: List[dict]) -> Optional[dict]:
+    """
+    Cartão ao qual um lançamento de crédito pertence, entre `cartoes`:
+    o do `cartao_id`; senão o único cartão ativo do dono; senão o único
+    cartão ativo sem usuário.
+    """
+    if doc.get("cartao_id"):
+        return next((c for c in cartoes if c.get("id") == doc["cartao_id"]), None)
+
+    ativos = [c for c in cartoes if c.get("ativo", True)]
+    proprios = [c for c in ativos if c.get("user_id") and c.get("user_id") == doc.get("user_id")]
+    if proprios:
+        return proprios[0] if len(proprios) == 1 else None
+
+    globais = [c for c in ativos if not c.get("user_id")]
+    return globais[0] if len(globais) == 1 else None
+
+
+def estagios_mes_referencia(cartao: dict) -> List[dict]:
+    """
+    Estágios que calculam `mes_referencia` de cada lançamento no Mongo, com a
+    mesma regra de `mes_referencia_da_compra`. Lançamentos cuja `data` não é
+    uma data YYYY-MM-DD válida ficam de fora (em vez de derrubar a agregação).
+    """
+    data_compra = {
+        "$dateFromString": {
+            "dateString": {
+                "$cond": [{"$eq": [{"$type": "$data"}, "string"]}, {"$substrCP": ["$data", 0, 10]}, ""]
+            },
+            "format": "%Y-%m-%d",
+            "onError": None,
+            "onNull": None,
+        }
+    }
+    return [
+        {"$addFields": {"data_compra": data_compra}},
+        {"$match": {"data_compra": {"$ne": None}}},
+        {
+            "$addFields": {
+                "mes_referencia": {
+                    "$dateToString": {
+                        "format": "%Y-%m",
+                        "date": {
+                            "$cond": [
+                                {"$lte": [{"$dayOfMonth": "$data_compra"}, dia_fechamento(cartao)]},
+                                "$data_compra",
+                                {"$dateAdd": {"startDate": "$data_compra", "unit": "month", "amount": 1}},
+                            ]
+                        },
+                    }
+                }
+            }
+        },
+    ]
+
+
+async def _agregar_ciclos(cartao: dict) -> List[dict]:
+    """Totais e ids de lançamentos por ciclo, calculados dos dados brutos."""
+    filtro = await filtro_lancamentos_cartao(cartao)
+    pipeline = [
+        {"$match": filtro},
+        uniao_parcelas(filtro),
+        *estagios_mes_referencia(cartao),
+        {
+            "$group": {
+                "_id": "$mes_referencia",
+                "valor_total": {"$sum": "$valor"},
+                "lancamentos_ids": {"$push": "$id"},
+            }
+        },
+    ]
+    return await db.lancamentos.aggregate(pipeline).to_list(length=None)
+
+
+async def recalcular_faturas(cartao: dict) -> List[str]:
+    """
+    Recalcula todas as faturas do cartão: uma agregação agrupa os lançamentos por
+    ciclo e um único `bulk_write` faz o upsert de cada ciclo (preservando
+    `valor_pago`/`status`) e zera os ciclos que ficaram sem lançamentos.
+    Retorna os meses de referência com lançamentos.
+    """
+    cartao_id = cartao["id"]
+    ciclos = await _agregar_ciclos(cartao)
+
+    operacoes = []
+    for ciclo in ciclos:
+        mes_ref = ciclo["_id"]
+        operacoes.append(
+            UpdateOne(
+                {"cartao_id": cartao_id, "mes_referencia": mes_ref},
+                {
+                    "$set": {
+                        "valor_total": ciclo["valor_total"],
+                        "lancamentos_ids": ciclo["lancamentos_ids"],
+                        "data_vencimento": data_vencimento_ciclo(mes_ref, cartao),
+                    },
+                    "$setOnInsert": {
+                        "id": fatura_id(cartao_id, mes_ref),
+                        "valor_pago": 0.0,
+                        "status": "aberta",
+                        "criado_em": datetime.utcnow(),
+                    },
+                },
+                upsert=True,
+            )
+        )
+
+    meses = [c["_id"] for c in ciclos]
+    operacoes.append(
+        UpdateMany(
+            {"cartao_id": cartao_id, "mes_referencia": {"$nin": meses}},
+            {"$set": {"valor_total": 0.0, "lancamentos_ids": []}},
+        )
+    )
+    await db.faturas.bulk_write(operacoes, ordered=False)
+    invalidar_limites()
+    return sorted(meses)
+
+
+# Índice único que torna seguros os upserts concorrentes de `registrar_em_faturas`
+_INDICE_CICLO = [("cartao_id", 1), ("mes_referencia", 1)]
+_indice_ciclo_verificado = False
+
+
+async def _garantir_indice_ciclo() -> None:
+    """
+    Confere (uma vez por processo) que o índice único (cartao_id, mes_referencia)
+    existe. Sem ele, upserts concorrentes criariam faturas duplicadas para o
+    mesmo ciclo, então a escrita falha em vez de seguir.
+    """
+    global _indice_ciclo_verificado
+    if _indice_ciclo_verificado:
+        return
+    indices = await db.faturas.index_information()
+    if not any(
+        info.get("unique") and [(campo, int(ordem)) for campo, ordem in info["key"]] == _INDICE_CICLO
+        for info in indices.values()
+    ):
+        raise RuntimeError("Índice único (cartao_id, mes_referencia) ausente em `faturas`; rode criar_indices")
+    _indice_ciclo_verificado = True
+
+
+def _contribui_para_fatura(doc: dict) -> bool:
+    # data fora do formato YYYY-MM-DD não tem ciclo: o lançamento fica fora das faturas
+    return doc.get("forma") == "credito" and doc.get("tipo") == "saida" and data_valida(doc.get("data"))
+
+
+async def registrar_em_faturas(docs: List[dict], delta: int = 1) -> None:
+    """
+    Mantém `faturas.valor_total`/`lancamentos_ids` a partir das escritas de
+    lançamentos: delta=1 para inseridos, delta=-1 para removidos (numa edição,
+    chame com o documento antigo e depois com o novo).
+
+    As operações são condicionadas à presença do id na fatura, então repetir
+    a mesma escrita não conta o valor duas vezes. Tudo vai num único bulk_write.
+    """
+    docs = [d for d in docs if _contribui_para_fatura(d)]
+    if not docs:
+        return
+
+    ids_cartao = list({d["cartao_id"] for d in docs if d.get("cartao_id")})
+    donos = list({d.get("user_id") for d in docs} | {None})
+    cartoes = await db.cartoes.find(
+        {"$or": [{"id": {"$in": ids_cartao}}, {"ativo": True, "user_id": {"$in": donos}}]}
+    ).to_list(length=None)
+
+    operacoes = []
+    afetados = set()
+    for doc in docs:
+        cartao = cartao_do_lancamento(doc, cartoes)
+        if not cartao:
+            continue
+        afetados.add(cartao["id"])
+        mes_ref = mes_referencia_da_compra(doc["data"], cartao)
+        valor = float(doc.get("valor", 0))
+        chave = {"cartao_id": cartao["id"], "mes_referencia": mes_ref}
+
+        if delta > 0:
+            operacoes.append(
+                UpdateOne(
+                    {**chave, "lancamentos_ids": {"$ne": doc["id"]}},
+                    {
+                        "$inc": {"valor_total": valor},
+                        "$push": {"lancamentos_ids": doc["id"]},
+                        "$setOnInsert": {
+                            "id": fatura_id(cartao["id"], mes_ref),
+                            "valor_pago": 0.0,
+                            "data_vencimento": data_vencimento_ciclo(mes_ref, cartao),
+                            "status": "aberta",
+                            "criado_em": datetime.utcnow(),
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+        else:
+            operacoes.append(
+                UpdateOne(
+                    {**chave, "lancamentos_ids": doc["id"]},
+                    {"$inc": {"valor_total": -valor}, "$pull": {"lancamentos_ids": doc["id"]}},
+                )
+            )
+
+    invalidar_projecoes(afetados)
+    invalidar_limites()
+    if not operacoes:
+        return
+    if delta > 0:
+        await _garantir_indice_ciclo()
+    try:
+        await db.faturas.bulk_write(operacoes, ordered=False)
+    except BulkWriteError as e:
+        # upsert que colide com a fatura existente = lançamento já contado
+        erros = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if erros:
+            raise
+
+
+async def verificar_faturas(cartao: dict, corrigir: bool = False) -> dict:
+    """
+    Compara as faturas mantidas incrementalmente com um recálculo a partir dos
+    lançamentos. Com `corrigir=True`, reconstrói as divergentes via `recalcular_faturas`.
+    """
+    esperado = {c["_id"]: c for c in await _agregar_ciclos(cartao)}
+    armazenado = {
+        f["mes_referencia"]: f
+        async for f in db.faturas.find(
+            {"cartao_id": cartao["id"]},
+            {"_id": 0, "mes_referencia": 1, "valor_total": 1, "lancamentos_ids": 1},
+        )
+    }
+
+    divergencias = []
+    for mes_ref in sorted(set(esperado) | set(armazenado)):
+        calc = esperado.get(mes_ref, {})
+        atual = armazenado.get(mes_ref, {})
+        valor_calc = round(float(calc.get("valor_total", 0.0)), 2)
+        valor_atual = round(float(atual.get("valor_total", 0.0)), 2)
+        ids_calc = set(calc.get("lancamentos_ids", []))
+        ids_atual = set(atual.get("lancamentos_ids", []))
+        if valor_calc != valor_atual or ids_calc != ids_atual:
+            divergencias.append(
+                {
+                    "mes_referencia": mes_ref,
+                    "valor_armazenado": valor_atual,
+                    "valor_calculado": valor_calc,
+                    "faltando": sorted(ids_calc - ids_atual),
+                    "sobrando": sorted(ids_atual - ids_calc),
+                }
+            )
+
+    if corrigir and divergencias:
+        await recalcular_faturas(cartao)
+
+    return {"consistente": not divergencias, "divergencias": divergencias, "corrigido": corrigir and bool(divergencias)}
+
+
+# Cache LRU: (cartao_id, meses_ahead, resumido, dia) -> (faturas, calculado_em)
+_projecoes_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def invalidar_projecoes(cartao_ids: Optional[Iterable[str]] = None) -> None:
+    """Descarta projeções em cache dos cartões informados (ou de todos)."""
+    if cartao_ids is None:
+        _projecoes_cache.clear()
+        return
+    ids = set(cartao_ids)
+    for chave in [k for k in _projecoes_cache if k[0] in ids]:
+        del _projecoes_cache[chave]
+
+
+async def _filtro_parcelas_futuras(cartao: dict, hoje: datetime) -> dict:
+    return {
+        "$and": [
+            await filtro_lancamentos_cartao(cartao),
+            {"data": {"$gte": hoje.strftime("%Y-%m-%d")}},
+            {
+                "$or": [
+                    {"origem": "parcela_futura"},
+                    {"parcelas_total": {"$exists": True, "$gt": 1}},
+                ]
+            },
+        ]
+    }
+
+
+async def projetar_faturas_futuras(cartao: dict, meses_ahead: int = 6, resumido: bool = False) -> List[dict]:
+    """
+    Faturas futuras do cartão, agrupadas por ciclo numa agregação.
+
+    Com `resumido=True` retorna só totais e quantidades (os itens de cada mês
+    vêm de `lancamentos_do_ciclo`); senão inclui os lançamentos com os campos
+    de PROJECAO_LANCAMENTO. O resultado fica em cache até uma escrita de
+    crédito no cartão (ou PROJECAO_CACHE_TTL).
+    """
+    hoje = datetime.now()
+    chave = (cartao["id"], meses_ahead, resumido, hoje.strftime("%Y-%m-%d"))
+    em_cache = _projecoes_cache.get(chave)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= PROJECAO_CACHE_TTL:
+        _projecoes_cache.move_to_end(chave)
+        return list(em_cache[0])
+
+    grupo: dict = {
+        "_id": "$mes_referencia",
+        "valor_total": {"$sum": "$valor"},
+        "quantidade": {"$sum": 1},
+    }
+    if not resumido:
+        grupo["lancamentos"] = {
+            "$push": {campo: f"${campo}" for campo in PROJECAO_LANCAMENTO if campo != "_id"}
+        }
+
+    filtro = await _filtro_parcelas_futuras(cartao, hoje)
+    pipeline = [
+        {"$match": filtro},
+        uniao_parcelas(filtro),
+        *estagios_mes_referencia(cartao),
+        {"$group": grupo},
+        {"$sort": {"_id": 1}},
+    ]
+    ciclos = await db.lancamentos.aggregate(pipeline).to_list(length=None)
+
+    limite = (hoje + relativedelta(months=meses_ahead)).strftime("%Y-%m-%d")
+    resultado = []
+    for ciclo in ciclos:
+        mes_ref = ciclo["_id"]
+        vencimento = data_vencimento_ciclo(mes_ref, cartao)
+        # Limitar a N meses à frente
+        if vencimento > limite:
+            continue
+
+        fatura = {
+            "id": f"{cartao['id']}_{mes_ref}_futura",
+            "cartao_id": cartao["id"],
+            "mes_referencia": mes_ref,
+            "valor_total": ciclo["valor_total"],
+            "quantidade": ciclo["quantidade"],
+            "data_vencimento": vencimento,
+            "status": "futura",
+        }
+        if not resumido:
+            lancamentos = sorted(ciclo["lancamentos"], key=lambda x: x.get("data", ""))
+            fatura["lancamentos"] = lancamentos
+            fatura["lancamentos_ids"] = [l.get("id") for l in lancamentos]
+        resultado.append(fatura)
+
+    _projecoes_cache[chave] = (resultado, time.monotonic())
+    _projecoes_cache.move_to_end(chave)
+    # entradas de dias anteriores nunca mais são lidas: saem por ordem de uso
+    while len(_projecoes_cache) > PROJECAO_CACHE_MAX:
+        _projecoes_cache.popitem(last=False)
+    return list(resultado)
+
+
+async def pipeline_lancamentos_ciclos(
+    cartao: dict, de: str, ate: str, apenas_futuras: bool = False
+) -> List[dict]:
+    """
+    Pipeline dos lançamentos do cartão nos ciclos `de`..`ate` (YYYY-MM), em ordem
+    de ciclo e data. O primeiro `$match` já limita `data` ao intervalo possível
+    (compras do ciclo M são do mês M ou do anterior), usando o índice.
+    """
+    if apenas_futuras:
+        filtro = await _filtro_parcelas_futuras(cartao, datetime.now())
+    else:
+        filtro = await filtro_lancamentos_cartao(cartao)
+
+    inicio = (datetime.strptime(de, "%Y-%m") - relativedelta(months=1)).strftime("%Y-%m-01")
+    filtro = {"$and": [filtro, {"data": {"$gte": inicio, "$lte": f"{ate}-31"}}]}
+    return [
+        {"$match": filtro},
+        uniao_parcelas(filtro),
+        *estagios_mes_referencia(cartao),
+        {"$match": {"mes_referencia": {"$gte": de, "$lte": ate}}},
+        {"$sort": {"mes_referencia": 1, "data": 1}},
+        {"$project": {**PROJECAO_LANCAMENTO, "mes_referencia": 1, "tipo": 1, "forma": 1}},
+    ]
+
+
+async def lancamentos_do_ciclo(cartao: dict, mes_referencia: str) -> List[dict]:
+    """Parcelas futuras de um ciclo (carregamento sob demanda da projeção resumida)."""
+    pipeline = await pipeline_lancamentos_ciclos(cartao, mes_referencia, mes_referencia, apenas_futuras=True)
+    return await db.lancamentos.aggregate(pipeline).to_list(length=None)
+
+
+# ({cartao_id: limite_usado}, calculado_em, dia)
+_limites_cache: Optional[tuple] = None
+
+
+def invalidar_limites() -> None:
+    global _limites_cache
+    _limites_cache = None
+
+
+async def limites_usados() -> Dict[str, float]:
+    """
+    Limite comprometido de todos os cartões, numa agregação sobre `faturas`:
+    soma do saldo (valor_total - valor_pago) das faturas não pagas que ainda
+    não venceram, ou seja, o ciclo aberto, os fechados a vencer e os ciclos
+    futuros (mantidos por ciclo a partir de cada lançamento de crédito, já
+    com as parcelas pendentes). Faturas antigas sem pagamento conciliado não
+    entram, senão o limite usado cresceria sem parar com o histórico.
+    """
+    global _limites_cache
+
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    if (
+        _limites_cache is not None
+        and _limites_cache[2] == hoje
+        and time.monotonic() - _limites_cache[1] <= LIMITES_CACHE_TTL
+    ):
+        return _limites_cache[0]
+
+    pipeline = [
+        {"$match": {"status": {"$ne": "paga"}, "data_vencimento": {"$gte": hoje}}},
+        {
+            "$group": {
+                "_id": "$cartao_id",
+                "limite_usado": {
+                    "$sum": {"$max": [0, {"$subtract": ["$valor_total", {"$ifNull": ["$valor_pago", 0]}]}]}
+                },
+            }
+        },
+    ]
+    resumo = {
+        doc["_id"]: round(float(doc["limite_usado"]), 2)
+        async for doc in db.faturas.aggregate(pipeline)
+    }
+    _limites_cache = (resumo, time.monotonic(), hoje)
+    return resumo
+
+
+def aplicar_limites(cartao: dict, resumo: Dict[str, float]) -> dict:
+    """Preenche `limite_usado`/`limite_disponivel` do cartão a partir do resumo."""
+    usado = resumo.get(cartao.get("id"), 0.0)
+    cartao["limite_usado"] = usado
+    cartao["limite_disponivel"] = round(float(cartao.get("limite_total", 0.0)) - usado, 2)
+    return cartao
+
+
+async def transicionar_status_faturas() -> dict:
+    """
+    Rotina do agendador: marca como `vencida`, em lote, toda fatura aberta cujo
+    vencimento passou sem pagamento integral.
+    """
+    hoje = datetime.now().strftime("%Y-%m-%d")
+    resultado = await db.faturas.update_many(
+        {
+            "status": "aberta",
+            "data_vencimento": {"$lt": hoje},
+            "valor_total": {"$gt": 0},
+            "$expr": {"$lt": [{"$ifNull": ["$valor_pago", 0]}, "$valor_total"]},
+        },
+        {"$set": {"status": "vencida"}},
+    )
+    if resultado.modified_count:
+        # import local: utils.previsao importa este módulo (via utils.conciliacao)
+        from utils.previsao import invalidar_previsao
+
+        invalidar_previsao()
+    return {"vencidas": resultado.modified_count}
+
+
+async def precomputar_alertas() -> dict:
+    """
+    Rotina do agendador: monta um documento de alertas por usuário em `alertas`
+    (faturas vencidas e as que vencem em até ALERTAS_JANELA_DIAS), para que o
+    endpoint de alertas seja uma leitura de um documento.
+    """
+    limite = (datetime.now() + timedelta(days=ALERTAS_JANELA_DIAS)).strftime("%Y-%m-%d")
+    pipeline = [
+        {"$match": {"status": {"$in": ["aberta", "vencida"]}, "data_vencimento": {"$lte": limite}}},
+        {"$lookup": {"from": "cartoes", "localField": "cartao_id", "foreignField": "id", "as": "cartao"}},
+        {
+            "$project": {
+                "_id": 0,
+                "id": 1,
+                "cartao_id": 1,
+                "mes_referencia": 1,
+                "valor_total": 1,
+                "valor_pago": 1,
+                "data_vencimento": 1,
+                "status": 1,
+                "cartao_nome": {"$first": "$cartao.nome"},
+                "user_id": {"$ifNull": [{"$first": "$cartao.user_id"}, None]},
+            }
+        },
+        {"$sort": {"data_vencimento": 1}},
+        {"$group": {"_id": "$user_id", "faturas": {"$push": "$$ROOT"}}},
+    ]
+    grupos = await db.faturas.aggregate(pipeline).to_list(length=None)
+
+    agora = datetime.utcnow()
+    operacoes = [
+        ReplaceOne(
+            {"user_id": grupo["_id"]},
+            {"user_id": grupo["_id"], "faturas": grupo["faturas"], "gerado_em": agora},
+            upsert=True,
+        )
+        for grupo in grupos
+    ]
+    operacoes.append(DeleteMany({"user_id": {"$nin": [g["_id"] for g in grupos]}}))
+    await db.alertas.bulk_write(operacoes, ordered=False)
+    return {"usuarios": len(grupos)}
@@ -0,0 +1,263 @@
+"""
+Projeção de fixos (receitas e despesas recorrentes) por mês.
+
+Os fixos ativos de cada usuário são compilados uma vez em vetores NumPy
+(mês inicial, mês final, valor) e mantidos em cache até uma escrita em
+`fixos`. Projetar um intervalo é uma comparação vetorizada que gera a matriz
+(mês × fixo) com o valor de cada fixo em cada mês, sem laço em Python.
+
+Meses são representados como inteiros `ano * 12 + (mês - 1)`.
+
+`lancar_fixos` (rotina do agendador) grava os lançamentos mensais de cada fixo.
+"""
+
+from __future__ import annotations
+
+import calendar
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from server import db
+from utils.comerciante import normalizar_comerciante
+from utils.responsavel import registrar_responsavel
+from utils.metas import registrar_em_metas
+from utils.saldos import registrar_em_saldos
+
+FIXOS_CACHE_TTL = 300  # segundos; cobre escritas feitas por outros workers
+PROJECAO_MAX_MESES = 600  # 50 anos
+
+_SEM_FIM = np.iinfo(np.int32).max
+
+# Campos de cada fixo devolvidos junto da matriz
+_CAMPOS_FIXO = ("id", "descricao", "categoria", "tipo", "responsavel", "diaVencimento")
+
+
+def mes_para_indice(mes: str) -> int:
+    """'YYYY-MM' -> ano * 12 + (mês - 1). ValueError se o formato for inválido."""
+    ano, m = mes.split("-")
+    ano_i, mes_i = int(ano), int(m)
+    if len(ano) != 4 or not 1 <= mes_i <= 12:
+        raise ValueError(f"Mês inválido: {mes!r}")
+    return ano_i * 12 + mes_i - 1
+
+
+def indice_para_mes(indice: int) -> str:
+    return f"{indice // 12:04d}-{indice % 12 + 1:02d}"
+
+
+class FixosCompilados:
+    """Fixos ativos de um usuário como vetores alinhados (uma posição por fixo)."""
+
+    __slots__ = ("fixos", "inicio", "fim", "lancado", "valores", "sinais")
+
+    def __init__(self, fixos: List[dict]):
+        validos = []
+        inicio, fim, lancado, valores = [], [], [], []
+        for f in fixos:
+            try:
+                ini = mes_para_indice(f["mesInicio"])
+                fi = mes_para_indice(f["mesFim"]) if f.get("mesFim") else _SEM_FIM
+                la = mes_para_indice(f["lancado_ate"]) if f.get("lancado_ate") else -1
+            except (KeyError, ValueError, AttributeError):
+                continue  # fixo com datas inválidas não entra na projeção
+            validos.append({campo: f.get(campo) for campo in _CAMPOS_FIXO})
+            inicio.append(ini)
+            fim.append(fi)
+            lancado.append(la)
+            valores.append(float(f.get("valor", 0) or 0))
+
+        self.fixos = validos
+        self.inicio = np.array(inicio, dtype=np.int32)
+        self.fim = np.array(fim, dtype=np.int32)
+        self.lancado = np.array(lancado, dtype=np.int32)
+        self.valores = np.array(valores, dtype=np.float64)
+        self.sinais = np.array([1.0 if f["tipo"] == "entrada" else -1.0 for f in validos], dtype=np.float64)
+
+    def matriz(self, de: int, ate: int, pendentes: bool = False) -> np.ndarray:
+        """
+        Matriz (meses de `de` a `ate`) × fixos com o valor de cada fixo no mês
+        (0 fora da vigência). Com `pendentes=True`, zera também os meses que
+        `lancar_fixos` já gravou como lançamento.
+        """
+        meses = np.arange(de, ate + 1, dtype=np.int32)[:, None]
+        vigente = (meses >= self.inicio[None, :]) & (meses <= self.fim[None, :])
+        if pendentes:
+            vigente &= meses > self.lancado[None, :]
+        return np.where(vigente, self.valores[None, :], 0.0)
+
+
+# user_id -> (FixosCompilados, compilado_em); None agrupa os fixos sem usuário
+_fixos_cache: Dict[Optional[str], tuple] = {}
+
+
+def invalidar_fixos(*user_ids: Optional[str]) -> None:
+    """Descarta os fixos compilados dos usuários informados (ou de todos, sem argumentos)."""
+    if not user_ids:
+        _fixos_cache.clear()
+        return
+    for user_id in user_ids:
+        _fixos_cache.pop(user_id, None)
+
+
+async def carregar_fixos(user_id: Optional[str] = None) -> FixosCompilados:
+    """Fixos ativos do usuário, compilados e em cache até a próxima escrita em `fixos`."""
+    em_cache = _fixos_cache.get(user_id)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= FIXOS_CACHE_TTL:
+        return em_cache[0]
+
+    fixos = await db.fixos.find({"user_id": user_id, "ativo": {"$ne": False}}, {"_id": 0}).to_list(length=None)
+    compilados = FixosCompilados(fixos)
+    _fixos_cache[user_id] = (compilados, time.monotonic())
+    return compilados
+
+
+async def projetar_fixos(de: str, ate: str, user_id: Optional[str] = None) -> dict:
+    """
+    Projeção dos fixos de `de` a `ate` (YYYY-MM), em formato colunar:
+    `valores[i][j]` é o valor do fixo `fixos[j]` no mês `meses[i]`.
+    """
+    inicio, fim = mes_para_indice(de), mes_para_indice(ate)
+    if fim < inicio:
+        raise ValueError("'ate' deve ser igual ou posterior a 'de'")
+    if fim - inicio + 1 > PROJECAO_MAX_MESES:
+        raise ValueError(f"Intervalo máximo de {PROJECAO_MAX_MESES} meses")
+
+    compilados = await carregar_fixos(user_id)
+    matriz = compilados.matriz(inicio, fim)
+    entradas = matriz[:, compilados.sinais > 0].sum(axis=1)
+    saidas = matriz[:, compilados.sinais < 0].sum(axis=1)
+
+    return {
+        "meses": [indice_para_mes(i) for i in range(inicio, fim + 1)],
+        "fixos": compilados.fixos,
+        "valores": matriz.tolist(),
+        "entradas": entradas.tolist(),
+        "saidas": saidas.tolist(),
+        "saldo": (entradas - saidas).tolist(),
+    }
+
+
+def lancamento_fixo_id(fixo_id: str, mes: str) -> str:
+    """Id determinístico do lançamento de um fixo num mês (reexecuções não duplicam)."""
+    return f"fixo_{fixo_id}_{mes}"
+
+
+def _data_no_mes(indice: int, dia: int) -> str:
+    ano, mes = indice // 12, indice % 12 + 1
+    return f"{ano:04d}-{mes:02d}-{min(max(int(dia or 1), 1), calendar.monthrange(ano, mes)[1]):02d}"
+
+
+async def lancar_fixos(hoje: Optional[datetime] = None) -> dict:
+    """
+    Rotina do agendador: cria os lançamentos (origem 'fixo') de todo mês cujo
+    vencimento já chegou, desde o último lançado de cada fixo (`lancado_ate`),
+    o que recupera meses perdidos com o sistema fora do ar. Meses que já têm
+    um lançamento 'fixo' de mesma descrição criado pelo frontend são pulados.
+
+    É idempotente: os ids são determinísticos e a gravação é um upsert com
+    `$setOnInsert` (com índice único parcial), num único bulk_write por
+    execução; workers concorrentes não duplicam lançamentos.
+    """
+    hoje = hoje or datetime.now()
+    hoje_str = hoje.strftime("%Y-%m-%d")
+    mes_atual = hoje.year * 12 + hoje.month - 1
+
+    lancamentos: List[dict] = []
+    checkpoints: List[UpdateOne] = []
+    async for fixo in db.fixos.find({"ativo": {"$ne": False}}, {"_id": 0}):
+        try:
+            inicio = mes_para_indice(fixo["mesInicio"])
+            fim = mes_para_indice(fixo["mesFim"]) if fixo.get("mesFim") else mes_atual
+            if fixo.get("lancado_ate"):
+                inicio = max(inicio, mes_para_indice(fixo["lancado_ate"]) + 1)
+        except (KeyError, ValueError, AttributeError):
+            continue
+
+        ultimo = None
+        for indice in range(inicio, min(fim, mes_atual) + 1):
+            data = _data_no_mes(indice, fixo.get("diaVencimento", 1))
+            if data > hoje_str:
+                break
+            mes = indice_para_mes(indice)
+            lancamentos.append(
+                {
+                    "id": lancamento_fixo_id(fixo["id"], mes),
+                    "data": data,
+                    "descricao": fixo.get("descricao", ""),
+                    "categoria": fixo.get("categoria") or "Outros",
+                    "tipo": fixo.get("tipo", "saida"),
+                    "valor": float(fixo.get("valor", 0) or 0),
+                    "forma": "outro",
+                    "responsavel": fixo.get("responsavel"),
+                    "origem": "fixo",
+                    "observacao": f"Fixo {mes}",
+                    "fixo_id": fixo["id"],
+                    "user_id": fixo.get("user_id"),
+                    "merchant_key": normalizar_comerciante(fixo.get("descricao", "")),
+                }
+            )
+            ultimo = mes
+
+        if ultimo:
+            checkpoints.append(
+                UpdateOne(
+                    {"id": fixo["id"], "lancado_ate": fixo.get("lancado_ate")},
+                    {"$set": {"lancado_ate": ultimo}},
+                )
+            )
+
+    if not lancamentos:
+        return {"criados": 0}
+
+    # meses já lançados pelo gerador antigo do frontend (ids aleatórios, sem
+    # `fixo_id`): só avançam o checkpoint, sem criar outro lançamento
+    legados = {
+        (doc.get("user_id"), doc.get("descricao"), doc["data"][:7])
+        async for doc in db.lancamentos.find(
+            {
+                "origem": "fixo",
+                "fixo_id": {"$exists": False},
+                "descricao": {"$in": list({d["descricao"] for d in lancamentos})},
+                "data": {"$gte": min(d["data"] for d in lancamentos)[:7], "$lte": hoje_str},
+            },
+            {"_id": 0, "user_id": 1, "descricao": 1, "data": 1},
+        )
+    }
+    lancamentos = [
+        d
+        for d in lancamentos
+        if (d["user_id"], d["descricao"], d["data"][:7]) not in legados
+        and (None, d["descricao"], d["data"][:7]) not in legados
+    ]
+    if not lancamentos:
+        await db.fixos.bulk_write(checkpoints, ordered=False)
+        return {"criados": 0}
+
+    operacoes = [UpdateOne({"id": doc["id"]}, {"$setOnInsert": doc}, upsert=True) for doc in lancamentos]
+    try:
+        resultado = await db.lancamentos.bulk_write(operacoes, ordered=False)
+        inseridos = [lancamentos[i] for i in resultado.upserted_ids]
+    except BulkWriteError as e:
+        # outro worker inseriu o mesmo id ao mesmo tempo: já existe, nada a fazer
+        erros = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if erros:
+            raise
+        inseridos = [lancamentos[u["index"]] for u in e.details.get("upserted", [])]
+
+    await db.fixos.bulk_write(checkpoints, ordered=False)
+    registrar_responsavel(inseridos)
+    await registrar_em_saldos(inseridos)
+    await registrar_em_metas(inseridos)
+    # import local: utils.previsao e utils.pivot importam este módulo
+    from utils.pivot import invalidar_pivot
+    from utils.previsao import invalidar_previsao
+
+    invalidar_fixos()  # `lancado_ate` mudou: os pendentes da projeção também
+    invalidar_previsao()
+    invalidar_pivot()
+    return {"criados": len(inseridos), "meses": sorted({d["data"][:7] for d in inseridos})}
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from server import db
+
+
+async def criar_indices() -> None:
+    """
+    Cria os índices usados pelas consultas da API.
+    `create_index` é idempotente, então é seguro rodar a cada startup.
+    """
+    # regras de categorização por usuário, em ordem de prioridade (criação)
+    await db.regras_categorizacao.create_index([("user_id", 1), ("criado_em", 1)])
+
+    # lançamentos de crédito por cartão (ciclos de fatura) e faturas por ciclo
+    await db.lancamentos.create_index([("forma", 1), ("cartao_id", 1), ("data", 1)])
+    await db.faturas.create_index([("cartao_id", 1), ("mes_referencia", 1)], unique=True)
+
+    # alertas pré-calculados por usuário e varredura de vencimentos do agendador
+    await db.alertas.create_index("user_id", unique=True)
+    await db.faturas.create_index([("status", 1), ("data_vencimento", 1)])
+
+    # planos de parcelamento: um por compra, buscados por período nas expansões
+    await db.planos_parcelamento.create_index("id", unique=True)
+    await db.planos_parcelamento.create_index([("data_inicial", 1), ("data_final", 1)])
+    # parcelas de extratos posteriores casadas com as parcelas planejadas
+    await db.planos_parcelamento.create_index(
+        [("comerciante", 1), ("parcelas_total", 1), ("valor_centavos", 1), ("user_id", 1)]
+    )
+
+    # lançamentos gerados dos fixos: id determinístico, único mesmo com vários workers
+    await db.lancamentos.create_index(
+        "id", unique=True, partialFilterExpression={"origem": "fixo"}, name="id_fixo_unico"
+    )
+
+    # livro de saldos diários: um documento por usuário e ano
+    await db.saldos_diarios.create_index([("user_id", 1), ("ano", 1)], unique=True)
+
+    # lançamentos por comerciante normalizado (agrupamento, deduplicação, busca)
+    await db.lancamentos.create_index([("merchant_key", 1), ("data", 1)])
+
+    # metas: uma por categoria e usuário; contadores de consumo por mês; eventos de limiar
+    await db.metas.create_index("id", unique=True)
+    await db.metas.create_index([("user_id", 1), ("categoria", 1)], unique=True)
+    await db.metas_consumo.create_index([("user_id", 1), ("mes", 1), ("categoria", 1)], unique=True)
+    await db.metas_eventos.create_index("id", unique=True)
+    await db.metas_eventos.create_index([("user_id", 1), ("criado_em", -1)])
+
+    # carteira de investimentos por usuário, ativo e data
+    await db.investimentos.create_index([("user_id", 1), ("ativo", 1), ("data", 1)])
@@ -0,0 +1,51 @@
+"""
+Medição das sub-consultas de endpoints compostos.
+
+Cada etapa aguardada via `Cronometro.medir` tem sua duração registrada; o total
+fica no log (DEBUG) e no cabeçalho `Server-Timing`, que o DevTools do navegador
+mostra por requisição. Etapas disparadas juntas com `asyncio.gather` aparecem
+sobrepostas, então o caminho crítico é a maior delas, não a soma.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import Awaitable, Dict, Optional, TypeVar
+
+from fastapi import Response
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Cronometro:
+    __slots__ = ("nome", "tempos", "_inicio")
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.tempos: Dict[str, float] = {}
+        self._inicio = time.perf_counter()
+
+    async def medir(self, etapa: str, aguardavel: Awaitable[T]) -> T:
+        """Aguarda `aguardavel` e registra sua duração (ms) como `etapa`."""
+        inicio = time.perf_counter()
+        try:
+            return await aguardavel
+        finally:
+            self.tempos[etapa] = (time.perf_counter() - inicio) * 1000
+
+    def total(self) -> float:
+        return (time.perf_counter() - self._inicio) * 1000
+
+    def server_timing(self) -> str:
+        etapas = [f"{etapa};dur={ms:.1f}" for etapa, ms in self.tempos.items()]
+        return ", ".join(etapas + [f"total;dur={self.total():.1f}"])
+
+    def registrar(self, response: Optional[Response] = None) -> None:
+        """Loga as durações e, se houver resposta, preenche `Server-Timing`."""
+        cabecalho = self.server_timing()
+        logger.debug(f"{self.nome}: {cabecalho}")
+        if response is not None:
+            response.headers["Server-Timing"] = cabecalho
@@ -0,0 +1,205 @@
+"""
+Metas: orçamento mensal de gastos por categoria.
+
+`metas_consumo` guarda um contador por (usuário, mês, categoria) com o total
+gasto, atualizado com `$inc` a cada escrita de lançamento (CRUD, importação,
+fixos lançados). O consumo de um mês sai só desses contadores, sem varrer
+`lancamentos`; como todas as categorias são contadas, uma meta criada no meio
+do mês já começa com o gasto correto.
+
+Nas categorias com meta, o incremento é um `find_one_and_update` que devolve o
+total novo: comparar antes/depois com os limiares da meta (em cache por
+usuário) é O(1), e cada limiar cruzado para cima vira um evento em
+`metas_eventos` (no máximo um por meta, mês e limiar).
+"""
+
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import DeleteMany, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from server import db
+
+METAS_CACHE_TTL = 300  # segundos; cobre escritas feitas por outros workers
+
+# user_id -> ({categoria: meta}, carregado_em); None agrupa as metas sem usuário
+_metas_cache: Dict[Optional[str], tuple] = {}
+
+
+def invalidar_metas(*user_ids: Optional[str]) -> None:
+    """Descarta as metas em cache dos usuários informados (ou de todos, sem argumentos)."""
+    if not user_ids:
+        _metas_cache.clear()
+        return
+    for user_id in user_ids:
+        _metas_cache.pop(user_id, None)
+
+
+async def metas_por_categoria(user_id: Optional[str] = None) -> Dict[str, dict]:
+    """Metas ativas do usuário por categoria, em cache até a próxima escrita em `metas`."""
+    em_cache = _metas_cache.get(user_id)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= METAS_CACHE_TTL:
+        return em_cache[0]
+
+    metas = {
+        meta["categoria"]: meta
+        async for meta in db.metas.find({"user_id": user_id, "ativo": {"$ne": False}}, {"_id": 0})
+    }
+    _metas_cache[user_id] = (metas, time.monotonic())
+    return metas
+
+
+def _contribui_para_meta(doc: dict) -> bool:
+    # parcelas futuras (virtuais) ainda não são gasto do mês
+    return (
+        doc.get("tipo") == "saida"
+        and doc.get("origem") != "parcela_futura"
+        and bool(doc.get("data"))
+        and bool(doc.get("valor"))
+    )
+
+
+def _evento(meta: dict, mes: str, limiar: float, gasto: float) -> dict:
+    return {
+        "id": f"{meta['id']}_{mes}_{limiar:g}",
+        "meta_id": meta["id"],
+        "user_id": meta.get("user_id"),
+        "categoria": meta["categoria"],
+        "mes": mes,
+        "limiar": limiar,
+        "valor_limite": meta["valor_limite"],
+        "gasto": round(gasto, 2),
+        "criado_em": datetime.utcnow(),
+    }
+
+
+async def registrar_em_metas(docs: Iterable[dict], delta: int = 1) -> List[dict]:
+    """
+    Soma (delta=1) ou subtrai (delta=-1) os gastos nos contadores de
+    (usuário, mês, categoria). Retorna os eventos de limiar cruzado.
+    """
+    movimentos: Dict[tuple, float] = defaultdict(float)
+    for doc in docs:
+        if _contribui_para_meta(doc):
+            chave = (doc.get("user_id"), doc["data"][:7], doc.get("categoria") or "Outros")
+            movimentos[chave] += delta * float(doc["valor"])
+    movimentos = {chave: valor for chave, valor in movimentos.items() if valor}
+    if not movimentos:
+        return []
+
+    sem_meta: List[UpdateOne] = []
+    eventos: List[dict] = []
+    for (user_id, mes, categoria), valor in movimentos.items():
+        filtro = {"user_id": user_id, "mes": mes, "categoria": categoria}
+        meta = (await metas_por_categoria(user_id)).get(categoria)
+        if meta is None or valor < 0:
+            # só gastos a mais podem cruzar um limiar
+            sem_meta.append(UpdateOne(filtro, {"$inc": {"gasto": valor}}, upsert=True))
+            continue
+
+        contador = await db.metas_consumo.find_one_and_update(
+            filtro,
+            {"$inc": {"gasto": valor}},
+            projection={"_id": 0, "gasto": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        depois = contador["gasto"]
+        antes = depois - valor
+        eventos.extend(
+            _evento(meta, mes, limiar, depois)
+            for limiar in meta.get("limiares") or [1.0]
+            if antes < limiar * meta["valor_limite"] <= depois
+        )
+
+    if sem_meta:
+        await db.metas_consumo.bulk_write(sem_meta, ordered=False)
+    if eventos:
+        try:
+            await db.metas_eventos.insert_many([dict(e) for e in eventos], ordered=False)
+        except BulkWriteError as e:
+            # limiar já cruzado antes neste mês (gasto caiu e voltou a subir): não é evento novo
+            erros = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in erros):
+                raise
+            repetidos = {err["index"] for err in erros}
+            eventos = [ev for i, ev in enumerate(eventos) if i not in repetidos]
+    return eventos
+
+
+async def consumo_do_mes(mes: str, user_id: Optional[str] = None) -> List[dict]:
+    """Cada meta ativa com o gasto do mês, lido só dos contadores."""
+    metas = await metas_por_categoria(user_id)
+    if not metas:
+        return []
+    gastos = {
+        c["categoria"]: c["gasto"]
+        async for c in db.metas_consumo.find(
+            {"user_id": user_id, "mes": mes, "categoria": {"$in": list(metas)}},
+            {"_id": 0, "categoria": 1, "gasto": 1},
+        )
+    }
+
+    consumo = []
+    for categoria, meta in sorted(metas.items()):
+        gasto = round(max(gastos.get(categoria, 0.0), 0.0), 2)
+        limite = meta["valor_limite"]
+        consumo.append(
+            {
+                **meta,
+                "mes": mes,
+                "gasto": gasto,
+                "restante": round(limite - gasto, 2),
+                "percentual": round(gasto / limite * 100, 1) if limite else None,
+                "estourada": gasto > limite,
+                "limiares_atingidos": [l for l in meta.get("limiares") or [] if gasto >= l * limite],
+            }
+        )
+    return consumo
+
+
+async def reconstruir_consumo(user_id: Optional[str] = None, todos: bool = False) -> dict:
+    """
+    Recalcula `metas_consumo` a partir de `lancamentos` (de um usuário ou, com
+    `todos=True`, de todos) numa agregação. Eventos já gerados são mantidos.
+    """
+    filtro_usuario = {} if todos else {"user_id": user_id}
+    pipeline = [
+        {
+            "$match": {
+                **filtro_usuario,
+                "tipo": "saida",
+                "origem": {"$ne": "parcela_futura"},
+                "data": {"$type": "string"},
+            }
+        },
+        {
+            "$group": {
+                "_id": {
+                    # sem `user_id` e `user_id: null` caem no mesmo contador
+                    "user_id": {"$ifNull": ["$user_id", None]},
+                    "mes": {"$substrBytes": ["$data", 0, 7]},
+                    "categoria": {"$ifNull": ["$categoria", "Outros"]},
+                },
+                "gasto": {"$sum": "$valor"},
+            }
+        },
+    ]
+    contadores = [
+        InsertOne(
+            {
+                "user_id": item["_id"].get("user_id"),
+                "mes": item["_id"]["mes"],
+                "categoria": item["_id"]["categoria"],
+                "gasto": item["gasto"],
+            }
+        )
+        async for item in db.lancamentos.aggregate(pipeline, allowDiskUse=True)
+    ]
+    await db.metas_consumo.bulk_write([DeleteMany(filtro_usuario)] + contadores, ordered=True)
+    return {"contadores": len(contadores)}
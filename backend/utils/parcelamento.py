@@ -0,0 +1,371 @@
+"""
+Planos de parcelamento: uma compra parcelada vira um documento em
+`planos_parcelamento`, e as parcelas futuras são expandidas sob demanda.
+
+As parcelas virtuais têm o mesmo formato (e os mesmos ids `{id}_parcela_{n}`)
+dos antigos lançamentos `parcela_futura`, então faturas, exportações e o
+dashboard as tratam como lançamentos comuns:
+- em agregações, `uniao_parcelas(filtro)` acrescenta um `$unionWith` que
+  expande os planos no próprio Mongo;
+- fora delas, `parcelas_virtuais(prefixo)` expande em Python, com cache por
+  período (mês/ano) invalidado nas escritas de planos.
+
+Editar ou excluir uma parcela virtual (`separar_parcela`) a marca em
+`excluidas` no plano; a edição vira um lançamento físico com o mesmo id.
+O mesmo acontece quando um extrato posterior traz a parcela ("Parcela 2 de 4"):
+`localizar_parcelas_planejadas` a encontra pelo índice (comerciante, total de
+parcelas, valor em centavos) e a importação a confirma com o id da parcela.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+from pymongo import ReplaceOne, UpdateOne
+
+from server import db
+from utils.comerciante import normalizar_comerciante
+
+PARCELAS_CACHE_TTL = 300  # segundos; cobre escritas feitas por outros workers
+
+_ID_PARCELA = re.compile(r"^(?P<plano>.+)_parcela_(?P<numero>\d+)$")
+
+# Campos copiados do plano para cada parcela
+_CAMPOS_PLANO = ("categoria", "tipo", "forma", "responsavel", "user_id", "cartao_id", "parcelas_total")
+
+
+def _centavos(valor) -> int:
+    return int(round(float(valor or 0) * 100))
+
+
+def criar_plano(doc: dict, parcela_inicial: int = 2, banco_origem: str = "") -> dict:
+    """
+    Plano das parcelas `parcela_inicial`..N da compra `doc` (a primeira parcela,
+    já gravada em `lancamentos`). Cada parcela vale `valor / parcelas_total`.
+    """
+    total = int(doc["parcelas_total"])
+    data_inicial = datetime.strptime(doc["data"], "%Y-%m-%d")
+    return {
+        "id": doc["id"],
+        "descricao": doc["descricao"],
+        "categoria": doc.get("categoria") or "Outros",
+        "tipo": doc.get("tipo", "saida"),
+        "forma": doc.get("forma"),
+        "responsavel": doc.get("responsavel"),
+        "user_id": doc.get("user_id"),
+        "cartao_id": doc.get("cartao_id"),
+        "valor_parcela": doc["valor"] / total,
+        "valor_centavos": _centavos(doc["valor"] / total),
+        "comerciante": normalizar_comerciante(doc["descricao"]),
+        "parcelas_total": total,
+        "parcela_inicial": parcela_inicial,
+        "excluidas": [],
+        "data_inicial": doc["data"],
+        # permite buscar por período sem expandir
+        "data_final": (data_inicial + relativedelta(months=total - 1)).strftime("%Y-%m-%d"),
+        "banco_origem": banco_origem,
+        "criado_em": datetime.utcnow(),
+    }
+
+
+def parcela_do_plano(plano: dict, numero: int) -> dict:
+    data = datetime.strptime(plano["data_inicial"], "%Y-%m-%d") + relativedelta(months=numero - 1)
+    total = plano["parcelas_total"]
+    parcela = {campo: plano.get(campo) for campo in _CAMPOS_PLANO}
+    parcela.update(
+        {
+            "id": f"{plano['id']}_parcela_{numero}",
+            "data": data.strftime("%Y-%m-%d"),
+            "descricao": f"{plano['descricao']} (Parcela {numero}/{total})",
+            "valor": plano["valor_parcela"],
+            "origem": "parcela_futura",
+            "parcela_atual": numero,
+            "observacao": f"Parcela {numero} de {total} - {plano.get('banco_origem', '')}",
+            "plano_id": plano["id"],
+            "merchant_key": plano.get("comerciante"),
+        }
+    )
+    return parcela
+
+
+def expandir_plano(plano: dict) -> List[dict]:
+    """Parcelas virtuais do plano (menos as excluídas), como lançamentos."""
+    excluidas = set(plano.get("excluidas") or [])
+    return [
+        parcela_do_plano(plano, n)
+        for n in range(plano["parcela_inicial"], plano["parcelas_total"] + 1)
+        if n not in excluidas
+    ]
+
+
+def estagios_expansao() -> List[dict]:
+    """Estágios que transformam documentos de `planos_parcelamento` em parcelas (igual a `expandir_plano`)."""
+    numero = {"$toString": "$_numero"}
+    total = {"$toString": "$parcelas_total"}
+    return [
+        {
+            "$addFields": {
+                "_numero": {
+                    "$setDifference": [
+                        {"$range": ["$parcela_inicial", {"$add": ["$parcelas_total", 1]}]},
+                        {"$ifNull": ["$excluidas", []]},
+                    ]
+                }
+            }
+        },
+        {"$unwind": "$_numero"},
+        {
+            "$project": {
+                "_id": 0,
+                **{campo: 1 for campo in _CAMPOS_PLANO},
+                "id": {"$concat": ["$id", "_parcela_", numero]},
+                "data": {
+                    "$dateToString": {
+                        "format": "%Y-%m-%d",
+                        "date": {
+                            "$dateAdd": {
+                                "startDate": {"$dateFromString": {"dateString": "$data_inicial", "format": "%Y-%m-%d"}},
+                                "unit": "month",
+                                "amount": {"$subtract": ["$_numero", 1]},
+                            }
+                        },
+                    }
+                },
+                "descricao": {"$concat": ["$descricao", " (Parcela ", numero, "/", total, ")"]},
+                "valor": "$valor_parcela",
+                "origem": {"$literal": "parcela_futura"},
+                "parcela_atual": "$_numero",
+                "observacao": {
+                    "$concat": ["Parcela ", numero, " de ", total, " - ", {"$ifNull": ["$banco_origem", ""]}]
+                },
+                "plano_id": "$id",
+                "merchant_key": "$comerciante",
+            }
+        },
+    ]
+
+
+def uniao_parcelas(filtro: Optional[dict] = None) -> dict:
+    """
+    `$unionWith` que acrescenta as parcelas virtuais (filtradas por `filtro`,
+    o mesmo aplicado aos lançamentos) a uma agregação sobre `lancamentos`.
+    """
+    pipeline = estagios_expansao()
+    if filtro:
+        pipeline.append({"$match": filtro})
+    return {"$unionWith": {"coll": "planos_parcelamento", "pipeline": pipeline}}
+
+
+# prefixo de data ("", "YYYY" ou "YYYY-MM") -> (parcelas, calculado_em)
+_parcelas_cache: Dict[str, tuple] = {}
+
+
+def invalidar_parcelas() -> None:
+    _parcelas_cache.clear()
+
+
+async def parcelas_virtuais(prefixo: str = "") -> List[dict]:
+    """
+    Parcelas virtuais com `data` começando por `prefixo` (mês, ano ou todas),
+    materializadas em cache por período até a próxima escrita de planos.
+    """
+    em_cache = _parcelas_cache.get(prefixo)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= PARCELAS_CACHE_TTL:
+        return list(em_cache[0])
+
+    filtro: dict = {}
+    if prefixo:
+        # planos cujo intervalo [data_inicial, data_final] cruza o período
+        filtro = {"data_inicial": {"$lte": f"{prefixo}-99"}, "data_final": {"$gte": prefixo}}
+    parcelas = [
+        parcela
+        async for plano in db.planos_parcelamento.find(filtro, {"_id": 0})
+        for parcela in expandir_plano(plano)
+        if parcela["data"].startswith(prefixo)
+    ]
+    _parcelas_cache[prefixo] = (parcelas, time.monotonic())
+    return list(parcelas)
+
+
+async def gravar_planos(planos: List[dict]) -> None:
+    """Grava os planos (substituindo um plano de mesmo id) num único bulk_write."""
+    if not planos:
+        return
+    await db.planos_parcelamento.bulk_write(
+        [ReplaceOne({"id": p["id"]}, p, upsert=True) for p in planos], ordered=False
+    )
+    invalidar_parcelas()
+
+
+async def localizar_parcelas_planejadas(transacoes: Iterable) -> Dict[str, Tuple[dict, int]]:
+    """
+    Casa parcelas de extrato (parcela_atual > 1) com parcelas ainda virtuais
+    dos planos, numa única consulta pelo índice de metadados. Chave do hash
+    join: (dono, comerciante, total de parcelas, valor em centavos ±1, que
+    cobre o arredondamento da divisão). Retorna {id da transação: (plano, número)}.
+    """
+    candidatas = [
+        t for t in transacoes
+        if t.parcela_atual and t.parcelas_total and 1 < t.parcela_atual <= t.parcelas_total
+    ]
+    if not candidatas:
+        return {}
+
+    chaves = {t.id: normalizar_comerciante(t.descricao) for t in candidatas}
+    centavos = {c + d for t in candidatas for c in [_centavos(t.valor)] for d in (-1, 0, 1)}
+    cursor = db.planos_parcelamento.find(
+        {
+            "comerciante": {"$in": list(set(chaves.values()))},
+            "parcelas_total": {"$in": list({t.parcelas_total for t in candidatas})},
+            "valor_centavos": {"$in": list(centavos)},
+        },
+        {"_id": 0},
+    )
+    tabela: Dict[tuple, List[dict]] = {}
+    async for plano in cursor:
+        chave = (plano.get("user_id"), plano["comerciante"], plano["parcelas_total"], plano["valor_centavos"])
+        tabela.setdefault(chave, []).append(plano)
+
+    encontradas: Dict[str, Tuple[dict, int]] = {}
+    usadas = set()
+    for t in candidatas:
+        for d in (0, -1, 1):
+            chave = (t.user_id, chaves[t.id], t.parcelas_total, _centavos(t.valor) + d)
+            plano = next(
+                (
+                    p for p in tabela.get(chave, [])
+                    if p["parcela_inicial"] <= t.parcela_atual
+                    and t.parcela_atual not in (p.get("excluidas") or [])
+                    and (p["id"], t.parcela_atual) not in usadas
+                ),
+                None,
+            )
+            if plano:
+                usadas.add((plano["id"], t.parcela_atual))
+                encontradas[t.id] = (plano, t.parcela_atual)
+                break
+    return encontradas
+
+
+async def confirmar_parcelas(confirmadas: List[Tuple[str, int]]) -> None:
+    """Retira dos planos, num bulk_write, as parcelas que passaram a existir como lançamentos."""
+    if not confirmadas:
+        return
+    await db.planos_parcelamento.bulk_write(
+        [
+            UpdateOne({"id": plano_id, "excluidas": {"$ne": numero}}, {"$push": {"excluidas": numero}})
+            for plano_id, numero in confirmadas
+        ],
+        ordered=False,
+    )
+    invalidar_parcelas()
+
+
+async def separar_parcela(lancamento_id: str) -> Optional[dict]:
+    """
+    Retira uma parcela virtual do seu plano (para editar ou excluir) e a
+    devolve como lançamento. None se o id não é de uma parcela virtual.
+    """
+    m = _ID_PARCELA.match(lancamento_id)
+    if not m:
+        return None
+    numero = int(m.group("numero"))
+    plano = await db.planos_parcelamento.find_one_and_update(
+        {
+            "id": m.group("plano"),
+            "parcela_inicial": {"$lte": numero},
+            "parcelas_total": {"$gte": numero},
+            "excluidas": {"$ne": numero},
+        },
+        {"$push": {"excluidas": numero}},
+        projection={"_id": 0},
+    )
+    if plano is None:
+        return None
+    invalidar_parcelas()
+    return parcela_do_plano(plano, numero)
+
+
+_CAMPOS_CONFERIDOS = ("id", "data", "descricao", "valor", "categoria", "tipo", "forma", "responsavel", "user_id", "cartao_id")
+
+
+async def migrar_parcelas_fisicas() -> dict:
+    """
+    Converte os lançamentos `parcela_futura` gravados um a um em planos.
+    Ids, datas e valores são preservados, então as faturas não mudam. Grupos
+    cujas parcelas não são reproduzidas exatamente pelo plano (ex: editadas à
+    mão) ficam como estão. Também preenche o índice de metadados (comerciante,
+    valor em centavos) de planos gravados antes dele e atualiza chaves de
+    comerciante calculadas por versões anteriores do normalizador.
+    """
+    grupos: Dict[str, List[dict]] = {}
+    async for doc in db.lancamentos.find({"origem": "parcela_futura"}, {"_id": 0}):
+        m = _ID_PARCELA.match(doc.get("id", ""))
+        if m and doc.get("parcela_atual") and doc.get("parcelas_total"):
+            grupos.setdefault(m.group("plano"), []).append(doc)
+    # a compra original dá a data exata da 1ª parcela (sem o arredondamento de fim de mês)
+    originais = {
+        doc["id"]: doc
+        async for doc in db.lancamentos.find({"id": {"$in": list(grupos)}}, {"_id": 0, "id": 1, "data": 1})
+    }
+
+    planos: List[dict] = []
+    removidos: List[str] = []
+    ignorados = 0
+    for plano_id, parcelas in grupos.items():
+        parcelas.sort(key=lambda d: d["parcela_atual"])
+        primeira = parcelas[0]
+        numero, total = int(primeira["parcela_atual"]), int(primeira["parcelas_total"])
+
+        if plano_id in originais:
+            data_inicial = originais[plano_id]["data"]
+        else:
+            data_inicial = max(
+                (datetime.strptime(p["data"], "%Y-%m-%d") - relativedelta(months=int(p["parcela_atual"]) - 1))
+                for p in parcelas
+            ).strftime("%Y-%m-%d")
+
+        sufixo = f" (Parcela {numero}/{total})"
+        descricao = primeira["descricao"]
+        plano = criar_plano(
+            {
+                **primeira,
+                "id": plano_id,
+                "data": data_inicial,
+                "descricao": descricao[: -len(sufixo)] if descricao.endswith(sufixo) else descricao,
+                "valor": primeira["valor"] * total,
+            },
+            parcela_inicial=numero,
+            banco_origem=str(primeira.get("observacao", "")).partition(" - ")[2],
+        )
+        plano["valor_parcela"] = primeira["valor"]
+        plano["valor_centavos"] = _centavos(primeira["valor"])
+        presentes = {int(p["parcela_atual"]) for p in parcelas}
+        plano["excluidas"] = [n for n in range(numero, total + 1) if n not in presentes]
+
+        esperadas = {p["id"]: p for p in expandir_plano(plano)}
+        if len(esperadas) != len(parcelas) or any(
+            p["id"] not in esperadas
+            or any(esperadas[p["id"]].get(c) != p.get(c) for c in _CAMPOS_CONFERIDOS)
+            for p in parcelas
+        ):
+            ignorados += 1
+            continue
+
+        planos.append(plano)
+        removidos.extend(esperadas)
+
+    # planos gravados antes do índice de metadados ou com a chave de comerciante antiga
+    async for p in db.planos_parcelamento.find({}, {"_id": 0}):
+        chave = normalizar_comerciante(p["descricao"])
+        if p.get("comerciante") != chave or "valor_centavos" not in p:
+            planos.append({**p, "comerciante": chave, "valor_centavos": _centavos(p["valor_parcela"])})
+
+    await gravar_planos(planos)
+    if removidos:
+        await db.lancamentos.delete_many({"id": {"$in": removidos}})
+    return {"planos": len(planos), "lancamentos_removidos": len(removidos), "ignorados": ignorados}
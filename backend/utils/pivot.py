@@ -0,0 +1,104 @@
+"""
+Pivot de lançamentos: valor por categoria (opcionalmente × responsável ou
+forma) e mês, para análises de tendência em vários anos.
+
+Um único `$group` (com as parcelas virtuais via `$unionWith`) devolve um total
+por (mês, categoria[, dimensão]); o pandas reorganiza em matriz densa
+(linhas × meses, zeros onde não houve movimento). A resposta é colunar:
+rótulos das linhas, rótulos das colunas e a matriz de valores.
+
+Resultados ficam em cache por conjunto de parâmetros até uma escrita em
+lançamentos (`invalidar_pivot`) ou PIVOT_CACHE_TTL.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+
+from server import db
+from utils.fixos import indice_para_mes, mes_para_indice
+from utils.parcelamento import uniao_parcelas
+
+PIVOT_CACHE_TTL = 300
+PIVOT_CACHE_MAX = 64  # conjuntos de parâmetros mantidos
+PIVOT_MAX_MESES = 240
+PIVOT_DIMENSOES = ("responsavel", "forma")
+
+# (de, ate, dividir_por, tipo, user_id) -> (pivot, calculado_em), do mais antigo ao mais recente
+_pivot_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def invalidar_pivot() -> None:
+    _pivot_cache.clear()
+
+
+async def pivot_lancamentos(
+    de: str,
+    ate: str,
+    dividir_por: Optional[str] = None,
+    tipo: str = "saida",
+    user_id: Optional[str] = None,
+) -> dict:
+    """
+    Matriz (categoria[, dimensão]) × mês com a soma dos lançamentos do `tipo`
+    de `de` a `ate` (YYYY-MM). `valores[i][j]` é da linha `linhas[i]` no mês
+    `colunas[j]`; com `dividir_por`, cada linha é `[categoria, valor da dimensão]`.
+    """
+    inicio, fim = mes_para_indice(de), mes_para_indice(ate)
+    if fim < inicio:
+        raise ValueError("'ate' deve ser igual ou posterior a 'de'")
+    if fim - inicio + 1 > PIVOT_MAX_MESES:
+        raise ValueError(f"Intervalo máximo de {PIVOT_MAX_MESES} meses")
+    if dividir_por is not None and dividir_por not in PIVOT_DIMENSOES:
+        raise ValueError(f"'dividir_por' deve ser um de: {', '.join(PIVOT_DIMENSOES)}")
+
+    chave = (de, ate, dividir_por, tipo, user_id)
+    em_cache = _pivot_cache.get(chave)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= PIVOT_CACHE_TTL:
+        return em_cache[0]
+
+    filtro: dict = {"tipo": tipo, "data": {"$gte": f"{de}-01", "$lte": f"{ate}-31"}}
+    if user_id:
+        filtro["user_id"] = user_id
+    grupo = {"mes": {"$substrBytes": ["$data", 0, 7]}, "categoria": {"$ifNull": ["$categoria", "Outros"]}}
+    if dividir_por:
+        grupo["dimensao"] = {"$ifNull": [f"${dividir_por}", "Outro"]}
+    pipeline = [
+        {"$match": filtro},
+        uniao_parcelas(filtro),
+        {"$group": {"_id": grupo, "valor": {"$sum": "$valor"}}},
+    ]
+    grupos = await db.lancamentos.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+    meses = [indice_para_mes(i) for i in range(inicio, fim + 1)]
+    indice = ["categoria", "dimensao"] if dividir_por else ["categoria"]
+    df = pd.DataFrame([{**g["_id"], "valor": g["valor"]} for g in grupos], columns=["mes", *indice, "valor"])
+    matriz = (
+        df.pivot_table(index=indice, columns="mes", values="valor", aggfunc="sum", fill_value=0.0)
+        .reindex(columns=meses, fill_value=0.0)
+        .round(2)
+    )
+    # linhas de maior total primeiro
+    totais_linha = matriz.sum(axis=1)
+    matriz = matriz.loc[totais_linha.sort_values(ascending=False, kind="stable").index]
+
+    pivot = {
+        "linhas": [list(r) if isinstance(r, tuple) else r for r in matriz.index.tolist()],
+        "colunas": meses,
+        "valores": matriz.to_numpy().tolist(),
+        "total_linhas": matriz.sum(axis=1).round(2).tolist(),
+        "total_colunas": matriz.sum(axis=0).round(2).tolist(),
+        "dividir_por": dividir_por,
+        "tipo": tipo,
+        "calculado_em": datetime.now().isoformat(),
+    }
+    _pivot_cache[chave] = (pivot, time.monotonic())
+    _pivot_cache.move_to_end(chave)
+    while len(_pivot_cache) > PIVOT_CACHE_MAX:
+        _pivot_cache.popitem(last=False)
+    return pivot
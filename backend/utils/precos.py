@@ -0,0 +1,137 @@
+"""
+Base local de preços de ativos (sem acesso à rede).
+
+Cada ativo é um arquivo em PRECOS_DIR (`BTC.csv`, `BNB.parquet`, ...) com as
+colunas de data (`data`/`date`) e preço em BRL (`preco`/`price`/`close`).
+Na primeira leitura, a série é ordenada e gravada como `.npy` em
+`PRECOS_DIR/.cache`; daí em diante é aberta com `mmap_mode="r"`, então dezenas
+de ativos com anos de preços diários não ocupam memória do processo nem são
+relidos. O cache é refeito quando o arquivo de origem fica mais novo.
+
+Dias são inteiros (dias desde 1970-01-01); o preço num dia é o último
+conhecido até ele (busca binária vetorizada).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PRECOS_DIR = Path(os.environ.get("PRECOS_DIR", Path(__file__).resolve().parent.parent / "data" / "precos"))
+
+_COLUNAS_DATA = ("data", "date")
+_COLUNAS_PRECO = ("preco", "price", "close", "fechamento")
+_EXTENSOES = (".csv", ".parquet")
+
+
+def datas_para_dias(datas) -> np.ndarray:
+    """Datas (strings YYYY-MM-DD ou datetime64) -> dias desde 1970-01-01 (int64)."""
+    return np.asarray(datas, dtype="datetime64[D]").astype(np.int64)
+
+
+class SeriePrecos:
+    """Série de preços de um ativo (vetores possivelmente mapeados em memória)."""
+
+    __slots__ = ("ativo", "dias", "precos")
+
+    def __init__(self, ativo: str, dias: np.ndarray, precos: np.ndarray):
+        self.ativo = ativo
+        self.dias = dias
+        self.precos = precos
+
+    def precos_em(self, dias: np.ndarray) -> np.ndarray:
+        """Último preço conhecido em cada dia (antes do primeiro preço, usa o primeiro)."""
+        idx = np.searchsorted(self.dias, dias, side="right") - 1
+        return self.precos[np.clip(idx, 0, len(self.precos) - 1)]
+
+    def ultimo(self) -> dict:
+        return {
+            "ativo": self.ativo,
+            "data": str(np.datetime64(int(self.dias[-1]), "D")),
+            "preco": float(self.precos[-1]),
+            "desde": str(np.datetime64(int(self.dias[0]), "D")),
+            "pontos": int(len(self.dias)),
+        }
+
+
+def _coluna(df: pd.DataFrame, nomes) -> Optional[str]:
+    colunas = {str(c).strip().lower(): c for c in df.columns}
+    return next((colunas[n] for n in nomes if n in colunas), None)
+
+
+def _ler_arquivo(caminho: Path) -> tuple:
+    """Lê CSV/Parquet e devolve (dias, preços) ordenados, um preço por dia (o último)."""
+    df = pd.read_parquet(caminho) if caminho.suffix == ".parquet" else pd.read_csv(caminho, sep=None, engine="python")
+    col_data, col_preco = _coluna(df, _COLUNAS_DATA), _coluna(df, _COLUNAS_PRECO)
+    if col_data is None or col_preco is None:
+        raise ValueError(f"colunas de data/preço não encontradas em {caminho.name}")
+
+    serie = pd.DataFrame(
+        {
+            "dia": pd.to_datetime(df[col_data], errors="coerce").dt.normalize(),
+            "preco": pd.to_numeric(df[col_preco], errors="coerce"),
+        }
+    ).dropna()
+    serie = serie.drop_duplicates("dia", keep="last").sort_values("dia")
+    return datas_para_dias(serie["dia"].values), serie["preco"].to_numpy(dtype=np.float64)
+
+
+def _carregar_serie(caminho: Path) -> SeriePrecos:
+    ativo = caminho.stem.upper()
+    cache = PRECOS_DIR / ".cache"
+    arq_dias, arq_precos = cache / f"{ativo}_dias.npy", cache / f"{ativo}_precos.npy"
+
+    origem_mtime = caminho.stat().st_mtime
+    if not (arq_precos.exists() and arq_precos.stat().st_mtime >= origem_mtime):
+        dias, precos = _ler_arquivo(caminho)
+        if not len(dias):
+            raise ValueError(f"nenhum preço válido em {caminho.name}")
+        cache.mkdir(parents=True, exist_ok=True)
+        np.save(arq_dias, dias)
+        np.save(arq_precos, precos)
+
+    return SeriePrecos(ativo, np.load(arq_dias, mmap_mode="r"), np.load(arq_precos, mmap_mode="r"))
+
+
+_series: Dict[str, SeriePrecos] = {}
+_ultimos: Dict[str, dict] = {}
+
+
+def carregar_precos(recarregar: bool = False) -> Dict[str, SeriePrecos]:
+    """
+    Séries de todos os ativos de PRECOS_DIR (carregadas uma vez; `recarregar`
+    relê o diretório, aproveitando os `.npy` ainda válidos). Arquivos inválidos
+    são ignorados com aviso no log.
+    """
+    if _series and not recarregar:
+        return _series
+
+    series: Dict[str, SeriePrecos] = {}
+    if PRECOS_DIR.is_dir():
+        for caminho in sorted(PRECOS_DIR.iterdir()):
+            if caminho.suffix.lower() not in _EXTENSOES:
+                continue
+            try:
+                series[caminho.stem.upper()] = _carregar_serie(caminho)
+            except (ImportError, OSError, ValueError) as e:
+                # ImportError: parquet sem pyarrow/fastparquet instalado
+                logger.warning(f"Preços de {caminho.name} ignorados: {e}")
+
+    _series.clear()
+    _series.update(series)
+    _ultimos.clear()
+    return _series
+
+
+def ultimos_precos() -> Dict[str, dict]:
+    """Último preço de cada ativo (em cache até o próximo recarregamento)."""
+    if not _ultimos:
+        _ultimos.update({ativo: serie.ultimo() for ativo, serie in carregar_precos().items()})
+    return _ultimos
@@ -0,0 +1,263 @@
+"""
+Previsão de fluxo de caixa: saldo ao fim de cada um dos próximos meses.
+
+Junta, em baldes mensais (mês atual + N-1), tudo o que já se sabe do futuro:
+- saldo atual: lançamentos fora do crédito até hoje (compras no crédito só
+  saem do caixa quando a fatura é paga);
+- faturas em aberto (inclusive as parcelas futuras), no mês do vencimento;
+  as vencidas há até PREVISAO_FATURAS_ATRASO_DIAS entram no mês atual;
+- lançamentos já agendados fora do crédito (menos os de fixos, que vêm da
+  projeção dos fixos);
+- fixos ainda não lançados (`FixosCompilados.matriz(pendentes=True)`);
+- média mensal histórica dos gastos/receitas variáveis, por categoria.
+
+Cada fonte vira vetores (mês, categoria, valor com sinal) somados numa matriz
+mês × categoria com `np.add.at`; o saldo é o `cumsum` das linhas. O resultado
+fica em cache por usuário até uma escrita em lançamentos/fixos/faturas
+(`invalidar_previsao`) ou PREVISAO_CACHE_TTL.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import calendar
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from server import db
+from utils.conciliacao import PALAVRAS_PAGAMENTO_FATURA
+from utils.fixos import FixosCompilados, carregar_fixos, indice_para_mes
+from utils.parcelamento import uniao_parcelas
+
+PREVISAO_CACHE_TTL = 300
+PREVISAO_MESES_HISTORICO = 6  # meses completos usados na média de gastos variáveis
+PREVISAO_MAX_MESES = 60
+# faturas vencidas há mais tempo sem pagamento conciliado são histórico, não dívida a pagar
+PREVISAO_FATURAS_ATRASO_DIAS = 40
+
+CATEGORIA_CARTAO = "Cartão de crédito"
+
+# user_id -> {meses: (previsão, calculada_em)}
+_previsoes_cache: Dict[Optional[str], Dict[int, tuple]] = {}
+
+
+def invalidar_previsao(user_id: Optional[str] = None) -> None:
+    """Descarta as previsões do usuário (ou de todos, sem argumento)."""
+    if user_id is None:
+        _previsoes_cache.clear()
+    else:
+        _previsoes_cache.pop(user_id, None)
+        _previsoes_cache.pop(None, None)  # a previsão geral inclui todos os usuários
+
+
+async def _fixos_do_escopo(user_id: Optional[str]) -> FixosCompilados:
+    """Fixos do usuário; na previsão geral, os de todos (o mesmo escopo dos lançamentos e faturas)."""
+    if user_id:
+        return await carregar_fixos(user_id)
+    fixos = await db.fixos.find({"ativo": {"$ne": False}}, {"_id": 0}).to_list(length=None)
+    return FixosCompilados(fixos)
+
+
+def _sinal(tipo: str) -> float:
+    return 1.0 if tipo == "entrada" else -1.0
+
+
+async def _saldo_atual(filtro_usuario: dict, hoje: str) -> float:
+    pipeline = [
+        {"$match": {**filtro_usuario, "data": {"$lte": hoje}, "forma": {"$ne": "credito"}}},
+        {
+            "$group": {
+                "_id": None,
+                "saldo": {"$sum": {"$cond": [{"$eq": ["$tipo", "entrada"]}, "$valor", {"$multiply": ["$valor", -1]}]}},
+            }
+        },
+    ]
+    resultado = await db.lancamentos.aggregate(pipeline).to_list(length=1)
+    return float(resultado[0]["saldo"]) if resultado else 0.0
+
+
+async def _faturas_a_pagar(user_id: Optional[str], agora: datetime) -> List[dict]:
+    """
+    Saldo devedor de cada fatura em aberto/vencida, com o mês de vencimento:
+    as que ainda vão vencer e as vencidas há no máximo PREVISAO_FATURAS_ATRASO_DIAS.
+    """
+    desde = (agora - timedelta(days=PREVISAO_FATURAS_ATRASO_DIAS)).strftime("%Y-%m-%d")
+    pipeline: List[dict] = [
+        {
+            "$match": {
+                "status": {"$in": ["aberta", "vencida"]},
+                "valor_total": {"$gt": 0},
+                "data_vencimento": {"$gte": desde},
+            }
+        },
+    ]
+    if user_id:
+        pipeline += [
+            {"$lookup": {"from": "cartoes", "localField": "cartao_id", "foreignField": "id", "as": "cartao"}},
+            {"$match": {"cartao.user_id": user_id}},
+        ]
+    pipeline.append(
+        {
+            "$project": {
+                "_id": 0,
+                "mes": {"$substrBytes": ["$data_vencimento", 0, 7]},
+                "valor": {"$subtract": ["$valor_total", {"$ifNull": ["$valor_pago", 0]}]},
+            }
+        }
+    )
+    return await db.faturas.aggregate(pipeline).to_list(length=None)
+
+
+async def _agendados(filtro_usuario: dict, hoje: str, ate: str) -> List[dict]:
+    """
+    Lançamentos futuros fora do crédito (o crédito já está nas faturas) e que
+    não são de fixos (os meses ainda não lançados vêm de `FixosCompilados`).
+    """
+    filtro = {
+        **filtro_usuario,
+        "data": {"$gt": hoje, "$lte": ate},
+        "forma": {"$ne": "credito"},
+        "origem": {"$ne": "fixo"},
+    }
+    pipeline = [
+        {"$match": filtro},
+        uniao_parcelas(filtro),
+        {
+            "$group": {
+                "_id": {"mes": {"$substrBytes": ["$data", 0, 7]}, "categoria": "$categoria", "tipo": "$tipo"},
+                "valor": {"$sum": "$valor"},
+            }
+        },
+    ]
+    return await db.lancamentos.aggregate(pipeline).to_list(length=None)
+
+
+async def _medias_historicas(filtro_usuario: dict, inicio_mes_atual: datetime) -> List[dict]:
+    """
+    Total por categoria/tipo nos últimos meses completos, sem fixos, parcelas
+    e pagamentos de fatura (que já entram por outras fontes).
+    """
+    inicio = inicio_mes_atual - relativedelta(months=PREVISAO_MESES_HISTORICO)
+    pagamentos = re.compile("|".join(re.escape(p) for p in PALAVRAS_PAGAMENTO_FATURA), re.IGNORECASE)
+    pipeline = [
+        {
+            "$match": {
+                **filtro_usuario,
+                "data": {"$gte": inicio.strftime("%Y-%m-%d"), "$lt": inicio_mes_atual.strftime("%Y-%m-%d")},
+                "origem": {"$nin": ["fixo", "parcela_futura"]},
+                "parcela_atual": {"$not": {"$gt": 1}},
+                "descricao": {"$not": pagamentos},
+            }
+        },
+        {"$group": {"_id": {"categoria": "$categoria", "tipo": "$tipo"}, "valor": {"$sum": "$valor"}}},
+    ]
+    return await db.lancamentos.aggregate(pipeline).to_list(length=None)
+
+
+async def calcular_previsao(meses: int = 12, user_id: Optional[str] = None) -> dict:
+    """
+    Saldo previsto ao fim de cada mês (do atual até `meses` - 1 à frente),
+    entradas/saídas por mês, quebra por categoria e por fonte.
+    """
+    if not 1 <= meses <= PREVISAO_MAX_MESES:
+        raise ValueError(f"'meses' deve estar entre 1 e {PREVISAO_MAX_MESES}")
+
+    em_cache = _previsoes_cache.get(user_id, {}).get(meses)
+    if em_cache is not None and time.monotonic() - em_cache[1] <= PREVISAO_CACHE_TTL:
+        return em_cache[0]
+
+    agora = datetime.now()
+    hoje = agora.strftime("%Y-%m-%d")
+    inicio_mes = agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    primeiro = agora.year * 12 + agora.month - 1
+    ultimo = primeiro + meses - 1
+    nomes_meses = [indice_para_mes(i) for i in range(primeiro, ultimo + 1)]
+    posicao_mes = {m: i for i, m in enumerate(nomes_meses)}
+    filtro_usuario = {"user_id": user_id} if user_id else {}
+
+    # fontes independentes, consultadas em paralelo
+    saldo_inicial, faturas, agendados, historico, fixos = await asyncio.gather(
+        _saldo_atual(filtro_usuario, hoje),
+        _faturas_a_pagar(user_id, agora),
+        _agendados(filtro_usuario, hoje, f"{nomes_meses[-1]}-31"),
+        _medias_historicas(filtro_usuario, inicio_mes),
+        _fixos_do_escopo(user_id),
+    )
+
+    # (mês, categoria, valor com sinal) de cada fonte, em vetores
+    categorias: Dict[str, int] = {}
+    linhas: List[int] = []
+    colunas: List[int] = []
+    valores: List[float] = []
+    por_fonte = {fonte: np.zeros(meses) for fonte in ("faturas", "agendados", "fixos", "media_historica")}
+
+    def adicionar(fonte: str, mes_idx: np.ndarray, categoria: List[str], valor: np.ndarray) -> None:
+        linhas.extend(mes_idx.tolist())
+        colunas.extend(categorias.setdefault(c, len(categorias)) for c in categoria)
+        valores.extend(valor.tolist())
+        np.add.at(por_fonte[fonte], mes_idx, valor)
+
+    # faturas: vencidas recentes entram no mês atual; além do horizonte, ficam de fora
+    fat = [
+        (0 if f["mes"] < nomes_meses[0] else posicao_mes[f["mes"]], f["valor"])
+        for f in faturas
+        if f["mes"] <= nomes_meses[-1]
+    ]
+    if fat:
+        idx, val = np.array(fat).T
+        adicionar("faturas", idx.astype(int), [CATEGORIA_CARTAO] * len(fat), -val)
+
+    agendados = [a["_id"] | {"valor": a["valor"]} for a in agendados if a["_id"]["mes"] in posicao_mes]
+    if agendados:
+        adicionar(
+            "agendados",
+            np.array([posicao_mes[a["mes"]] for a in agendados]),
+            [a.get("categoria") or "Outros" for a in agendados],
+            np.array([_sinal(a.get("tipo")) * a["valor"] for a in agendados]),
+        )
+
+    if fixos.fixos:
+        matriz = fixos.matriz(primeiro, ultimo, pendentes=True) * fixos.sinais[None, :]
+        mes_idx, fixo_idx = np.nonzero(matriz)
+        adicionar(
+            "fixos",
+            mes_idx,
+            [fixos.fixos[j].get("categoria") or "Outros" for j in fixo_idx],
+            matriz[mes_idx, fixo_idx],
+        )
+
+    if historico:
+        # média mensal de cada categoria, repetida em todos os meses
+        medias = np.array([_sinal(h["_id"].get("tipo")) * h["valor"] / PREVISAO_MESES_HISTORICO for h in historico])
+        nomes = [h["_id"].get("categoria") or "Outros" for h in historico]
+        # no mês atual, só a fração que ainda falta (o realizado já está no saldo)
+        fracao = np.ones(meses)
+        fracao[0] = 1 - (agora.day - 1) / calendar.monthrange(agora.year, agora.month)[1]
+        mes_idx = np.repeat(np.arange(meses), len(historico))
+        adicionar("media_historica", mes_idx, nomes * meses, np.tile(medias, meses) * fracao[mes_idx])
+
+    matriz_cat = np.zeros((meses, len(categorias)))
+    if valores:
+        np.add.at(matriz_cat, (np.array(linhas), np.array(colunas)), np.array(valores))
+
+    entradas = np.where(matriz_cat > 0, matriz_cat, 0).sum(axis=1)
+    saidas = -np.where(matriz_cat < 0, matriz_cat, 0).sum(axis=1)
+    saldo = saldo_inicial + np.cumsum(entradas - saidas)
+
+    previsao = {
+        "meses": nomes_meses,
+        "saldo_inicial": round(saldo_inicial, 2),
+        "entradas": np.round(entradas, 2).tolist(),
+        "saidas": np.round(saidas, 2).tolist(),
+        "saldo": np.round(saldo, 2).tolist(),
+        "por_categoria": {nome: np.round(matriz_cat[:, j], 2).tolist() for nome, j in categorias.items()},
+        "por_fonte": {fonte: np.round(v, 2).tolist() for fonte, v in por_fonte.items()},
+        "calculado_em": agora.isoformat(),
+    }
+    _previsoes_cache.setdefault(user_id, {})[meses] = (previsao, time.monotonic())
+    return previsao
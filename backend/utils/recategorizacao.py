@@ -0,0 +1,190 @@
+"""
+Job de recategorização completa de `lancamentos`.
+
+Funciona em duas fases, ambas em lotes e retomáveis a partir de checkpoint:
+1. Prévia: passa todos os lançamentos pelo motor de regras atual e acumula um
+   diff por regra (quantos mudariam, de quais categorias, amostra).
+2. Aplicação: repassa os lançamentos e grava, com `bulk_write` por lote, apenas
+   as mudanças das regras aceitas.
+
+A memória usada é O(lote + número de regras); o checkpoint é o último `_id`
+processado, salvo no documento da tarefa a cada lote, junto dos usuários já
+alterados: ao fim, os contadores de `metas_consumo` desses usuários são
+reconstruídos e os caches agrupados por categoria descartados.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from pymongo import UpdateOne
+
+from server import db
+from utils.categorizacao import RegrasCompiladas, carregar_regras, categorizar_com_origem
+from utils.metas import reconstruir_consumo
+from utils.pivot import invalidar_pivot
+from utils.previsao import invalidar_previsao
+from utils.tarefas import atualizar_progresso, concluir_tarefa, falhar_tarefa, obter_tarefa
+
+RECATEGORIZACAO_LOTE = 2000
+DIFF_AMOSTRA = 5
+
+_PROJECAO = {"_id": 1, "id": 1, "user_id": 1, "descricao": 1, "categoria": 1}
+
+
+async def categorias_alteradas(user_ids: Iterable[Optional[str]]) -> None:
+    """
+    Depois de mudar `categoria` em lote: refaz os contadores de consumo das
+    metas dos usuários afetados e descarta pivot e previsão.
+    """
+    for user_id in set(user_ids):
+        await reconstruir_consumo(user_id)
+    invalidar_pivot()
+    invalidar_previsao()
+
+
+def _diff_para_lista(diff: Dict[str, dict]) -> List[dict]:
+    """Serializa o diff (chaves de categoria podem ter caracteres inválidos no Mongo)."""
+    return sorted(
+        (
+            {
+                "regra": chave,
+                "categoria_nova": item["categoria_nova"],
+                "total": item["total"],
+                "de": [{"categoria": c, "total": n} for c, n in item["de"].items()],
+                "amostra": item["amostra"],
+            }
+            for chave, item in diff.items()
+        ),
+        key=lambda x: x["total"],
+        reverse=True,
+    )
+
+
+def _diff_de_lista(itens: List[dict]) -> Dict[str, dict]:
+    return {
+        item["regra"]: {
+            "categoria_nova": item["categoria_nova"],
+            "total": item["total"],
+            "de": {d["categoria"]: d["total"] for d in item["de"]},
+            "amostra": item["amostra"],
+        }
+        for item in itens
+    }
+
+
+async def _lotes(ultimo_id):
+    """Percorre `lancamentos` em ordem de `_id`, a partir do checkpoint, em lotes."""
+    filtro = {"_id": {"$gt": ultimo_id}} if ultimo_id is not None else {}
+    cursor = db.lancamentos.find(filtro, _PROJECAO).sort("_id", 1).batch_size(RECATEGORIZACAO_LOTE)
+
+    lote: List[dict] = []
+    async for doc in cursor:
+        lote.append(doc)
+        if len(lote) >= RECATEGORIZACAO_LOTE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+async def _regras_do_lote(lote: List[dict]) -> Dict[Optional[str], RegrasCompiladas]:
+    """Regras compiladas de cada usuário presente no lote (cada lançamento usa as do seu dono)."""
+    return {uid: await carregar_regras(uid) for uid in {doc.get("user_id") for doc in lote}}
+
+
+async def gerar_previa(tarefa_id: str) -> None:
+    """Fase 1: calcula o diff por regra sem gravar nada em `lancamentos`."""
+    try:
+        tarefa = await obter_tarefa(tarefa_id) or {}
+        ultimo_id = tarefa.get("checkpoint")
+        processados = tarefa.get("processados", 0)
+        diff = _diff_de_lista(tarefa.get("diff") or [])
+
+        async for lote in _lotes(ultimo_id):
+            regras = await _regras_do_lote(lote)
+            for doc in lote:
+                resultado = categorizar_com_origem(
+                    regras[doc.get("user_id")], str(doc.get("descricao", ""))
+                )
+                if not resultado:
+                    continue
+                categoria_nova, chave = resultado
+                categoria_atual = doc.get("categoria") or "Outros"
+                if categoria_nova == categoria_atual:
+                    continue
+
+                item = diff.setdefault(
+                    chave, {"categoria_nova": categoria_nova, "total": 0, "de": {}, "amostra": []}
+                )
+                item["total"] += 1
+                item["de"][categoria_atual] = item["de"].get(categoria_atual, 0) + 1
+                if len(item["amostra"]) < DIFF_AMOSTRA:
+                    item["amostra"].append({"id": doc.get("id"), "descricao": doc.get("descricao")})
+
+            processados += len(lote)
+            ultimo_id = lote[-1]["_id"]
+            await atualizar_progresso(
+                tarefa_id, processados, checkpoint=ultimo_id, diff=_diff_para_lista(diff)
+            )
+
+        await concluir_tarefa(
+            tarefa_id,
+            {
+                "alteracoes": sum(item["total"] for item in diff.values()),
+                "diff": _diff_para_lista(diff),
+            },
+        )
+    except Exception as e:
+        await falhar_tarefa(tarefa_id, str(e))
+
+
+async def aplicar_previa(tarefa_id: str, regras_aceitas: Set[str]) -> None:
+    """
+    Fase 2: grava as mudanças das regras aceitas.
+    O filtro de cada UpdateOne inclui a categoria lida, então edições feitas
+    entre a leitura e a escrita não são sobrescritas.
+    """
+    try:
+        tarefa = await obter_tarefa(tarefa_id) or {}
+        ultimo_id = tarefa.get("checkpoint")
+        processados = tarefa.get("processados", 0)
+        atualizados = tarefa.get("atualizados", 0)
+        usuarios = set(tarefa.get("usuarios") or [])
+
+        async for lote in _lotes(ultimo_id):
+            regras = await _regras_do_lote(lote)
+            operacoes: List[UpdateOne] = []
+            for doc in lote:
+                resultado = categorizar_com_origem(
+                    regras[doc.get("user_id")], str(doc.get("descricao", ""))
+                )
+                if not resultado:
+                    continue
+                categoria_nova, chave = resultado
+                categoria_atual: Optional[str] = doc.get("categoria")
+                if chave not in regras_aceitas or categoria_nova == (categoria_atual or "Outros"):
+                    continue
+                operacoes.append(
+                    UpdateOne(
+                        {"_id": doc["_id"], "categoria": categoria_atual},
+                        {"$set": {"categoria": categoria_nova}},
+                    )
+                )
+
+                usuarios.add(doc.get("user_id"))
+
+            if operacoes:
+                res = await db.lancamentos.bulk_write(operacoes, ordered=False)
+                atualizados += res.modified_count
+
+            processados += len(lote)
+            ultimo_id = lote[-1]["_id"]
+            await atualizar_progresso(
+                tarefa_id, processados, checkpoint=ultimo_id, atualizados=atualizados, usuarios=list(usuarios)
+            )
+
+        await categorias_alteradas(usuarios)
+        await concluir_tarefa(tarefa_id, {"atualizados": atualizados})
+    except Exception as e:
+        await falhar_tarefa(tarefa_id, str(e))
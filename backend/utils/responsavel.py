@@ -1,28 +1,178 @@
 from __future__ import annotations
-from typing import Optional
+
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set
+
 from models.importacao import TransacaoExtraida
+from server import db
 
 
 # Mapeamento de nomes/palavras-chave para responsável
 RESPONSAVEL_POR_DESCRICAO = {
     # Aluguel
     "albino": "Davi",
-    
+
     # Baba
     "sheila": "Davi",
-    
+
     # Transferências internas (já detectadas como duplicatas, mas marcar responsável)
     "ana jullya": "Ana",
     "ana lima": "Ana",
     "davi miranda": "Davi",
     "davi stark": "Davi",
-    
+
     # PIX de bico (quem recebe)
     "joão victor amaral": "Davi",
     "joao victor amaral": "Davi",
     "victor amaral": "Davi",
 }
 
+# Índice de histórico: só sugere quando há evidência suficiente e majoritária
+HISTORICO_MIN_OCORRENCIAS = 2
+HISTORICO_MIN_PROPORCAO = 0.6
+HISTORICO_TTL = 3600  # segundos até reconstruir (captura escritas de outros workers)
+HISTORICO_CACHE_MAX_USUARIOS = 256  # usuários com índice em memória
+
+# Palavras que aparecem em quase toda descrição de extrato e não ajudam a decidir
+_PALAVRAS_IGNORADAS = {
+    "pix", "enviado", "recebido", "compra", "debito", "credito", "cartao", "pagamento",
+    "transferencia", "parcela", "com", "para", "dos", "das", "ltda", "online",
+}
+
+
+def _tokens(descricao: str) -> Set[str]:
+    """Tokens normalizados (sem acento, minúsculos, só letras, 3+ caracteres)."""
+    texto = unicodedata.normalize("NFKD", descricao.lower())
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    return {tok for tok in re.findall(r"[a-z]{3,}", texto) if tok not in _PALAVRAS_IGNORADAS}
+
+
+class IndiceResponsavel:
+    """
+    Frequência de responsáveis por token de descrição, aprendida do histórico.
+
+    Representação compacta: cada responsável ganha um índice inteiro e cada
+    token guarda uma lista de contagens nessa ordem (normalmente 2-3 posições).
+    """
+
+    __slots__ = ("responsaveis", "_posicao", "contagens")
+
+    def __init__(self):
+        self.responsaveis: List[str] = []
+        self._posicao: Dict[str, int] = {}
+        self.contagens: Dict[str, List[int]] = {}
+
+    def _indice(self, responsavel: str) -> int:
+        posicao = self._posicao.get(responsavel)
+        if posicao is None:
+            posicao = len(self.responsaveis)
+            self.responsaveis.append(responsavel)
+            self._posicao[responsavel] = posicao
+        return posicao
+
+    def registrar(self, descricao: str, responsavel: Optional[str], delta: int = 1) -> None:
+        """Soma (ou subtrai, com delta negativo) uma ocorrência do responsável."""
+        if not responsavel or not descricao:
+            return
+        posicao = self._indice(responsavel)
+        for tok in _tokens(descricao):
+            contagem = self.contagens.get(tok)
+            if contagem is None:
+                if delta <= 0:
+                    continue
+                contagem = self.contagens[tok] = []
+            if len(contagem) <= posicao:
+                contagem.extend([0] * (posicao + 1 - len(contagem)))
+            contagem[posicao] = max(0, contagem[posicao] + delta)
+
+    def sugerir(self, descricao: str) -> Optional[str]:
+        """
+        Vota com a distribuição de cada token da descrição.
+        Retorna o responsável majoritário ou None se a evidência for fraca.
+        """
+        votos = [0.0] * len(self.responsaveis)
+        ocorrencias = 0
+        for tok in _tokens(descricao):
+            contagem = self.contagens.get(tok)
+            if not contagem:
+                continue
+            total = sum(contagem)
+            if total == 0:
+                continue
+            ocorrencias += total
+            for posicao, n in enumerate(contagem):
+                votos[posicao] += n / total
+
+        if ocorrencias < HISTORICO_MIN_OCORRENCIAS or not any(votos):
+            return None
+
+        melhor = max(range(len(votos)), key=votos.__getitem__)
+        if votos[melhor] / sum(votos) < HISTORICO_MIN_PROPORCAO:
+            return None
+        return self.responsaveis[melhor]
+
+
+# Cache LRU: user_id -> (índice, construído_em); None é o índice de todos os lançamentos
+_indices: "OrderedDict[Optional[str], tuple]" = OrderedDict()
+
+
+async def obter_indice_responsavel(user_id: Optional[str] = None) -> IndiceResponsavel:
+    """
+    Índice do usuário, construído uma vez a partir de `lancamentos` e depois
+    mantido por `registrar_responsavel`. Reconstruído a cada HISTORICO_TTL;
+    com mais de HISTORICO_CACHE_MAX_USUARIOS usuários, os menos usados
+    recentemente são descartados.
+
+    Sem `user_id` (o frontend ainda não o envia na importação nem no CRUD), o
+    índice é aprendido de todos os lançamentos, com ou sem usuário.
+    """
+    entrada = _indices.get(user_id)
+    agora = time.monotonic()
+    if entrada is not None and agora - entrada[1] <= HISTORICO_TTL:
+        _indices.move_to_end(user_id)
+        return entrada[0]
+
+    indice = IndiceResponsavel()
+    filtro: dict = {"responsavel": {"$nin": [None, ""]}}
+    if user_id is not None:
+        filtro["user_id"] = user_id
+    cursor = db.lancamentos.find(
+        filtro,
+        {"_id": 0, "descricao": 1, "responsavel": 1},
+    )
+    async for doc in cursor:
+        indice.registrar(str(doc.get("descricao", "")), doc.get("responsavel"))
+
+    _indices[user_id] = (indice, agora)
+    _indices.move_to_end(user_id)
+    while len(_indices) > HISTORICO_CACHE_MAX_USUARIOS:
+        _indices.popitem(last=False)
+    return indice
+
+
+def registrar_responsavel(docs: Iterable[dict], delta: int = 1) -> None:
+    """
+    Atualiza incrementalmente os índices já carregados com lançamentos
+    inseridos (delta=1) ou removidos (delta=-1). Índices ainda não carregados
+    serão construídos do banco quando forem usados, já com esses documentos.
+    """
+    for doc in docs:
+        # o índice do dono e o de todos os lançamentos (chave None)
+        for chave in {doc.get("user_id"), None}:
+            entrada = _indices.get(chave)
+            if entrada is not None:
+                entrada[0].registrar(str(doc.get("descricao", "")), doc.get("responsavel"), delta)
+
+
+def _responsavel_por_palavra(desc_lower: str) -> Optional[str]:
+    for palavra, responsavel in RESPONSAVEL_POR_DESCRICAO.items():
+        if palavra in desc_lower:
+            return responsavel
+    return None
+
 
 def detectar_responsavel(transacao: TransacaoExtraida) -> Optional[str]:
     """
@@ -30,21 +180,31 @@ def detectar_responsavel(transacao: TransacaoExtraida) -> Optional[str]:
     Retorna 'Davi', 'Ana' ou None.
     """
     desc_lower = transacao.descricao.lower()
-    
+
     # Se for entrada (recebimento), geralmente é do Davi (bicos)
     if transacao.tipo == "entrada":
         # Verificar se é PIX de bico
-        for palavra, responsavel in RESPONSAVEL_POR_DESCRICAO.items():
-            if palavra in desc_lower:
-                return responsavel
+        responsavel = _responsavel_por_palavra(desc_lower)
         # Se não encontrou, mas é entrada, provavelmente é do Davi
-        return "Davi"
-    
+        return responsavel or "Davi"
+
     # Se for saída (gasto), verificar descrição
-    for palavra, responsavel in RESPONSAVEL_POR_DESCRICAO.items():
-        if palavra in desc_lower:
-            return responsavel
-    
     # Se não encontrou nada, retorna None (usuário pode definir depois)
-    return None
+    return _responsavel_por_palavra(desc_lower)
+
+
+async def sugerir_responsavel(transacao: TransacaoExtraida) -> Optional[str]:
+    """
+    Como `detectar_responsavel`, mas consulta o histórico do usuário antes dos
+    fallbacks: palavras conhecidas > histórico > entrada é do Davi.
+    """
+    responsavel = _responsavel_por_palavra(transacao.descricao.lower())
+    if responsavel:
+        return responsavel
+
+    indice = await obter_indice_responsavel(transacao.user_id)
+    responsavel = indice.sugerir(transacao.descricao)
+    if responsavel:
+        return responsavel
 
+    return detectar_responsavel(transacao)
@@ -0,0 +1,210 @@
+"""
+Livro de saldos diários por usuário.
+
+No Mongo, `saldos_diarios` guarda um documento por (usuário, ano) com o saldo
+líquido de cada dia (`deltas.MM-DD`), atualizado com `$inc` a cada escrita de
+lançamento: O(1) por escrita e seguro com vários workers.
+
+Em memória, `LedgerSaldo` mantém, por usuário, os dias com movimento e as
+somas acumuladas (prefix sums) em vetores NumPy ordenados. O saldo numa data
+é uma busca binária (O(log n)); uma série diária sai em O(dias) a partir do
+saldo do dia anterior ao intervalo. As escritas deste worker ajustam o sufixo
+das somas; as de outros workers entram no recarregamento (SALDOS_CACHE_TTL).
+
+Só entram lançamentos fora do crédito (compras no crédito saem do caixa no
+pagamento da fatura), como na previsão de fluxo de caixa, e nunca parcelas
+virtuais (`parcela_futura`), nem quando uma delas é separada do plano.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from pymongo import DeleteMany, InsertOne, UpdateOne
+
+from server import db
+
+SALDOS_CACHE_TTL = 300
+
+_EPOCA = date(1970, 1, 1)
+_DATA_ISO = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def dia_para_indice(data: str) -> int:
+    """'YYYY-MM-DD' -> dias desde 1970-01-01. ValueError se a data for inválida."""
+    return (date.fromisoformat(data[:10]) - _EPOCA).days
+
+
+def indice_para_dia(indice: int) -> str:
+    return (_EPOCA + timedelta(days=int(indice))).isoformat()
+
+
+def data_valida(data) -> bool:
+    """`data` começa com uma data YYYY-MM-DD existente (outros formatos não entram no livro)."""
+    if not isinstance(data, str) or not _DATA_ISO.match(data):
+        return False
+    try:
+        dia_para_indice(data)
+    except ValueError:
+        return False
+    return True
+
+
+def _contribui_para_saldo(doc: dict) -> bool:
+    # parcelas futuras (virtuais) ainda não saíram do caixa
+    return (
+        doc.get("forma") != "credito"
+        and doc.get("origem") != "parcela_futura"
+        and data_valida(doc.get("data"))
+    )
+
+
+def _valor_com_sinal(doc: dict) -> float:
+    valor = float(doc.get("valor", 0) or 0)
+    return valor if doc.get("tipo") == "entrada" else -valor
+
+
+class LedgerSaldo:
+    """Dias com movimento (ordenados) e saldo acumulado até cada um deles."""
+
+    __slots__ = ("dias", "acumulado")
+
+    def __init__(self, dias: np.ndarray, deltas: np.ndarray):
+        ordem = np.argsort(dias, kind="stable")
+        self.dias = dias[ordem].astype(np.int64)
+        self.acumulado = np.cumsum(deltas[ordem].astype(np.float64))
+
+    def aplicar(self, dia: int, valor: float) -> None:
+        """Soma `valor` ao movimento de `dia`: ajusta as somas do dia em diante."""
+        i = int(np.searchsorted(self.dias, dia))
+        if i == len(self.dias) or self.dias[i] != dia:
+            anterior = self.acumulado[i - 1] if i else 0.0
+            self.dias = np.insert(self.dias, i, dia)
+            self.acumulado = np.insert(self.acumulado, i, anterior)
+        self.acumulado[i:] += valor
+
+    def saldo_em(self, dia: int) -> float:
+        """Saldo ao fim de `dia` (busca binária)."""
+        i = int(np.searchsorted(self.dias, dia, side="right"))
+        return float(self.acumulado[i - 1]) if i else 0.0
+
+    def serie(self, de: int, ate: int) -> np.ndarray:
+        """Saldo ao fim de cada dia de `de` a `ate`."""
+        inicial = self.saldo_em(de - 1)
+        lo = int(np.searchsorted(self.dias, de))
+        hi = int(np.searchsorted(self.dias, ate, side="right"))
+        acumulado = self.acumulado[lo:hi]
+        movimentos = np.zeros(ate - de + 1)
+        movimentos[self.dias[lo:hi] - de] = np.diff(acumulado, prepend=inicial)
+        return inicial + np.cumsum(movimentos)
+
+
+# user_id -> (LedgerSaldo, carregado_em); None agrupa lançamentos sem usuário
+_ledgers: Dict[Optional[str], tuple] = {}
+
+
+def invalidar_saldos(*user_ids: Optional[str]) -> None:
+    """Descarta os ledgers dos usuários informados (ou de todos, sem argumentos)."""
+    if not user_ids:
+        _ledgers.clear()
+        return
+    for user_id in user_ids:
+        _ledgers.pop(user_id, None)
+
+
+async def obter_ledger(user_id: Optional[str] = None) -> LedgerSaldo:
+    """Ledger do usuário, montado de `saldos_diarios` e mantido pelas escritas."""
+    entrada = _ledgers.get(user_id)
+    if entrada is not None and time.monotonic() - entrada[1] <= SALDOS_CACHE_TTL:
+        return entrada[0]
+
+    dias: List[int] = []
+    deltas: List[float] = []
+    async for doc in db.saldos_diarios.find({"user_id": user_id}, {"_id": 0, "ano": 1, "deltas": 1}):
+        for mes_dia, valor in (doc.get("deltas") or {}).items():
+            data = f"{doc.get('ano')}-{mes_dia}"
+            if data_valida(data):
+                dias.append(dia_para_indice(data))
+                deltas.append(valor)
+
+    ledger = LedgerSaldo(np.array(dias, dtype=np.int64), np.array(deltas, dtype=np.float64))
+    _ledgers[user_id] = (ledger, time.monotonic())
+    return ledger
+
+
+async def registrar_em_saldos(docs: Iterable[dict], delta: int = 1) -> None:
+    """
+    Soma (delta=1) ou subtrai (delta=-1) os lançamentos no saldo de cada dia:
+    um `$inc` por (usuário, ano, dia), todos num bulk_write. Os ledgers já
+    carregados são ajustados no lugar.
+    """
+    movimentos: Dict[tuple, float] = defaultdict(float)
+    for doc in docs:
+        if _contribui_para_saldo(doc):
+            movimentos[(doc.get("user_id"), doc["data"][:10])] += delta * _valor_com_sinal(doc)
+    movimentos = {chave: valor for chave, valor in movimentos.items() if valor}
+    if not movimentos:
+        return
+
+    await db.saldos_diarios.bulk_write(
+        [
+            UpdateOne(
+                {"user_id": user_id, "ano": data[:4]},
+                {"$inc": {f"deltas.{data[5:]}": valor}},
+                upsert=True,
+            )
+            for (user_id, data), valor in movimentos.items()
+        ],
+        ordered=False,
+    )
+
+    for (user_id, data), valor in movimentos.items():
+        entrada = _ledgers.get(user_id)
+        if entrada is not None:
+            entrada[0].aplicar(dia_para_indice(data), valor)
+
+
+async def reconstruir_saldos(user_id: Optional[str] = None, todos: bool = False) -> dict:
+    """
+    Recalcula `saldos_diarios` a partir de `lancamentos` (de um usuário ou,
+    com `todos=True`, de todos) numa agregação, e descarta os ledgers em memória.
+    """
+    filtro_usuario = {} if todos else {"user_id": user_id}
+    pipeline = [
+        {
+            "$match": {
+                **filtro_usuario,
+                "forma": {"$ne": "credito"},
+                "origem": {"$ne": "parcela_futura"},
+                "data": {"$regex": _DATA_ISO.pattern},
+            }
+        },
+        {
+            "$group": {
+                # sem `user_id` e `user_id: null` são o mesmo dono (um documento só por ano)
+                "_id": {"user_id": {"$ifNull": ["$user_id", None]}, "data": {"$substrBytes": ["$data", 0, 10]}},
+                "valor": {"$sum": {"$cond": [{"$eq": ["$tipo", "entrada"]}, "$valor", {"$multiply": ["$valor", -1]}]}},
+            }
+        },
+    ]
+    por_ano: Dict[tuple, Dict[str, float]] = defaultdict(dict)
+    async for item in db.lancamentos.aggregate(pipeline, allowDiskUse=True):
+        data = item["_id"]["data"]
+        if item["valor"] and data_valida(data):
+            por_ano[(item["_id"].get("user_id"), data[:4])][data[5:]] = item["valor"]
+
+    operacoes = [DeleteMany(filtro_usuario)] + [
+        InsertOne({"user_id": uid, "ano": ano, "deltas": deltas}) for (uid, ano), deltas in por_ano.items()
+    ]
+    await db.saldos_diarios.bulk_write(operacoes, ordered=True)
+
+    if todos:
+        invalidar_saldos()
+    else:
+        invalidar_saldos(user_id)
+    return {"documentos": len(por_ano), "dias": sum(len(d) for d in por_ano.values())}
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from server import db
+
+logger = logging.getLogger(__name__)
+
+TAREFA_INATIVA_SEGUNDOS = 600  # "executando" sem progresso há mais tempo: worker caiu
+
+
+async def criar_tarefa(tipo: str, total: int, parametros: Optional[dict] = None) -> str:
+    """
+    Registra uma tarefa de longa duração em `tarefas` e retorna seu id.
+    O documento é usado para acompanhar o progresso via /api/tarefas/{id}.
+    """
+    tarefa_id = str(uuid.uuid4())
+    await db.tarefas.insert_one(
+        {
+            "id": tarefa_id,
+            "tipo": tipo,
+            "status": "executando",
+            "total": total,
+            "processados": 0,
+            "parametros": parametros or {},
+            "resultado": None,
+            "erro": None,
+            "criado_em": datetime.utcnow(),
+            "atualizado_em": datetime.utcnow(),
+        }
+    )
+    return tarefa_id
+
+
+async def atualizar_progresso(tarefa_id: str, processados: int, **extras) -> None:
+    await db.tarefas.update_one(
+        {"id": tarefa_id},
+        {"$set": {"processados": processados, "atualizado_em": datetime.utcnow(), **extras}},
+    )
+
+
+async def concluir_tarefa(tarefa_id: str, resultado: Optional[dict] = None) -> None:
+    await db.tarefas.update_one(
+        {"id": tarefa_id},
+        {"$set": {"status": "concluida", "resultado": resultado, "atualizado_em": datetime.utcnow()}},
+    )
+
+
+async def falhar_tarefa(tarefa_id: str, erro: str) -> None:
+    logger.error(f"Tarefa {tarefa_id} falhou: {erro}")
+    await db.tarefas.update_one(
+        {"id": tarefa_id},
+        {"$set": {"status": "erro", "erro": erro, "atualizado_em": datetime.utcnow()}},
+    )
+
+
+async def obter_tarefa(tarefa_id: str) -> Optional[dict]:
+    return await db.tarefas.find_one({"id": tarefa_id}, {"_id": 0})
+
+
+async def interromper_tarefas_inativas() -> dict:
+    """
+    Marca como `interrompida` as tarefas "executando" sem progresso há
+    TAREFA_INATIVA_SEGUNDOS (o worker que as executava caiu ou reiniciou).
+    Roda na inicialização e periodicamente no agendador.
+    """
+    agora = datetime.utcnow()
+    resultado = await db.tarefas.update_many(
+        {"status": "executando", "atualizado_em": {"$lt": agora - timedelta(seconds=TAREFA_INATIVA_SEGUNDOS)}},
+        {"$set": {"status": "interrompida", "atualizado_em": agora}},
+    )
+    return {"interrompidas": resultado.modified_count}
+
+
+async def reabrir_tarefa(tarefa_id: str) -> bool:
+    """
+    Marca uma tarefa interrompida como em execução para retomá-la do checkpoint.
+    Só reabre tarefas com erro, interrompidas ou "executando" sem progresso há
+    TAREFA_INATIVA_SEGUNDOS (worker que caiu). A troca de status é atômica:
+    retorna False se a tarefa não pode ser retomada ou outro pedido já a reabriu.
+    """
+    agora = datetime.utcnow()
+    reaberta = await db.tarefas.find_one_and_update(
+        {
+            "id": tarefa_id,
+            "$or": [
+                {"status": {"$in": ["erro", "interrompida"]}},
+                {
+                    "status": "executando",
+                    "atualizado_em": {"$lt": agora - timedelta(seconds=TAREFA_INATIVA_SEGUNDOS)},
+                },
+            ],
+        },
+        {"$set": {"status": "executando", "erro": None, "atualizado_em": agora}},
+    )
+    return reaberta is not None
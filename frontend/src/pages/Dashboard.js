@@ -144,64 +144,7 @@ export default function Dashboard() {
     return () => window.removeEventListener('keydown', handleKeyDown);
   }, [showGlobalSearch]);
 
-  // Auto-generate lancamentos from fixos
-  useEffect(() => {
-    const runGerarLancamentos = async () => {
-      if (periodoTipo === "mes" && periodoMes && !loading) {
-        await gerarLancamentosDoMes(periodoMes);
-      }
-    };
-    runGerarLancamentos();
-  }, [fixos, periodoMes, periodoTipo, loading]);
-
-  const gerarLancamentosDoMes = async (mesSelecionado) => {
-    const [ano, mes] = mesSelecionado.split('-').map(Number);
-    const fixosAtivos = fixos.filter(f => {
-      if (!f.ativo) return false;
-      const [anoInicio, mesInicio] = f.mesInicio.split('-').map(Number);
-      if (ano < anoInicio || (ano === anoInicio && mes < mesInicio)) return false;
-      if (f.mesFim) {
-        const [anoFim, mesFim] = f.mesFim.split('-').map(Number);
-        if (ano > anoFim || (ano === anoFim && mes > mesFim)) return false;
-      }
-      return true;
-    });
-
-    const novosLancamentosParaCriar = [];
-    for (const fixo of fixosAtivos) {
-      const diaValido = Math.min(fixo.diaVencimento, new Date(ano, mes, 0).getDate());
-      const dataLancamento = `${ano}-${String(mes).padStart(2, '0')}-${String(diaValido).padStart(2, '0')}`;
-      
-      const jaExiste = lancamentos.some(l => 
-        l.origem === 'fixo' && 
-        l.descricao === fixo.descricao && 
-        l.data.startsWith(mesSelecionado)
-      );
-
-      if (!jaExiste) {
-        novosLancamentosParaCriar.push({
-          data: dataLancamento,
-          descricao: fixo.descricao,
-          categoria: fixo.categoria,
-          tipo: fixo.tipo,
-          valor: fixo.valor,
-          forma: 'boleto',
-          origem: 'fixo',
-          observacao: `Gerado automaticamente de: ${fixo.descricao}`
-        });
-      }
-    }
-
-    if (novosLancamentosParaCriar.length > 0) {
-      try {
-        await Promise.all(novosLancamentosParaCriar.map(createLancamento));
-        toast.info(`${novosLancamentosParaCriar.length} lançamento(s) gerado(s) a partir das contas fixas.`);
-        await fetchData(); // Re-fetch data after auto-generation
-      } catch (error) {
-        toast.error("Erro ao gerar lançamentos automáticos.");
-      }
-    }
-  };
+  // Lançamentos dos fixos são gravados no servidor (rotina `fixos_lancamentos`)
 
   // Filter lancamentos by period
   const lancamentosFiltrados = useMemo(() => {
@@ -190,7 +190,7 @@ export default function FaturasCartao() {
                   <div className="flex items-center justify-between">
                     <div>
                       <p className="text-sm text-slate-400">
-                        {fatura.lancamentos?.length || fatura.lancamentos_ids?.length || 0}{" "}
+                        {fatura.quantidade ?? (fatura.lancamentos?.length || fatura.lancamentos_ids?.length || 0)}{" "}
                         lançamento(s)
                       </p>
                     </div>